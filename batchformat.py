@@ -0,0 +1,170 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Format all entries of a BibTeX file as references without the GUI.
+
+    Usage:
+        python batchformat.py library.bib -o references.html --format html --processes 4
+
+    Entries are parsed and formatted chunk by chunk, optionally in a pool
+    of worker processes, and written as plain text, HTML or JSON lines.
+    Entries which cannot be formatted are collected in a report instead of
+    being printed one by one.
+"""
+
+import io
+import sys
+import json
+import argparse
+import multiprocessing
+from xml.sax.saxutils import escape
+
+import formatting
+import loader
+
+__author__ = 'Jens-Kristian Krogager'
+
+output_formats = ['text', 'html', 'jsonl']
+# Smaller texts are formatted in one process, starting the pool takes longer:
+min_parallel_size = 1000000
+
+
+class FormatReport(object):
+    """ Summary of a batch run: number of entries and entries that could not be formatted. """
+
+    def __init__(self):
+        self.n_entries = 0
+        self.unknown_types = dict()
+        self.errors = list()
+
+    def add(self, n_entries, unknown_types, errors):
+        self.n_entries += n_entries
+        for key, entry_type in unknown_types:
+            self.unknown_types.setdefault(entry_type, []).append(key)
+        self.errors.extend(errors)
+
+    def as_dict(self):
+        return {'entries': self.n_entries,
+                'unknown_types': self.unknown_types,
+                'errors': [{'key': key, 'error': error} for key, error in self.errors]}
+
+    def summary(self):
+        lines = [u"Formatted %i entries" % self.n_entries]
+        for entry_type, keys in sorted(self.unknown_types.items()):
+            lines.append(u"  Reference format not defined for type '%s': %i entries"
+                         % (entry_type, len(keys)))
+        if self.errors:
+            lines.append(u"  Entries which could not be formatted: %i" % len(self.errors))
+        return u'\n'.join(lines)
+
+
+def format_database(bib_database, Nshow=3, Nmax=8):
+    """
+    Format all entries of a BibliographyData.
+    Returns a list of (key, entry_type, reference), the (key, type) of
+    entries with an unknown type and the (key, error) of failed entries.
+    An entry which cannot be formatted does not stop the others.
+    """
+    references = list()
+    unknown_types = list()
+    errors = list()
+    for key, bib_entry in bib_database.entries.items():
+        try:
+            ref = formatting.format_reference(bib_entry, Nshow, Nmax, warnings=unknown_types)
+        except KeyError as error:
+            errors.append((key, u"missing field: %s" % error.args[0]))
+            continue
+        except Exception as error:
+            errors.append((key, u"%s: %s" % (type(error).__name__, error)))
+            continue
+        references.append((key, bib_entry.type, ref))
+    return references, unknown_types, errors
+
+
+def format_job(job):
+    """ Parse and format a job of loader.chunk_jobs() in a worker process. """
+    return format_database(loader.parse_job(job))
+
+
+def iter_formatted(text, processes=1, chunk_size=1000000):
+    """
+    Yield the output of format_database() for each chunk of `text`, in order.
+    `processes` worker processes (None: number of CPUs) are only used for
+    texts of at least `min_parallel_size` characters.
+    """
+    if processes == 1 or len(text) < min_parallel_size:
+        for chunk_database, end in loader.iter_batches(text, chunk_size):
+            yield format_database(chunk_database)
+        return
+
+    # At least one chunk for each process:
+    chunk_size = min(chunk_size, len(text) // (processes or multiprocessing.cpu_count()) + 1)
+    jobs, ends = loader.chunk_jobs(text, chunk_size)
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap(format_job, jobs):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def write_reference(output, output_format, key, entry_type, ref):
+    if output_format == 'html':
+        output.write(u'  <li id="%s">%s</li>\n' % (escape(key, {'"': '&quot;'}), escape(ref)))
+    elif output_format == 'jsonl':
+        record = {'key': key, 'type': entry_type, 'reference': ref}
+        output.write(json.dumps(record, ensure_ascii=False) + u'\n')
+    else:
+        output.write(ref + u'\n')
+
+
+def format_file(filename, output, output_format='text', processes=1, chunk_size=1000000):
+    """
+    Format every entry of the BibTeX file `filename` and write the
+    references to the unicode stream `output`. Returns a FormatReport.
+    """
+    if output_format not in output_formats:
+        raise ValueError("Unknown output format: %s" % output_format)
+
+    report = FormatReport()
+    text = loader.read_bibtex(filename)
+    if output_format == 'html':
+        output.write(u'<ul>\n')
+    for references, unknown_types, errors in iter_formatted(text, processes, chunk_size):
+        for key, entry_type, ref in references:
+            write_reference(output, output_format, key, entry_type, ref)
+        report.add(len(references), unknown_types, errors)
+    if output_format == 'html':
+        output.write(u'</ul>\n')
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Format the entries of a BibTeX file as references")
+    parser.add_argument('filename', help="BibTeX file")
+    parser.add_argument('-o', '--output', default=None, help="Output file (default: stdout)")
+    parser.add_argument('-f', '--format', default='text', choices=output_formats)
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help="Number of worker processes, 0 to use all CPUs (default: 1)")
+    parser.add_argument('--report', default=None,
+                        help="Write the report of unformatted entries to this JSON file")
+    args = parser.parse_args()
+
+    processes = args.processes if args.processes > 0 else None
+    if args.output:
+        output = io.open(args.output, 'w', encoding='utf-8')
+    else:
+        output = io.open(sys.stdout.fileno(), 'w', encoding='utf-8', closefd=False)
+    with output:
+        report = format_file(args.filename, output, args.format, processes)
+
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            json.dump(report.as_dict(), report_file, indent=2)
+    sys.stderr.write(report.summary().encode('utf-8') + b'\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
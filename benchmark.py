@@ -0,0 +1,559 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Benchmarks for PyBib on synthetic BibTeX libraries.
+
+    Usage:
+        python benchmark.py parse --sizes 10000 100000 500000
+        python benchmark.py format --sizes 10000 100000
+        python benchmark.py startup
+        python benchmark.py columns --sizes 10000
+        python benchmark.py memory --sizes 10000 100000
+        python benchmark.py latex --lists 5000
+        python benchmark.py suite --sizes 1000 10000 100000 --output results.json
+        python benchmark.py compare old.json results.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import random
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+import pybtex.database
+
+import batchformat
+import columns
+import compactstore
+import dbcache
+import formatting
+import loader
+import session
+import texconvert
+import writer
+
+__author__ = 'Jens-Kristian Krogager'
+
+surnames = [u'{Krogager}', u'{Fynbo}', u'{M{\\o}ller}', u'{Bouch{\\\'e}}', u'{P{\\\'e}roux}',
+            u'{Fria{\\c c}a}', u'{Ivezi{\\\'c}}', u'{Ledoux}', u'{Noterdaeme}', u'{Christensen}',
+            u'{Jur{\\\'i}{\\v c}}', u'{da Silveira}', u'{Zafar}', u'{Smith}', u'{Heintz}']
+initials = [u'J.-K.', u'J.~P.~U.', u'P.', u'N.', u'C.', u'A.~C.~S.', u'M.', u'L.', u'K.~E.']
+journals = [u'\\' + name for name in sorted(formatting.journal_transform)]
+months = [u'jan', u'feb', u'mar', u'apr', u'may', u'jun',
+          u'jul', u'aug', u'sep', u'oct', u'nov', u'dec']
+words = [u'galaxies', u'quasar', u'absorption', u'metallicity', u'dust', u'redshift',
+         u'damped', u'Lyman-{$\\alpha$}', u'systems', u'evolution', u'survey', u'host',
+         u'gamma-ray', u'bursts', u'star', u'formation', u'molecular', u'hydrogen']
+
+
+def make_authors(rng, last_names=surnames, first_names=initials):
+    """ Return a list of 1 to 12 random author names. """
+    return [u'%s, %s' % (rng.choice(last_names), rng.choice(first_names))
+            for _ in range(rng.randint(1, 12))]
+
+
+def make_entry(num, rng):
+    """ Return the BibTeX text of a synthetic ADS-style article. """
+    year = rng.randint(1990, 2016)
+    authors = make_authors(rng)
+    title = u' '.join(rng.choice(words) for _ in range(rng.randint(5, 14)))
+    keywords = u', '.join(u'galaxies: ' + rng.choice(words) for _ in range(3))
+    volume = rng.randint(1, 800)
+    page = rng.randint(1, 3000)
+    journal = rng.choice(journals)
+    lines = [u'@ARTICLE{key%i_%i,' % (num, year),
+             u'   author = {%s},' % u' and\n\t'.join(authors),
+             u'    title = "{%s}",' % title,
+             u'  journal = {%s},' % journal,
+             u' keywords = {%s},' % keywords,
+             u'     year = %i,' % year,
+             u'    month = %s,' % rng.choice(months),
+             u'   volume = %i,' % volume,
+             u'    pages = {%i-%i},' % (page, page + rng.randint(1, 20)),
+             u'      doi = {10.1093/mnras/stu%i},' % num,
+             u'   adsurl = {http://adsabs.harvard.edu/abs/%iMNRAS.%i..%iK},' % (year, volume, page),
+             u'  adsnote = {Provided by the SAO/NASA Astrophysics Data System}',
+             u'}', u'']
+    return u'\n'.join(lines)
+
+
+def write_library(filename, n_entries, seed=1):
+    rng = random.Random(seed)
+    with open(filename, 'wb') as output:
+        for num in range(n_entries):
+            output.write(make_entry(num, rng).encode('utf-8'))
+            output.write(b'\n')
+
+
+def timed(func, *args, **kwargs):
+    """ Return the result of func(*args, **kwargs) and the time it took. """
+    t0 = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - t0
+
+
+def bench_parse(sizes, processes=None):
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    temp_dir = tempfile.mkdtemp()
+    print("%10s  %10s  %10s  %10s  %8s" % ('entries', 'pybtex', 'chunked', 'parallel', 'speedup'))
+    for n_entries in sizes:
+        filename = os.path.join(temp_dir, 'library_%i.bib' % n_entries)
+        write_library(filename, n_entries)
+
+        reference, t_pybtex = timed(pybtex.database.parse_file, filename)
+        serial, t_serial = timed(loader.parse_file, filename, 1)
+        parallel, t_parallel = timed(loader.parse_file, filename, processes, 1000000)
+        assert list(parallel.entries.keys()) == list(reference.entries.keys())
+
+        print("%10i  %9.2fs  %9.2fs  %9.2fs  %7.1fx" % (n_entries, t_pybtex, t_serial, t_parallel,
+                                                         t_pybtex / t_parallel))
+        os.remove(filename)
+    os.rmdir(temp_dir)
+
+
+def bench_format(sizes, processes=None, output_format='text'):
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    temp_dir = tempfile.mkdtemp()
+    output_name = os.path.join(temp_dir, 'references.out')
+    print("%10s  %16s  %16s" % ('entries', 'serial', 'parallel'))
+    for n_entries in sizes:
+        filename = os.path.join(temp_dir, 'library_%i.bib' % n_entries)
+        write_library(filename, n_entries)
+
+        rates = list()
+        for n_proc in (1, processes):
+            with io.open(output_name, 'w', encoding='utf-8') as output:
+                report, dt = timed(batchformat.format_file, filename, output, output_format, n_proc)
+            assert report.n_entries == n_entries
+            rates.append(n_entries / dt)
+
+        print("%10i  %10.0f ent/s  %10.0f ent/s" % (n_entries, rates[0], rates[1]))
+        os.remove(filename)
+    os.remove(output_name)
+    os.rmdir(temp_dir)
+
+
+def bench_columns(sizes):
+    """ Build time and memory of the field columns. """
+    temp_dir = tempfile.mkdtemp()
+    for n_entries in sizes:
+        filename = os.path.join(temp_dir, 'library_%i.bib' % n_entries)
+        write_library(filename, n_entries)
+        bib_database = loader.parse_file(filename)
+        field_columns = columns.FieldColumns()
+        _, dt = timed(field_columns.build, bib_database)
+        print("%i entries, built in %.2fs" % (n_entries, dt))
+        print(field_columns.memory_report())
+        os.remove(filename)
+    os.rmdir(temp_dir)
+
+
+def resident_memory():
+    """ Resident memory of this process in bytes. """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        import resource
+        # Peak instead of current memory, in kB on Linux:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+memory_stores = ['pybtex', 'compact', 'session', 'session-compact', 'workspace', 'workspace-compact']
+
+
+def measure_store(filename, store, n_lookups=1000):
+    """
+    Load `filename` into a BibliographyData ('pybtex'), a CompactDatabase
+    ('compact'), or open it in a DatabaseSession or a Workspace with either
+    store ('session', 'workspace' and '-compact'), which adds the search
+    index, the field columns and the source text. Returns the memory held
+    after loading in bytes and the time of looking up `n_lookups` random
+    entries.
+    """
+    import gc
+    import shutil
+    import workspace
+    if store in ('pybtex', 'compact'):
+        text = loader.read_bibtex(filename)
+    gc.collect()
+    before = resident_memory()
+    if store in ('pybtex', 'compact'):
+        if store == 'compact':
+            bib_database = compactstore.CompactDatabase()
+        else:
+            bib_database = pybtex.database.BibliographyData()
+        for chunk_database, end in loader.iter_batches(text):
+            loader.merge_into(bib_database, chunk_database)
+        del chunk_database
+    else:
+        # Parse the file instead of reading an earlier binary cache:
+        dbcache.cache_directory = tempfile.mkdtemp()
+        compact = store.endswith('-compact')
+        if store.startswith('workspace'):
+            bib = workspace.Workspace(compact)
+        else:
+            bib = session.DatabaseSession(compact)
+        bib.open(filename)
+        shutil.rmtree(dbcache.cache_directory)
+        bib_database = bib.bib_database
+    gc.collect()
+    size = resident_memory() - before
+
+    rng = random.Random(1)
+    keys = list(bib_database.entries.keys())
+    sample = [rng.choice(keys) for _ in range(n_lookups)]
+    t0 = time.time()
+    for key in sample:
+        bib_database.entries[key].fields['title']
+    return size, time.time() - t0
+
+
+def bench_memory(sizes):
+    """ Memory of the entries as pybtex objects and in the compact store, alone and in a session. """
+    temp_dir = tempfile.mkdtemp()
+    print("%10s  %-18s  %10s  %12s  %14s" % ('entries', 'store', 'memory', 'per entry', '1000 lookups'))
+    for n_entries in sizes:
+        filename = os.path.join(temp_dir, 'library_%i.bib' % n_entries)
+        write_library(filename, n_entries)
+        for store in memory_stores:
+            # Measure in a fresh process, so memory freed by the other store is not reused:
+            pool = multiprocessing.Pool(1)
+            size, dt = pool.apply(measure_store, (filename, store))
+            pool.close()
+            pool.join()
+            print("%10i  %-18s  %8.1fMB  %10.0f B  %12.1fms" % (n_entries, store, size / 1024. ** 2,
+                                                                float(size) / n_entries, 1000 * dt))
+        os.remove(filename)
+    os.rmdir(temp_dir)
+
+
+# Names as written by ADS, with the accent and letter macros of texconvert:
+latex_surnames = surnames + [u'{Schr{\\"o}der}', u'{Gonz{\\\'a}lez}', u'{Hern{\\\'a}ndez-Garc{\\\'\\i}a}',
+                             u'{{\\L}ukasz}', u'{Stra{\\ss}er}', u'{{\\AA}str{\\"o}m}', u'{Ca{\\~n}ete}',
+                             u'{Erd{\\H o}s}', u'{{\\v S}koda}', u'{Ko{\\c{c}}}', u'{Lindstr{\\o}m}',
+                             u'{{\\O}stergaard}', u'{Mu{\\~n}oz}', u'{de Ugarte Postigo}', u'{Dess{\\`e}ges}',
+                             u'{Th{\\\'e}ophile}', u'{Ma{\\l}ek}', u'{G{\\"u}rkan}', u'{Y{\\i}ld{\\i}z}',
+                             u'{{\\c S}ahin}', u'{Bj{\\o}rnsson}', u'{Sch{\\ae}fer}', u'{J\\\'{o}hannesson}']
+latex_initials = initials + [u'{\\\'A}.', u'{\\O}.', u'{\\v S}.', u'{\\L}.', u'{\\\'E}.~{\\AA}.']
+
+# Texts the fast conversion leaves to pylatexenc:
+fallback_texts = [u'{Lyman-{$\\alpha$}}', u'{\\textbf{Smith}}', u'{Smith} \\& {Jones}', u"``{Smith}''",
+                  u'{50\\% complete}', u'{\\\'{oo}}', u'{Smith\\\'}', u'{\\$}', u'{a\\\\b}',
+                  u'{\\AE\\oe\\OE{}\\j}', u'{\\\'\\ae}', u'{\\t{oo}}']
+
+
+def latex_corpus():
+    """ LaTeX texts covering every accent and letter macro of texconvert in different forms. """
+    texts = list()
+    for accent in sorted(texconvert.accents):
+        space = u' ' if accent.isalpha() else u''
+        for base in (u'a', u'E', u'o', u'z', u'\\i', u'\\o'):
+            texts += [u'\\%s{%s}' % (accent, base), u'{\\%s %s}' % (accent, base),
+                      u'\\%s { %s }' % (accent, base)]
+            if base.isalpha():
+                texts.append(u'x\\%s%s%sy' % (accent, space, base))
+        texts.append(u'\\%s{}' % accent)
+    for name in sorted(texconvert.letters):
+        texts += [u'{\\%s}' % name, u'\\%s{}x' % name, u'x \\%s y' % name, u'\\%s\\%s.' % (name, name)]
+    texts += [u'a\\%sb' % char for char in sorted(texconvert.escaped)]
+    texts += [u'  {J.~P.~U.}  ', u'{a}\n{b}', u'{{\\o}}', u'{a} {b}', u'x{ a}', u'x{ }y', u'{a } b',
+              u'\\o {b} c', u'{a} \\o', u'x ~ {b}', u"\\' \\i a", u'{a}\n\n{b}']
+    return texts + fallback_texts
+
+
+def bench_latex(n_lists, seed=1):
+    """
+    Check the fast LaTeX conversion against pylatexenc on the corpus and on
+    `n_lists` random author lists, and time both on the author names.
+    """
+    from pylatexenc import latex2text
+    rng = random.Random(seed)
+    names = list()
+    for _ in range(n_lists):
+        names.extend(make_authors(rng, latex_surnames, latex_initials))
+    names = [name for name in names if u'\\' in name]
+
+    texts = sorted(set(latex_corpus() + names))
+    n_fallback = 0
+    mismatches = list()
+    for text in texts:
+        if texconvert.fast_latex2text(text) is None:
+            n_fallback += 1
+        expected = latex2text.latex2text(text)
+        if texconvert.latex2text(text) != expected:
+            mismatches.append((text, expected))
+    print("%i texts checked, %i passed to pylatexenc, %i differ" % (
+        len(texts), n_fallback, len(mismatches)))
+    for text, expected in mismatches[:20]:
+        print((u"  %s: %s != %s" % (text, texconvert.latex2text(text), expected)).encode('utf-8'))
+
+    print("%10s  %10s  %12s  %12s  %8s" % ('lists', 'names', 'pylatexenc', 'fast', 'speedup'))
+    _, t_old = timed(lambda: [latex2text.latex2text(name) for name in names])
+    _, t_new = timed(lambda: [texconvert.latex2text(name) for name in names])
+    print("%10i  %10i  %10.3fs  %10.3fs  %7.1fx" % (n_lists, len(names), t_old, t_new, t_old / t_new))
+    return 1 if mismatches else 0
+
+
+startup_commands = [('import session', "import session"),
+                    ('import pybtex.database', "import pybtex.database"),
+                    ('import pylatexenc.latex2text', "import pylatexenc.latex2text"),
+                    ('open and render test.bib',
+                     "import session; s = session.DatabaseSession(); s.open('test.bib'); "
+                     "s.render_entry(s.entryID_list[0], ['author', 'title', 'journal', 'year'])")]
+
+
+def bench_startup(repeat=5):
+    """ Time fresh interpreters running each of the `startup_commands`. """
+    here = os.path.dirname(os.path.abspath(__file__))
+    cache_name = dbcache.cache_filename(os.path.join(here, 'test.bib'))
+
+    def run(command):
+        times = list()
+        for _ in range(repeat):
+            # Start without the binary cache every time:
+            if os.path.exists(cache_name):
+                os.remove(cache_name)
+            times.append(timed(subprocess.check_call, [sys.executable, '-c', command], cwd=here)[1])
+        return min(times)
+
+    t_python = run('pass')
+    print("%-28s  %10s" % ('command', 'time'))
+    for label, command in startup_commands:
+        print("%-28s  %8.0fms" % (label, 1000 * (run(command) - t_python)))
+    if os.path.exists(cache_name):
+        os.remove(cache_name)
+
+
+# Queries of the suite, as typed in the search bar, the content search and the query line:
+filter_texts = [u'k', u'ke', u'key', u'key1', u'key12', u'key123']
+content_queries = [{'author': u'fynbo'}, {'title': u'damped absorption'},
+                   {'author': u'krogager', 'journal': u'mnras'}]
+query_texts = [u'author:fynbo year:2000..2010', u'title:"molecular hydrogen" -keyword:dust',
+               u'journal:apj quasar']
+view_fields = ['Author', 'Journal', 'Year', 'Title', 'Volume', 'Keyword', 'AdsURL']
+
+
+def best_time(func, repeat, *args):
+    """ Shortest time of `repeat` calls of func(*args). """
+    return min(timed(func, *args)[1] for _ in range(repeat))
+
+
+def run_suite(filename, n_entries, repeat=3, n_render=1000, seed=1):
+    """
+    Time the load, search, render and save paths of a DatabaseSession on a
+    synthetic library. Returns a list of results: dictionaries with the
+    name of the benchmark, the number of operations timed and the seconds.
+    """
+    rng = random.Random(seed)
+    results = list()
+
+    def add(name, seconds, operations=1):
+        results.append({'benchmark': name, 'entries': n_entries,
+                        'operations': operations, 'seconds': seconds})
+
+    write_library(filename, n_entries, seed)
+    cache_name = dbcache.cache_filename(filename)
+
+    # Loading:
+    add('load.pybtex', timed(pybtex.database.parse_file, filename)[1])
+    db_session = session.DatabaseSession()
+    add('load.session', timed(db_session.open, filename)[1])
+    db_session = session.DatabaseSession()
+    add('load.cached', timed(db_session.open, filename)[1])
+    keys = db_session.entryID_list
+
+    # Searching:
+    def type_filter():
+        for text in filter_texts:
+            db_session.filter_keys(text)
+    add('search.filter_keys', best_time(type_filter, repeat), len(filter_texts))
+
+    def search_content():
+        for queries in content_queries:
+            db_session.search_content(queries)
+    add('search.content', best_time(search_content, repeat), len(content_queries))
+
+    def run_queries():
+        for text in query_texts:
+            db_session.query_engine.cache.clear()
+            db_session.query(text)
+    add('search.query', best_time(run_queries, repeat), len(query_texts))
+
+    def rank_content():
+        for queries in content_queries:
+            db_session.rank_content(queries)
+    add('search.rank', best_time(rank_content, repeat), len(content_queries))
+    db_session.reset_scope()
+
+    # Rendering:
+    sample = [rng.choice(keys) for _ in range(min(n_render, len(keys)))]
+
+    def render_entries():
+        for key in sample:
+            db_session.render_entry(key, view_fields)
+    db_session.render_cache.clear()
+    add('render.entry_cold', timed(render_entries)[1], len(sample))
+    add('render.entry_warm', best_time(render_entries, repeat), len(sample))
+
+    def format_references():
+        for key in sample:
+            formatting.format_reference(db_session.bib_database.entries[key])
+    add('render.format_reference', best_time(format_references, repeat), len(sample))
+
+    # Saving:
+    output_name = filename + '.saved'
+    db_session.update_entry(sample[0], {'title': u'Edited title'})
+    add('save.incremental', timed(db_session.save, output_name)[1])
+    add('save.full', timed(writer.save_full, output_name, db_session.bib_database)[1])
+
+    for name in (filename, output_name, cache_name):
+        if os.path.exists(name):
+            os.remove(name)
+    cache_name = dbcache.cache_filename(output_name)
+    if os.path.exists(cache_name):
+        os.remove(cache_name)
+    return results
+
+
+def git_revision():
+    """ Current git commit of the repository, or None. """
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                             cwd=here, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.strip().decode('ascii')
+
+
+def bench_suite(sizes, output=None, repeat=3):
+    """ Run the suite for each size, print the results and write them to `output` as JSON. """
+    temp_dir = tempfile.mkdtemp()
+    results = list()
+    print("%10s  %-26s  %10s  %12s" % ('entries', 'benchmark', 'total', 'per op'))
+    for n_entries in sizes:
+        filename = os.path.join(temp_dir, 'library_%i.bib' % n_entries)
+        for result in run_suite(filename, n_entries, repeat):
+            print("%10i  %-26s  %9.3fs  %10.3fms" % (n_entries, result['benchmark'],
+                                                     result['seconds'],
+                                                     1000 * result['seconds'] / result['operations']))
+            results.append(result)
+    os.rmdir(temp_dir)
+
+    if output is not None:
+        report = {'revision': git_revision(),
+                  'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'pybtex': getattr(pybtex, '__version__', None),
+                  'results': results}
+        with open(output, 'w') as json_file:
+            json.dump(report, json_file, indent=1, sort_keys=True)
+        print("Results written to %s" % output)
+    return results
+
+
+def compare_results(old_name, new_name, threshold=1.2):
+    """
+    Print the time per operation of two result files of the suite side by
+    side. Returns the number of benchmarks slower by more than `threshold`.
+    """
+    with open(old_name) as json_file:
+        old = json.load(json_file)
+    with open(new_name) as json_file:
+        new = json.load(json_file)
+
+    def per_operation(report):
+        return dict(((result['benchmark'], result['entries']),
+                     result['seconds'] / result['operations']) for result in report['results'])
+
+    old_times = per_operation(old)
+    new_times = per_operation(new)
+    print("%10s  %-26s  %12s  %12s  %7s" % ('entries', 'benchmark', old['revision'],
+                                            new['revision'], 'ratio'))
+    n_slower = 0
+    for name, n_entries in sorted(set(old_times) & set(new_times), key=lambda item: (item[1], item[0])):
+        t_old = old_times[(name, n_entries)]
+        t_new = new_times[(name, n_entries)]
+        ratio = t_new / t_old if t_old > 0 else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = '  slower'
+            n_slower += 1
+        elif ratio < 1. / threshold:
+            flag = '  faster'
+        print("%10i  %-26s  %10.3fms  %10.3fms  %6.2fx%s" % (n_entries, name, 1000 * t_old,
+                                                               1000 * t_new, ratio, flag))
+    return n_slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for PyBib")
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    parse_parser = subparsers.add_parser('parse', help="Serial vs. parallel loading of .bib files")
+    parse_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 500000])
+    parse_parser.add_argument('--processes', type=int, default=None,
+                              help="Number of worker processes (default: number of CPUs)")
+
+    format_parser = subparsers.add_parser('format', help="Batch reference formatting throughput")
+    format_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    format_parser.add_argument('--processes', type=int, default=None,
+                               help="Number of worker processes (default: number of CPUs)")
+    format_parser.add_argument('--format', default='text', choices=batchformat.output_formats)
+
+    startup_parser = subparsers.add_parser('startup', help="Import and cold start time of the core")
+    startup_parser.add_argument('--repeat', type=int, default=5)
+
+    columns_parser = subparsers.add_parser('columns', help="Build time and memory of the field columns")
+    columns_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+
+    memory_parser = subparsers.add_parser('memory', help="Memory of pybtex entries and the compact store")
+    memory_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+
+    latex_parser = subparsers.add_parser('latex', help="Fast LaTeX conversion vs. pylatexenc")
+    latex_parser.add_argument('--lists', type=int, default=5000, help="Number of author lists")
+
+    suite_parser = subparsers.add_parser('suite', help="Load, search, render and save times of a session")
+    suite_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    suite_parser.add_argument('--repeat', type=int, default=3)
+    suite_parser.add_argument('--output', default=None, help="Write the results to this JSON file")
+
+    compare_parser = subparsers.add_parser('compare', help="Compare two JSON files of the suite")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=1.2,
+                                help="Ratio of times counted as a regression (default: 1.2)")
+
+    args = parser.parse_args()
+    if args.benchmark == 'parse':
+        bench_parse(args.sizes, args.processes)
+    elif args.benchmark == 'format':
+        bench_format(args.sizes, args.processes, args.format)
+    elif args.benchmark == 'startup':
+        bench_startup(args.repeat)
+    elif args.benchmark == 'columns':
+        bench_columns(args.sizes)
+    elif args.benchmark == 'memory':
+        bench_memory(args.sizes)
+    elif args.benchmark == 'latex':
+        return bench_latex(args.lists)
+    elif args.benchmark == 'suite':
+        bench_suite(args.sizes, args.output, args.repeat)
+    elif args.benchmark == 'compare':
+        if compare_results(args.old, args.new, args.threshold):
+            return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Column store of normalized field text for all entries.
+    Every entry gets a row, and every field a column (a list indexed by
+    row) of cleaned display text and of lowercased, accent-folded search
+    text. The journal column holds the journal name and its normalized
+    abbreviation. Columns are filled once when the database is loaded and
+    rows are overwritten in place when an entry is edited, so displaying
+    and matching field text is a list lookup instead of string processing
+    on the raw pybtex fields.
+"""
+
+import sys
+
+import formatting
+import searchindex
+
+__author__ = 'Jens-Kristian Krogager'
+
+column_fields = ['author', 'title', 'journal', 'year', 'volume', 'pages', 'keywords', 'abstract']
+
+
+def display_text(bib_entry, field):
+    """ Cleaned display text of `field`, as shown in the entry view. """
+    if field == 'author':
+        if 'author' not in bib_entry.persons.keys():
+            return u''
+        return formatting.format_author_list(bib_entry, showAll=True)
+    elif field not in bib_entry.fields.keys():
+        return u''
+    elif field == 'journal':
+        return formatting.format_journal_name(bib_entry)
+    return formatting.clean_string(bib_entry.fields[field].replace('\n', ' '))
+
+
+def search_text(bib_entry, field):
+    """ Lowercased search text of `field` with LaTeX converted and accents removed. """
+    if field == 'author':
+        if 'author' not in bib_entry.persons.keys():
+            return u''
+        return u'; '.join(searchindex.normalize_text(author_field)
+                          for author_field in bib_entry.fields['author'].split(' and '))
+    elif field not in bib_entry.fields.keys():
+        return u''
+    return searchindex.normalize_text(bib_entry.fields[field])
+
+
+def string_size(text, seen):
+    """ Size in bytes of a string not already counted in `seen`. """
+    if id(text) in seen:
+        return 0
+    seen.add(id(text))
+    return sys.getsizeof(text)
+
+
+class FieldColumns(object):
+    """ Display and search text of `fields` in lists indexed by the row of each key. """
+
+    def __init__(self, fields=column_fields):
+        self.fields = list(fields)
+        self.clear()
+
+    def clear(self):
+        self.row = dict()
+        self.free_rows = list()
+        self.display = dict((field, list()) for field in self.fields)
+        self.search = dict((field, list()) for field in self.fields)
+        self.journal_key = list()
+
+    def __len__(self):
+        return len(self.row)
+
+    def __contains__(self, key):
+        return key in self.row
+
+    def build(self, bib_database):
+        self.clear()
+        for key, bib_entry in bib_database.entries.items():
+            self.add_entry(key, bib_entry)
+
+    def get_state(self):
+        """ Return the columns as a dictionary which can be pickled, see dbcache.py. """
+        return {'fields': self.fields, 'row': self.row, 'free_rows': self.free_rows,
+                'display': self.display, 'search': self.search, 'journal_key': self.journal_key}
+
+    def set_state(self, state):
+        self.fields = state['fields']
+        self.row = state['row']
+        self.free_rows = state['free_rows']
+        self.display = state['display']
+        self.search = state['search']
+        self.journal_key = state['journal_key']
+
+    def _set_row(self, row, bib_entry):
+        for field in self.fields:
+            display = display_text(bib_entry, field)
+            if field == 'journal':
+                search = searchindex.normalize_text(display)
+            else:
+                search = search_text(bib_entry, field)
+            # Share the string when the search text is the same as the display text:
+            if search == display:
+                search = display
+            self.display[field][row] = display
+            self.search[field][row] = search
+        if 'journal' in bib_entry.fields.keys():
+            self.journal_key[row] = formatting.normalize_journal(bib_entry.fields['journal'])
+        else:
+            self.journal_key[row] = u''
+
+    def _new_row(self, key):
+        if self.free_rows:
+            row = self.free_rows.pop()
+        else:
+            row = len(self.journal_key)
+            for field in self.fields:
+                self.display[field].append(u'')
+                self.search[field].append(u'')
+            self.journal_key.append(u'')
+        self.row[key] = row
+        return row
+
+    def add_entry(self, key, bib_entry):
+        if key in self.row:
+            self.update_entry(key, bib_entry)
+            return
+        self._set_row(self._new_row(key), bib_entry)
+
+    def copy_entry(self, key, other):
+        """ Add the row of `key` from another FieldColumns with the same fields. """
+        row = self.row.get(key)
+        if row is None:
+            row = self._new_row(key)
+        other_row = other.row[key]
+        for field in self.fields:
+            self.display[field][row] = other.display[field][other_row]
+            self.search[field][row] = other.search[field][other_row]
+        self.journal_key[row] = other.journal_key[other_row]
+
+    def subset_state(self, keys):
+        """ Return the state (see get_state) of only the rows of `keys`. """
+        subset = FieldColumns(self.fields)
+        for key in keys:
+            subset.copy_entry(key, self)
+        return subset.get_state()
+
+    def update_entry(self, key, bib_entry):
+        """ Overwrite the row of `key` in place. """
+        if key not in self.row:
+            self.add_entry(key, bib_entry)
+        else:
+            self._set_row(self.row[key], bib_entry)
+
+    def remove_entry(self, key):
+        row = self.row.pop(key, None)
+        if row is None:
+            return
+        for field in self.fields:
+            self.display[field][row] = u''
+            self.search[field][row] = u''
+        self.journal_key[row] = u''
+        self.free_rows.append(row)
+
+    def display_text(self, key, field):
+        return self.display[field][self.row[key]]
+
+    def search_text(self, key, field):
+        return self.search[field][self.row[key]]
+
+    def search_texts(self, key):
+        """ Dictionary of field -> search text of the entry. """
+        row = self.row[key]
+        return dict((field, self.search[field][row]) for field in self.fields)
+
+    def memory_usage(self):
+        """
+        Return a dictionary of column name -> approximate size in bytes of the
+        lists and the strings they hold. Shared strings are only counted once.
+        """
+        seen = set()
+        usage = dict()
+        for field in self.fields:
+            for kind, columns in (('display', self.display), ('search', self.search)):
+                column = columns[field]
+                size = sys.getsizeof(column)
+                size += sum(string_size(text, seen) for text in column)
+                usage['%s.%s' % (field, kind)] = size
+        usage['journal_key'] = sys.getsizeof(self.journal_key)
+        usage['journal_key'] += sum(string_size(text, seen) for text in self.journal_key)
+        usage['row'] = sys.getsizeof(self.row)
+        return usage
+
+    def memory_report(self):
+        usage = self.memory_usage()
+        lines = ["Columns of %i entries:" % len(self)]
+        for name, size in sorted(usage.items()):
+            lines.append("  %-20s %10.1f kB" % (name, size / 1024.))
+        lines.append("  %-20s %10.1f kB" % ('total', sum(usage.values()) / 1024.))
+        return '\n'.join(lines)
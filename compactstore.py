@@ -0,0 +1,286 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Memory-compact storage of BibTeX entries for very large libraries.
+    A CompactDatabase can be used in place of a pybtex BibliographyData by
+    the session. Each entry is kept as a CompactEntry record with
+    __slots__, its fields as a flat tuple of names and values and its
+    persons as tuples of name parts, as in the binary cache (dbcache.py).
+    Field names, persons and short values (journal macros, months, adsnote,
+    years, ...) are interned in a table shared by all entries.
+    Longer values are stored UTF-8 encoded, which takes a quarter of the
+    memory of a unicode string on wide Python builds.
+
+    pybtex Entry and Person objects are only built when an entry is looked
+    up, e.g., by the editor, the renderer or the writer. The most recently
+    used entries are kept as live Entry objects, so in-place edits work as
+    with pybtex; an entry is packed again when it drops out of this set.
+    Entries returned while iterating over all entries are temporary copies
+    unless they are live, and should not be modified.
+
+    The saving comes at a cost: looking up an entry that is not live takes
+    about 0.1-0.2 ms to build its pybtex objects, 30-80 times as long as
+    with pybtex. In a session, where the search index, the field columns
+    and the source text stay the same, the compact store about halves the
+    memory (see `python benchmark.py memory`).
+"""
+
+from collections import OrderedDict
+
+import dbcache
+
+__author__ = 'Jens-Kristian Krogager'
+
+# Values up to this length are interned, longer values are stored as UTF-8:
+max_intern_length = 40
+
+
+class StringTable(object):
+    """ Intern table of unicode strings and of packed person names. """
+
+    def __init__(self):
+        self.strings = dict()
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, text):
+        return self.strings.setdefault(text, text)
+
+    def intern_person(self, name_parts):
+        """ Intern the name parts of a packed person, and the packed person itself. """
+        packed = tuple(tuple(self.intern(name) for name in names) for names in name_parts)
+        return self.strings.setdefault(packed, packed)
+
+    def intern_short(self, text):
+        if len(text) > max_intern_length:
+            return text.encode('utf-8')
+        return self.strings.setdefault(text, text)
+
+
+def field_items(fields):
+    """ (name, value) pairs of the flat fields of a CompactEntry, with values as unicode. """
+    return [(fields[i], fields[i+1].decode('utf-8') if isinstance(fields[i+1], str) else fields[i+1])
+            for i in range(0, len(fields), 2)]
+
+
+class CompactEntry(object):
+    """ Key, type, flat (name, value, name, value, ...) fields and packed persons of an entry. """
+    __slots__ = ('key', 'type', 'fields', 'persons')
+
+    def __init__(self, key, entry_type, fields, persons):
+        self.key = key
+        self.type = entry_type
+        self.fields = fields
+        self.persons = persons
+
+
+class CompactEntries(object):
+    """
+    Case-insensitive, ordered mapping of key -> entry like the `entries` of
+    a BibliographyData, holding CompactEntry records and at most
+    `max_live` unpacked Entry objects.
+    """
+
+    def __init__(self, database, strings, max_live=2000):
+        self.database = database
+        self.strings = strings
+        self.max_live = max_live
+        self.records = dict()
+        self._order = list()
+        # Removed keys are dropped from the order when it is next read:
+        self.n_removed = 0
+        self.live = OrderedDict()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, key):
+        return key.lower() in self.records
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __delitem__(self, key):
+        lower_key = key.lower()
+        del self.records[lower_key]
+        self.live.pop(lower_key, None)
+        self.n_removed += 1
+
+    @property
+    def order(self):
+        """ Keys in the order they were added. """
+        if self.n_removed:
+            self._order = [key for key in self._order if key.lower() in self.records]
+            self.n_removed = 0
+        return self._order
+
+    def keys(self):
+        return list(self.order)
+
+    def iterkeys(self):
+        return iter(self.order)
+
+    # -- Packing:
+    def pack(self, key, bib_entry):
+        intern = self.strings.intern
+        intern_short = self.strings.intern_short
+        fields = list()
+        for name, value in bib_entry.fields.items():
+            fields.append(intern(name))
+            fields.append(intern_short(value))
+        persons = tuple((intern(role), tuple(self.strings.intern_person(dbcache.pack_person(person))
+                                              for person in person_list))
+                        for role, person_list in bib_entry.persons.items())
+        return CompactEntry(key, intern(bib_entry.original_type), tuple(fields), persons)
+
+    def unpack(self, record):
+        bib_entry = dbcache.unpack_entry((record.key, record.type, field_items(record.fields),
+                                          record.persons))
+        bib_entry.collection = self.database
+        return bib_entry
+
+    def add_packed(self, packed):
+        """ Add an entry in the packed form of dbcache.pack_entry without creating an Entry. """
+        key, entry_type, fields, persons = packed
+        intern = self.strings.intern
+        intern_short = self.strings.intern_short
+        flat = list()
+        for name, value in fields:
+            flat.append(intern(name))
+            flat.append(intern_short(value))
+        persons = tuple((intern(role), tuple(self.strings.intern_person(person)
+                                              for person in person_list))
+                        for role, person_list in persons)
+        self.insert(key, CompactEntry(key, intern(entry_type), tuple(flat), persons))
+
+    def packed_entries(self, keys=None):
+        """ Yield the entries of `keys` (default: all) in the packed form of dbcache.pack_entry. """
+        for key in (self.order if keys is None else keys):
+            record = self.record(key)
+            yield (record.key, record.type, field_items(record.fields), record.persons)
+
+    def record(self, key):
+        """ Return the CompactEntry of `key`, packing the live entry first. """
+        lower_key = key.lower()
+        bib_entry = self.live.get(lower_key)
+        if bib_entry is not None:
+            self.records[lower_key] = self.pack(self.records[lower_key].key, bib_entry)
+        return self.records[lower_key]
+
+    def insert(self, key, record):
+        lower_key = key.lower()
+        if lower_key not in self.records:
+            self.order.append(key)
+        self.records[lower_key] = record
+        self.live.pop(lower_key, None)
+
+    # -- Entry objects:
+    def __getitem__(self, key):
+        lower_key = key.lower()
+        bib_entry = self.live.pop(lower_key, None)
+        if bib_entry is None:
+            bib_entry = self.unpack(self.records[lower_key])
+            if len(self.live) >= self.max_live:
+                # Keep the changes of the least recently used entry:
+                old_key, old_entry = self.live.popitem(last=False)
+                self.records[old_key] = self.pack(self.records[old_key].key, old_entry)
+        self.live[lower_key] = bib_entry
+        return bib_entry
+
+    def __setitem__(self, key, bib_entry):
+        lower_key = key.lower()
+        if lower_key in self.records:
+            key = self.records[lower_key].key
+        bib_entry.key = key
+        bib_entry.collection = self.database
+        self.insert(key, self.pack(key, bib_entry))
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def itervalues(self):
+        for key, bib_entry in self.iteritems():
+            yield bib_entry
+
+    def iteritems(self):
+        """ Yield (key, entry). Entries which are not live are temporary copies. """
+        live = self.live
+        for key in self.order:
+            lower_key = key.lower()
+            bib_entry = live.get(lower_key)
+            if bib_entry is None:
+                bib_entry = self.unpack(self.records[lower_key])
+            yield key, bib_entry
+
+    # Iterators rather than lists, so all entries are never unpacked at once:
+    values = itervalues
+    items = iteritems
+
+    def release(self):
+        """ Pack all live entries. """
+        for lower_key, bib_entry in self.live.items():
+            self.records[lower_key] = self.pack(self.records[lower_key].key, bib_entry)
+        self.live.clear()
+
+
+class CompactDatabase(object):
+    """
+    Drop-in replacement of a pybtex BibliographyData holding CompactEntries.
+    Databases created with the same `strings` table share interned strings.
+    """
+
+    def __init__(self, strings=None, max_live=2000):
+        if strings is None:
+            strings = StringTable()
+        self.strings = strings
+        self.entries = CompactEntries(self, strings, max_live)
+        self._preamble = list()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def preamble(self):
+        return ''.join(self._preamble)
+
+    def add_to_preamble(self, *values):
+        self._preamble.extend(values)
+
+    def add_entry(self, key, bib_entry):
+        """ Add an Entry, which is packed. Repeated keys are reported as by pybtex. """
+        if key in self.entries:
+            from pybtex.database import BibliographyDataError
+            from pybtex.errors import report_error
+            report_error(BibliographyDataError('repeated bibliograhpy entry: %s' % key))
+            return
+        self.entries[key] = bib_entry
+
+    def add_packed(self, packed):
+        self.entries.add_packed(packed)
+
+    def packed_entries(self, keys=None):
+        return self.entries.packed_entries(keys)
+
+    def to_bibliography_data(self, keys=None, preamble=True):
+        """ Return a pybtex BibliographyData of the entries of `keys` (default: all). """
+        from pybtex.database import BibliographyData
+        bib_database = BibliographyData()
+        if preamble:
+            bib_database.add_to_preamble(*self._preamble)
+        if keys is None:
+            keys = self.entries.keys()
+        for key in keys:
+            bib_database.add_entry(key, self.entries.unpack(self.entries.record(key)))
+        return bib_database
+
+    def to_string(self, bib_format, chunk_size=1000):
+        """ Format the database with pybtex, unpacking `chunk_size` entries at a time. """
+        keys = self.entries.keys()
+        pieces = list()
+        for start in range(0, max(len(keys), 1), chunk_size):
+            chunk = self.to_bibliography_data(keys[start:start + chunk_size], preamble=start == 0)
+            pieces.append(chunk.to_string(bib_format))
+        return u'\n'.join(pieces)
@@ -0,0 +1,164 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Binary cache of parsed BibTeX databases.
+    The cache of a .bib file is stored in the per-user `cache_directory`
+    under a name derived from the path of the file, and holds the entries
+    in a compact tuple form together with the search index tokens and the
+    field columns, so an unchanged file can be reopened without parsing. The cache is only used if the format version, file size and
+    content hash all match the file on disk.
+    The cache is pickled, so it must only be read from a directory which
+    other users cannot write to; it is never stored next to the .bib file.
+"""
+
+import os
+import hashlib
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from pybtex.database import BibliographyData, Entry, Person
+
+# Increase when the layout of the cached data changes:
+CACHE_VERSION = 4
+cache_directory = os.path.join(os.path.expanduser('~'), '.pybib', 'cache')
+
+name_parts = ['first_names', 'middle_names', 'prelast_names', 'last_names', 'lineage_names']
+
+
+def cache_filename(filename):
+    """ Name of the cache of `filename` in the `cache_directory`. """
+    path = os.path.abspath(filename)
+    path_hash = hashlib.sha1(path.encode('utf-8') if isinstance(path, unicode) else path).hexdigest()
+    return os.path.join(cache_directory, os.path.basename(path) + '.' + path_hash + '.pybibcache')
+
+
+def file_info(filename):
+    """ Return the absolute path, size and SHA1 hash of a file. """
+    with open(filename, 'rb') as raw_file:
+        content = raw_file.read()
+    return {'path': os.path.abspath(filename),
+            'size': len(content),
+            'sha1': hashlib.sha1(content).hexdigest()}
+
+
+def pack_person(person):
+    return tuple(getattr(person, part) for part in name_parts)
+
+
+def unpack_person(packed):
+    person = Person()
+    for part, names in zip(name_parts, packed):
+        setattr(person, part, list(names))
+    return person
+
+
+def pack_entry(bib_entry):
+    persons = [(role, [pack_person(person) for person in person_list])
+               for role, person_list in bib_entry.persons.items()]
+    return (bib_entry.key, bib_entry.original_type, list(bib_entry.fields.items()), persons)
+
+
+def unpack_entry(packed):
+    key, entry_type, fields, persons = packed
+    bib_entry = Entry(entry_type, fields=fields)
+    for role, person_list in persons:
+        bib_entry.persons[role] = [unpack_person(person) for person in person_list]
+    bib_entry.key = key
+    return bib_entry
+
+
+def save_cache(filename, bib_database, entry_tokens=None, info=None, columns=None, keys=None,
+               preamble=None):
+    """
+    Write the cache of `bib_database` parsed from `filename`.
+    `entry_tokens` are the tokens of searchindex.ContentIndex and `columns`
+    the state of a columns.FieldColumns, whose author column holds the
+    converted author names. `info` is the file_info() of the file content
+    that was parsed. Only the entries of `keys` and the
+    `preamble` are written if given (e.g., one file of a workspace).
+    Returns False if the cache could not be written (e.g., read-only directory).
+    """
+    if info is None:
+        info = file_info(filename)
+    header = dict(info, version=CACHE_VERSION)
+    if hasattr(bib_database, 'packed_entries'):
+        # A compactstore.CompactDatabase is already packed:
+        entries = list(bib_database.packed_entries(keys))
+    elif keys is None:
+        entries = [pack_entry(bib_entry) for bib_entry in bib_database.entries.values()]
+    else:
+        entries = [pack_entry(bib_database.entries[key]) for key in keys]
+    if preamble is None:
+        preamble = bib_database._preamble
+    data = {'entries': entries,
+            'preamble': list(preamble),
+            'entry_tokens': entry_tokens,
+            'columns': columns}
+
+    cache_file = cache_filename(filename)
+    try:
+        if not os.path.isdir(cache_directory):
+            os.makedirs(cache_directory, 0o700)
+        fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix='.tmp')
+    except (IOError, OSError):
+        return False
+
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            # The header is pickled separately so it can be checked without
+            # loading the full cache:
+            pickle.dump(header, output, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, output, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_name, cache_file)
+    except (IOError, OSError):
+        os.remove(temp_name)
+        return False
+    return True
+
+
+def load_cache(filename, info=None, bib_database=None):
+    """
+    Return the cached data of `filename` as a dictionary with the keys
+    'bib_database', 'entry_tokens' and 'columns', or None if there is
+    no valid cache for the current content of the file. `info` is the
+    result of file_info() if already known. The entries are added to
+    `bib_database` if given (e.g., a compactstore.CompactDatabase).
+    """
+    cache_file = cache_filename(filename)
+    if not os.path.exists(cache_file):
+        return None
+
+    try:
+        with open(cache_file, 'rb') as cache:
+            header = pickle.load(cache)
+            if header.get('version') != CACHE_VERSION:
+                return None
+            if header.get('path') != os.path.abspath(filename):
+                return None
+            if header.get('size') != os.path.getsize(filename):
+                return None
+            if info is None:
+                info = file_info(filename)
+            if header.get('sha1') != info['sha1']:
+                return None
+            data = pickle.load(cache)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        return None
+
+    if bib_database is None:
+        bib_database = BibliographyData()
+    if hasattr(bib_database, 'add_packed'):
+        for packed in data['entries']:
+            bib_database.add_packed(packed)
+    else:
+        for packed in data['entries']:
+            bib_entry = unpack_entry(packed)
+            bib_database.add_entry(bib_entry.key, bib_entry)
+    bib_database.add_to_preamble(*data['preamble'])
+    return {'bib_database': bib_database,
+            'entry_tokens': data['entry_tokens'],
+            'columns': data['columns']}
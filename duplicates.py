@@ -0,0 +1,81 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Detection of duplicate entries by their persistent identifiers.
+    The DOI, arXiv eprint number and ADS bibcode of every entry are kept in
+    hash maps, so checking a new entry is a few dictionary lookups instead
+    of a comparison with every entry already loaded.
+"""
+
+import re
+import urllib
+
+__author__ = 'Jens-Kristian Krogager'
+
+doi_prefix = re.compile(r'^(?:https?://(?:dx\.)?doi\.org/|doi:)', re.IGNORECASE)
+eprint_prefix = re.compile(r'^(?:arxiv:)', re.IGNORECASE)
+eprint_version = re.compile(r'v\d+$')
+adsurl_bibcode = re.compile(r'/abs/([^/?#\s]+)')
+
+identifier_types = ['doi', 'eprint', 'bibcode']
+
+
+def normalize_doi(doi):
+    return doi_prefix.sub('', doi.strip()).lower()
+
+
+def normalize_eprint(eprint):
+    return eprint_version.sub('', eprint_prefix.sub('', eprint.strip())).lower()
+
+
+def entry_identifiers(bib_entry):
+    """ Return a list of (identifier type, normalized identifier) of the entry. """
+    fields = bib_entry.fields
+    identifiers = list()
+    if fields.get('doi', '').strip():
+        identifiers.append(('doi', normalize_doi(fields['doi'])))
+    if fields.get('eprint', '').strip():
+        identifiers.append(('eprint', normalize_eprint(fields['eprint'])))
+
+    bibcode = fields.get('bibcode', '').strip()
+    if not bibcode:
+        match = adsurl_bibcode.search(fields.get('adsurl', ''))
+        if match:
+            bibcode = urllib.unquote(match.group(1))
+    if bibcode:
+        identifiers.append(('bibcode', bibcode))
+    return identifiers
+
+
+class DuplicateIndex(object):
+    """ Identifier -> key of the entry it was first seen in, one map per identifier type. """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.keys = dict((id_type, dict()) for id_type in identifier_types)
+        self.identifiers = dict()
+
+    def find(self, bib_entry):
+        """ Return the key of an indexed entry with an identifier in common, or None. """
+        for id_type, identifier in entry_identifiers(bib_entry):
+            key = self.keys[id_type].get(identifier)
+            if key is not None:
+                return key
+        return None
+
+    def add_entry(self, key, bib_entry):
+        identifiers = entry_identifiers(bib_entry)
+        for id_type, identifier in identifiers:
+            self.keys[id_type].setdefault(identifier, key)
+        self.identifiers[key] = identifiers
+
+    def remove_entry(self, key):
+        for id_type, identifier in self.identifiers.pop(key, ()):
+            if self.keys[id_type].get(identifier) == key:
+                del self.keys[id_type][identifier]
+
+    def update_entry(self, key, bib_entry):
+        self.remove_entry(key)
+        self.add_entry(key, bib_entry)
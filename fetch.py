@@ -0,0 +1,364 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Fetch BibTeX entries for DOIs and ADS bibcodes.
+
+    Usage:
+        python fetch.py 10.1093/mnras/stv1146 2015MNRAS.451.3286A -o new.bib
+
+    DOIs are resolved by the Crossref API, one request each, and bibcodes
+    by the ADS export API in batches of up to `ads_batch_size` (an ADS API
+    token is read from $ADS_API_TOKEN or ~/.ads/dev_key). Requests run in a
+    pool of `workers` threads, which limits the number of concurrent
+    requests, and share keep-alive connections from a ConnectionPool.
+    Responses are kept in an on-disk ResponseCache for `ttl` seconds, per
+    DOI and per bibcode, so fetching the same identifiers again makes no
+    requests. The base URLs can be set to a local server for testing.
+    The entries are returned together as one BibliographyData, to be added
+    to a session with DatabaseSession.add_entries().
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import Queue
+import socket
+import urllib
+import hashlib
+import httplib
+import argparse
+import threading
+import urlparse
+from multiprocessing.pool import ThreadPool
+
+import duplicates
+import instrument
+import loader
+
+__author__ = 'Jens-Kristian Krogager'
+
+doi_url = 'https://api.crossref.org/works/%s/transform/application/x-bibtex'
+ads_url = 'https://api.adsabs.harvard.edu/v1/export/bibtex'
+ads_batch_size = 100
+cache_directory = os.path.join(os.path.expanduser('~'), '.pybib', 'http_cache')
+user_agent = 'PyBib (https://github.com/jkrogager/PyBib)'
+
+doi_pattern = re.compile(r'^10\.\d{4,9}/\S+$')
+bibcode_pattern = re.compile(r'^\d{4}[A-Za-z&.][\w&.]{13}[A-Z.]$')
+
+
+class FetchError(Exception):
+    pass
+
+
+def parse_identifier(text):
+    """
+    Return ('doi', doi) or ('bibcode', bibcode) for a DOI, bibcode, doi.org
+    or ADS URL. Raises ValueError for anything else.
+    """
+    text = text.strip()
+    match = duplicates.adsurl_bibcode.search(text)
+    if match:
+        text = urllib.unquote(match.group(1))
+    if bibcode_pattern.match(text):
+        return ('bibcode', text)
+    doi = duplicates.normalize_doi(text)
+    if doi_pattern.match(doi):
+        return ('doi', doi)
+    raise ValueError("Not a DOI or ADS bibcode: %s" % text)
+
+
+def read_ads_token():
+    token = os.environ.get('ADS_API_TOKEN')
+    if token:
+        return token.strip()
+    try:
+        with open(os.path.expanduser('~/.ads/dev_key')) as key_file:
+            return key_file.read().strip()
+    except IOError:
+        return None
+
+
+class ResponseCache(object):
+    """ Response bodies stored as files in `directory`, valid for `ttl` seconds. """
+
+    def __init__(self, directory=None, ttl=7 * 24 * 3600):
+        self.directory = directory or cache_directory
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    def filename(self, name):
+        return os.path.join(self.directory, hashlib.sha1(name.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, name):
+        """ Return the cached text of `name`, or None if missing or expired. """
+        try:
+            with open(self.filename(name)) as cache_file:
+                cached = json.load(cache_file)
+        except (IOError, ValueError):
+            return None
+        if cached.get('name') != name or time.time() - cached['time'] > self.ttl:
+            return None
+        return cached['text']
+
+    def put(self, name, text):
+        """ Store the text of `name`. Errors are reported but not raised, the response is just not cached. """
+        import writer
+        content = json.dumps({'name': name, 'time': time.time(), 'text': text})
+        try:
+            with self.lock:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+            writer.write_atomic(self.filename(name), content.decode('ascii'))
+        except (IOError, OSError) as error:
+            instrument.count('fetch.cache_errors')
+            sys.stderr.write("Could not cache %s: %s\n" % (name.encode('utf-8'), error))
+
+    def clear(self):
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.directory, name))
+
+
+class ConnectionPool(object):
+    """
+    Keep-alive HTTP(S) connections shared by threads, at most `max_idle`
+    idle connections per host. A request on a reused connection which was
+    closed by the server is sent again on a new connection.
+    """
+
+    def __init__(self, timeout=30, max_idle=8):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle = dict()
+        self.lock = threading.Lock()
+        self.created = 0
+
+    def get_connection(self, scheme, netloc):
+        with self.lock:
+            queue = self.idle.setdefault((scheme, netloc), Queue.LifoQueue(self.max_idle))
+        try:
+            return queue.get_nowait(), True
+        except Queue.Empty:
+            pass
+        with self.lock:
+            self.created += 1
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout), False
+        return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def release(self, scheme, netloc, connection):
+        try:
+            self.idle[(scheme, netloc)].put_nowait(connection)
+        except Queue.Full:
+            connection.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """ Send a request and return (status, body). Raises FetchError if the server cannot be reached. """
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers or {})
+        headers.setdefault('User-Agent', user_agent)
+        while True:
+            connection, reused = self.get_connection(parts.scheme, parts.netloc)
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error) as error:
+                connection.close()
+                if reused:
+                    continue
+                raise FetchError("%s: %s" % (url, error))
+            if response.getheader('connection', '').lower() == 'close':
+                connection.close()
+            else:
+                self.release(parts.scheme, parts.netloc, connection)
+            return response.status, data
+
+    def close(self):
+        with self.lock:
+            for queue in self.idle.values():
+                while not queue.empty():
+                    queue.get_nowait().close()
+            self.idle.clear()
+
+
+class FetchResult(object):
+    """ Fetched entries as a BibliographyData and a dictionary of identifier -> error message. """
+
+    def __init__(self, bib_database, failed):
+        self.bib_database = bib_database
+        self.failed = failed
+
+    def summary(self):
+        message = "%i entries fetched" % len(self.bib_database.entries)
+        if self.failed:
+            message += ", %i failed" % len(self.failed)
+        return message
+
+
+class MetadataFetcher(object):
+    """
+    Resolve DOIs and bibcodes to BibTeX with `workers` concurrent requests.
+    `cache` is a ResponseCache, or None to always fetch.
+    """
+
+    def __init__(self, workers=4, cache=None, pool=None, doi_url=doi_url, ads_url=ads_url,
+                 ads_token=None):
+        self.workers = workers
+        self.cache = cache
+        self.pool = pool or ConnectionPool()
+        self.doi_url = doi_url
+        self.ads_url = ads_url
+        self.ads_token = ads_token if ads_token is not None else read_ads_token()
+
+    def cached(self, name):
+        if self.cache is None:
+            return None
+        return self.cache.get(name)
+
+    def store(self, name, text):
+        if self.cache is not None:
+            self.cache.put(name, text)
+
+    def fetch_doi(self, doi):
+        """ Return the BibTeX text of a DOI. Raises FetchError. """
+        name = 'doi:' + doi
+        text = self.cached(name)
+        if text is not None:
+            return text
+        url = self.doi_url % urllib.quote(doi.encode('utf-8'), safe='/')
+        status, data = self.pool.request('GET', url, headers={'Accept': 'application/x-bibtex'})
+        if status != 200:
+            raise FetchError("HTTP %i" % status)
+        text = data.decode('utf-8')
+        self.store(name, text)
+        return text
+
+    def fetch_bibcodes(self, bibcodes):
+        """ Return a dictionary of bibcode -> BibTeX text. Raises FetchError. """
+        texts = dict()
+        missing = list()
+        for bibcode in bibcodes:
+            text = self.cached('bibcode:' + bibcode)
+            if text is None:
+                missing.append(bibcode)
+            else:
+                texts[bibcode] = text
+        if not missing:
+            return texts
+        if not self.ads_token:
+            raise FetchError("No ADS API token, set $ADS_API_TOKEN")
+
+        headers = {'Authorization': 'Bearer ' + self.ads_token,
+                   'Content-Type': 'application/json'}
+        status, data = self.pool.request('POST', self.ads_url, json.dumps({'bibcode': missing}),
+                                         headers)
+        if status != 200:
+            raise FetchError("HTTP %i" % status)
+        export = json.loads(data.decode('utf-8'))['export']
+        # ADS uses the bibcode as the key of each entry:
+        for entry_type, key, start, end in loader.scan_entries(export):
+            if key in missing:
+                texts[key] = export[start:end]
+                self.store('bibcode:' + key, texts[key])
+        return texts
+
+    def run_job(self, job):
+        """ Run one request. Returns a list of (identifier, BibTeX text or None, error). """
+        id_type, values = job
+        try:
+            if id_type == 'doi':
+                return [(values, self.fetch_doi(values), None)]
+            texts = self.fetch_bibcodes(values)
+        except (FetchError, ValueError, KeyError) as error:
+            if id_type == 'doi':
+                return [(values, None, unicode(error))]
+            return [(bibcode, None, unicode(error)) for bibcode in values]
+        return [(bibcode, texts.get(bibcode), None if bibcode in texts else u"Not found")
+                for bibcode in values]
+
+    def fetch(self, identifiers):
+        """
+        Fetch the entries of a list of DOIs, bibcodes or their URLs.
+        Returns a FetchResult with all fetched entries in one BibliographyData.
+        """
+        from pybtex.database import BibliographyData
+        from pybtex.exceptions import PybtexError
+        failed = dict()
+        dois = list()
+        bibcodes = list()
+        for text in identifiers:
+            try:
+                id_type, value = parse_identifier(text)
+            except ValueError as error:
+                failed[text] = unicode(error)
+                continue
+            target = dois if id_type == 'doi' else bibcodes
+            if value not in target:
+                target.append(value)
+
+        jobs = [('doi', doi) for doi in dois]
+        jobs += [('bibcode', bibcodes[start:start + ads_batch_size])
+                 for start in range(0, len(bibcodes), ads_batch_size)]
+        bib_database = BibliographyData()
+        if not jobs:
+            return FetchResult(bib_database, failed)
+
+        pool = ThreadPool(min(self.workers, len(jobs)))
+        try:
+            for results in pool.imap_unordered(self.run_job, jobs):
+                for identifier, text, error in results:
+                    if text is None:
+                        failed[identifier] = error
+                        continue
+                    try:
+                        loader.merge_into(bib_database, loader.parse_job((u'', text)))
+                    except PybtexError as parse_error:
+                        failed[identifier] = unicode(parse_error)
+        finally:
+            pool.close()
+            pool.join()
+        return FetchResult(bib_database, failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch BibTeX entries of DOIs and ADS bibcodes")
+    parser.add_argument('identifiers', nargs='+', help="DOIs, bibcodes or their URLs")
+    parser.add_argument('-o', '--output', default=None, help="Output file (default: stdout)")
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help="Number of concurrent requests (default: 4)")
+    parser.add_argument('--ttl', type=float, default=7, help="Days to keep cached responses")
+    parser.add_argument('--no-cache', action='store_true', help="Do not use the response cache")
+    parser.add_argument('--doi-url', default=doi_url, help="URL of a DOI with %%s for the DOI")
+    parser.add_argument('--ads-url', default=ads_url, help="URL of the ADS BibTeX export")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else ResponseCache(ttl=args.ttl * 24 * 3600)
+    fetcher = MetadataFetcher(args.workers, cache, doi_url=args.doi_url, ads_url=args.ads_url)
+    result = fetcher.fetch([identifier.decode('utf-8') for identifier in args.identifiers])
+    fetcher.pool.close()
+
+    text = result.bib_database.to_string('bibtex')
+    if args.output:
+        output = io.open(args.output, 'w', encoding='utf-8')
+    else:
+        output = io.open(sys.stdout.fileno(), 'w', encoding='utf-8', closefd=False)
+    with output:
+        output.write(text)
+    for identifier, error in sorted(result.failed.items()):
+        sys.stderr.write((u"%s: %s\n" % (identifier, error)).encode('utf-8'))
+    sys.stderr.write(result.summary() + '\n')
+    return 1 if result.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
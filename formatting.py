@@ -6,7 +6,9 @@
 """
 
 # from pylatexenc import latexencode
-from pylatexenc import latex2text
+
+import texconvert
+from rendercache import LRUCache
 
 journal_transform = {'aj': u'AJ',
                      'araa': u'ARA&A',
@@ -24,6 +26,10 @@ journal_transform = {'aj': u'AJ',
                      'aplett': u'Astrophys. Lett.'}
 
 
+# Converted author names, shared by all entries:
+author_cache = LRUCache(maxsize=20000)
+
+
 all_bibtex_fields = [
     'author',
     'title',
@@ -93,18 +99,25 @@ def clean_string(string):
     return string.strip()
 
 
-def format_author_list(bib_entry, Nshow=3, Nmax=8, showAll=False):
-    """ Convert the BibTeX name list to real text: """
-
-    author_list = bib_entry.fields['author'].split(' and ')
-    authors = list()
-    for author_field in author_list:
+def format_author(author_field):
+    """ Convert a single BibTeX author name to clean Unicode text. """
+    unicode_author = author_cache.get(author_field)
+    if unicode_author is None:
         # Convert LaTeX to Unicode
         if '\\' in author_field:
-            unicode_author = latex2text.latex2text(author_field)
+            unicode_author = texconvert.latex2text(author_field)
         else:
             unicode_author = author_field
-        authors.append(clean_string(unicode_author))
+        unicode_author = clean_string(unicode_author)
+        author_cache.put(author_field, unicode_author)
+    return unicode_author
+
+
+def format_author_list(bib_entry, Nshow=3, Nmax=8, showAll=False):
+    """ Convert the BibTeX name list to real text: """
+
+    author_list = bib_entry.fields['author'].split(' and ')
+    authors = [format_author(author_field) for author_field in author_list]
 
     if showAll:
         if len(authors) == 1:
@@ -150,7 +163,16 @@ def format_journal_name(bib_entry):
     return field_text
 
 
-def format_reference(bib_entry, Nshow=3, Nmax=8):
+def normalize_journal(name):
+    """ Lowercase and remove everything but letters and digits: 'A&A' -> 'aa'. """
+    return u''.join(char for char in name.lower() if char.isalnum())
+
+
+def format_reference(bib_entry, Nshow=3, Nmax=8, warnings=None):
+    """
+    Format the entry as a short reference. If `warnings` is a list, entry
+    types without a defined format are reported there instead of printed.
+    """
     # Handle different entry types:
     bibitem = bib_entry.fields
     if bib_entry.type.lower() == 'article':
@@ -195,6 +217,9 @@ def format_reference(bib_entry, Nshow=3, Nmax=8):
             biblist = (author, year, title, editor, booktitle)
             ref = u"{} ({}), {}. In {} {}, {}".format(*biblist)
 
+        else:
+            ref = u"{} ({}), {}. In {}".format(author, year, title, booktitle)
+
     elif bib_entry.type.lower() == 'inbook':
         if 'author' in bibitem.keys():
             author = format_author_list(bib_entry, Nshow, Nmax)
@@ -219,12 +244,44 @@ def format_reference(bib_entry, Nshow=3, Nmax=8):
 
     else:
         ref = u"Reference format not defined for type: " + bib_entry.type
-        print u"\n  Reference format is not defined for type: " + bib_entry.type
-        print u"  Add definition in function 'bibtex.format_reference'\n"
+        if warnings is not None:
+            warnings.append((bib_entry.key, bib_entry.type))
+        else:
+            print u"\n  Reference format is not defined for type: " + bib_entry.type
+            print u"  Add definition in function 'bibtex.format_reference'\n"
 
     return ref
 
 
+def format_entry_view(bib_entry, field_names):
+    """ Return the display text of each of `field_names` for the entry view. """
+    entry_view = list()
+    for name in field_names:
+        if name.lower() == 'author':
+            field_text = format_author_list(bib_entry, showAll=True)
+
+        elif name.lower() in bib_entry.fields.keys():
+            if name.lower() == 'journal':
+                # Convert the LaTeX shorthand to real text:
+                field_text = format_journal_name(bib_entry)
+
+            elif name.lower() == 'adsurl':
+                urlLink = bib_entry.fields[name.lower()].replace('\n', ' ')
+                urlText = format_reference(bib_entry, 1, 2)
+                field_text = "<a href=\"%s\">%s</a>" % (urlLink, urlText)
+
+            else:
+                field_text = bib_entry.fields[name.lower()].replace('\n', ' ')
+                field_text = clean_string(field_text)
+
+        else:
+            field_text = ''
+
+        entry_view.append(field_text)
+
+    return entry_view
+
+
 def format_author_name(name_dict):
     """
     Input expected is a dictionary containing a full name in BibTeX style, e.g.:
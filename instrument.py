@@ -0,0 +1,191 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Timing spans and counters for the hot paths of PyBib.
+    Instrumentation is off by default. Functions decorated with traced()
+    and `with span(...)` blocks then only check a module flag, and count()
+    returns at once, so the cost is a function call.
+    Once enabled, every span records its duration and the statistics per
+    name (calls, total, mean and max time) are shown by report(). The spans
+    and counters can be exported to a trace file in the Chrome trace event
+    format, which chrome://tracing and https://ui.perfetto.dev can open.
+
+    Set the environment variable PYBIB_TRACE to a file name to enable the
+    instrumentation at start-up and write the trace when Python exits.
+"""
+
+import os
+import json
+import time
+import atexit
+import thread
+import threading
+from functools import wraps
+
+__author__ = 'Jens-Kristian Krogager'
+
+enabled = False
+
+# Trace events are not recorded beyond this number, statistics still are:
+max_events = 200000
+
+_events = list()
+_stats = dict()
+_counters = dict()
+_state = threading.local()
+_t0 = time.time()
+last_span = None
+
+
+class SpanStats(object):
+    """ Number of calls, total and maximum duration in seconds of one span name. """
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, duration):
+        self.calls += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+
+class NullSpan(object):
+    """ Span used while disabled. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class Span(object):
+
+    def __init__(self, name, args=None):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        _state.depth = getattr(_state, 'depth', 0) + 1
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        global last_span
+        end = time.time()
+        _state.depth -= 1
+        duration = end - self.start
+        stats = _stats.get(self.name)
+        if stats is None:
+            stats = _stats[self.name] = SpanStats()
+        stats.add(duration)
+        last_span = (self.name, duration)
+        if len(_events) < max_events:
+            event = {'name': self.name, 'ph': 'X', 'pid': os.getpid(), 'tid': thread.get_ident(),
+                     'ts': (self.start - _t0) * 1e6, 'dur': duration * 1e6}
+            if self.args:
+                event['args'] = self.args
+            _events.append(event)
+            if _state.depth == 0 and _counters:
+                # Counter values after each outermost span:
+                _events.append({'name': 'counters', 'ph': 'C', 'pid': os.getpid(),
+                                'ts': (end - _t0) * 1e6, 'args': dict(_counters)})
+        return False
+
+
+_null_span = NullSpan()
+
+
+def span(name, **args):
+    """ Context manager timing the block as `name`. Keyword arguments are stored in the trace. """
+    if not enabled:
+        return _null_span
+    return Span(name, args)
+
+
+def traced(name):
+    """ Decorator timing each call of the function as a span `name`. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """ Add `n` to the counter `name`. """
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    global _t0, last_span
+    del _events[:]
+    _stats.clear()
+    _counters.clear()
+    _t0 = time.time()
+    last_span = None
+
+
+def counters():
+    return dict(_counters)
+
+
+def statistics():
+    """ Dictionary of span name -> SpanStats. """
+    return dict(_stats)
+
+
+def report(caches=None):
+    """
+    Text table of the span statistics and counters. `caches` is an optional
+    dictionary of name -> rendercache.LRUCache whose hit rates are added.
+    """
+    lines = ["%-28s %7s %10s %10s %10s" % ('span', 'calls', 'total', 'mean', 'max')]
+    for name, stats in sorted(_stats.items(), key=lambda item: -item[1].total):
+        lines.append("%-28s %7i %8.1fms %8.2fms %8.1fms" % (name, stats.calls, 1000 * stats.total,
+                                                              1000 * stats.total / stats.calls,
+                                                              1000 * stats.max))
+    if _counters:
+        lines.append("")
+        lines.append("%-28s %7s" % ('counter', 'value'))
+        for name, value in sorted(_counters.items()):
+            lines.append("%-28s %7i" % (name, value))
+    if caches:
+        lines.append("")
+        lines.append("%-28s %7s %10s %10s" % ('cache', 'size', 'hits', 'misses'))
+        for name, cache in sorted(caches.items()):
+            lines.append("%-28s %7i %10i %10i" % (name, len(cache), cache.hits, cache.misses))
+    if len(_events) >= max_events:
+        lines.append("")
+        lines.append("Trace is full, only the first %i events are kept." % max_events)
+    return '\n'.join(lines)
+
+
+def export_trace(filename):
+    """ Write the recorded spans and counters in the Chrome trace event format. """
+    metadata = {'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'args': {'name': 'PyBib'}}
+    with open(filename, 'w') as trace_file:
+        json.dump({'traceEvents': [metadata] + _events, 'displayTimeUnit': 'ms'}, trace_file)
+
+
+if os.environ.get('PYBIB_TRACE'):
+    enable()
+    atexit.register(export_trace, os.environ['PYBIB_TRACE'])
@@ -0,0 +1,94 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Undo/redo journal of entry edits.
+    Every edit is stored as a list of field-level deltas
+    (key, field, old value, new value), so the memory used grows with the
+    number of changed fields and not with the size of the entries. The
+    old value of an added field is None, undoing the edit removes it.
+    Person fields (author, editor) are stored as their ' and '-joined names.
+"""
+
+
+def field_value(bib_entry, field):
+    """ Return the text of `field` in the entry, or None if not present. """
+    if field in bib_entry.persons.keys():
+        return u' and '.join(unicode(person) for person in bib_entry.persons[field])
+    elif field in bib_entry.fields.keys():
+        return bib_entry.fields[field]
+    return None
+
+
+def set_field_value(bib_entry, field, value):
+    """ Set the text of `field` in the entry. A value of None removes the field. """
+    from pybtex.database import Person
+    if value is None:
+        remove_field(bib_entry, field)
+    elif field in bib_entry.persons.keys() or field.lower() in Person.valid_roles:
+        bib_entry.persons[field] = [Person(name) for name in value.split(' and ')]
+    else:
+        bib_entry.fields[field] = value
+
+
+def remove_field(bib_entry, field):
+    """ Remove a field or person role. The dictionaries of pybtex do not support `del`. """
+    from pybtex.database import FieldDict
+    from pybtex.utils import OrderedCaseInsensitiveDict
+    lower_field = field.lower()
+    if field in bib_entry.persons:
+        bib_entry.persons = OrderedCaseInsensitiveDict([(role, persons) for role, persons
+                                                        in bib_entry.persons.items()
+                                                        if role.lower() != lower_field])
+    if field in bib_entry.fields:
+        bib_entry.fields = FieldDict(bib_entry, [(name, value) for name, value in bib_entry.fields.items()
+                                                 if name.lower() != lower_field])
+
+
+class EditJournal(object):
+    """ Stacks of edit steps, each step being a list of deltas applied together. """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.undo_stack = list()
+        self.redo_stack = list()
+
+    def record(self, deltas):
+        """ Add a step of (key, field, old, new) deltas. Clears the redo history. """
+        if deltas:
+            self.undo_stack.append(list(deltas))
+            self.redo_stack = list()
+
+    def forget(self, keys):
+        """ Remove the deltas of the given keys, e.g., after the entries were reloaded. """
+        keys = set(keys)
+        for stack in (self.undo_stack, self.redo_stack):
+            steps = [[delta for delta in deltas if delta[0] not in keys] for deltas in stack]
+            stack[:] = [deltas for deltas in steps if deltas]
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self, bib_database):
+        """ Revert the last step in `bib_database`. Returns the keys of the changed entries. """
+        if not self.undo_stack:
+            return []
+        deltas = self.undo_stack.pop()
+        for key, field, old, new in reversed(deltas):
+            set_field_value(bib_database.entries[key], field, old)
+        self.redo_stack.append(deltas)
+        return [key for key, field, old, new in deltas]
+
+    def redo(self, bib_database):
+        """ Apply the last undone step again. Returns the keys of the changed entries. """
+        if not self.redo_stack:
+            return []
+        deltas = self.redo_stack.pop()
+        for key, field, old, new in deltas:
+            set_field_value(bib_database.entries[key], field, new)
+        self.undo_stack.append(deltas)
+        return [key for key, field, old, new in deltas]
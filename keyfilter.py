@@ -0,0 +1,146 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Incremental substring filter over the list of entry keys.
+    Keys are lowercased once and indexed by their trigrams. When a query
+    extends the previous one, only the previous result set is re-checked.
+"""
+
+from bisect import insort
+
+import instrument
+
+
+def trigrams(text):
+    return set(text[i:i+3] for i in range(len(text) - 2))
+
+
+def runs(indices):
+    """ Group ascending indices into (first, last) runs of consecutive numbers. """
+    result = list()
+    for num in indices:
+        if result and result[-1][1] == num - 1:
+            result[-1] = (result[-1][0], num)
+        else:
+            result.append((num, num))
+    return result
+
+
+def row_changes(old, new, max_runs=100):
+    """
+    Compare two ascending lists of positions, e.g. two filter results.
+    Returns the runs (first, last) of rows of `old` to remove and the runs
+    of rows of `new` to insert afterwards, or None if either list is not
+    ascending or there are more than `max_runs` runs, in which case a full
+    update is cheaper.
+    """
+    for rows in (old, new):
+        if any(rows[num] >= rows[num + 1] for num in xrange(len(rows) - 1)):
+            return None
+    new_set = set(new)
+    old_set = set(old)
+    removed = runs([num for num, position in enumerate(old) if position not in new_set])
+    inserted = runs([num for num, position in enumerate(new) if position not in old_set])
+    if len(removed) + len(inserted) > max_runs:
+        return None
+    return removed, inserted
+
+
+class KeyFilter(object):
+    """
+    Filter a sorted list of keys by case-insensitive substring match.
+    Results are lists of positions in `keys`, restricted to the current
+    scope (e.g., the result of a content search) and in ascending order,
+    or in the order of the scope if it was set with `ordered=True`.
+    """
+
+    def __init__(self, keys=()):
+        self.set_keys(keys)
+
+    def set_keys(self, keys):
+        self.keys = list()
+        self.position = dict()
+        self.trigram_index = dict()
+        self.add_keys(keys)
+
+    def add_keys(self, keys):
+        """ Insert new keys in sorted order. Only the new keys are indexed. """
+        new_keys = [key for key in keys if key not in self.position]
+        if len(new_keys) > len(self.keys) / 8:
+            self.keys = sorted(self.keys + new_keys)
+        else:
+            for key in new_keys:
+                insort(self.keys, key)
+        self.lower_keys = [key.lower() for key in self.keys]
+        self.position = dict((key, num) for num, key in enumerate(self.keys))
+        # Trigrams map to keys, not positions, so they stay valid when keys are inserted:
+        for key in new_keys:
+            for trigram in trigrams(key.lower()):
+                self.trigram_index.setdefault(trigram, set()).add(key)
+        self.set_scope(None)
+
+    def remove_keys(self, keys):
+        removed = set(keys)
+        for key in removed:
+            for trigram in trigrams(key.lower()):
+                self.trigram_index[trigram].discard(key)
+        self.keys = [key for key in self.keys if key not in removed]
+        self.lower_keys = [key.lower() for key in self.keys]
+        self.position = dict((key, num) for num, key in enumerate(self.keys))
+        self.set_scope(None)
+
+    def set_scope(self, keys=None, ordered=False):
+        """
+        Restrict the filter to the given keys. `None` selects all keys.
+        If `ordered` is True, results keep the order of `keys` (e.g., ranked).
+        """
+        self.ordered = ordered and keys is not None
+        if keys is None:
+            self.scope = range(len(self.keys))
+            self.scope_set = None
+        else:
+            self.scope = [self.position[key] for key in keys if key in self.position]
+            if not self.ordered:
+                self.scope.sort()
+            self.scope_set = set(self.scope)
+        self.reset()
+
+    def reset(self):
+        self.last_query = None
+        self.last_result = self.scope
+
+    def candidates(self, query):
+        """ Return the indices that can contain `query`, using the previous result when possible. """
+        if self.last_query is not None and self.last_query in query:
+            return self.last_result
+
+        if len(query) < 3:
+            return self.scope
+
+        postings = sorted((self.trigram_index.get(trigram, set()) for trigram in trigrams(query)),
+                          key=len)
+        matching_keys = set(postings[0])
+        for posting in postings[1:]:
+            matching_keys &= posting
+            if not matching_keys:
+                break
+        position = self.position
+        matches = set(position[key] for key in matching_keys)
+        if self.scope_set is not None:
+            matches &= self.scope_set
+        if self.ordered:
+            return [num for num in self.scope if num in matches]
+        return sorted(matches)
+
+    def filter(self, text):
+        query = text.lower()
+        if query:
+            lower_keys = self.lower_keys
+            candidates = self.candidates(query)
+            instrument.count('keyfilter.scanned', len(candidates))
+            result = [num for num in candidates if query in lower_keys[num]]
+        else:
+            result = self.scope
+        self.last_query = query
+        self.last_result = result
+        return result
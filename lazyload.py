@@ -0,0 +1,290 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Lazy loading of BibTeX files.
+    A LazyDatabase memory-maps the file and only scans it for the position
+    and key of every entry, which is much faster than parsing it. An entry
+    is parsed by pybtex when it is first looked up, and kept. A background
+    thread can parse the remaining entries in small batches, so the file
+    is fully parsed after a while without blocking the caller.
+    A LazyDatabase can be used in place of a pybtex BibliographyData by
+    the session, see DatabaseSession.open_lazy().
+"""
+
+import mmap
+import time
+import threading
+
+from pybtex.database import BibliographyData
+from pybtex.database.input import bibtex
+
+import loader
+
+__author__ = 'Jens-Kristian Krogager'
+
+
+class LazyEntries(object):
+    """
+    Ordered, case-insensitive mapping of key -> entry like the `entries` of
+    a BibliographyData, parsing entries from the file when looked up.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self._order = list()
+        # Removed keys are dropped from the order when it is next read:
+        self.n_removed = 0
+        self.offsets = dict()
+        self.parsed = dict()
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, key):
+        lower_key = key.lower()
+        return lower_key in self.offsets or lower_key in self.parsed
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __delitem__(self, key):
+        """ Remove an entry. Its text stays in the mapped file but is never parsed. """
+        lower_key = key.lower()
+        if lower_key not in self:
+            raise KeyError(key)
+        with self.database.lock:
+            self.offsets.pop(lower_key, None)
+            self.parsed.pop(lower_key, None)
+            self.n_removed += 1
+
+    @property
+    def order(self):
+        """ Keys in file order, followed by added keys. """
+        if self.n_removed:
+            self._order = [key for key in self._order if key in self]
+            self.n_removed = 0
+        return self._order
+
+    def keys(self):
+        return list(self.order)
+
+    def iterkeys(self):
+        return iter(self.order)
+
+    def __getitem__(self, key):
+        lower_key = key.lower()
+        bib_entry = self.parsed.get(lower_key)
+        if bib_entry is None:
+            if lower_key not in self.offsets:
+                raise KeyError(key)
+            self.database.parse_keys([key])
+            bib_entry = self.parsed[lower_key]
+        return bib_entry
+
+    def __setitem__(self, key, bib_entry):
+        lower_key = key.lower()
+        if lower_key not in self.offsets and lower_key not in self.parsed:
+            self.order.append(key)
+        bib_entry.key = key
+        bib_entry.collection = self.database
+        self.parsed[lower_key] = bib_entry
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def iteritems(self):
+        """ Yield (key, entry) in file order, parsing the entries not parsed yet. """
+        for key in self.order:
+            yield key, self[key]
+
+    def itervalues(self):
+        for key, bib_entry in self.iteritems():
+            yield bib_entry
+
+    def items(self):
+        self.database.parse_all()
+        return list(self.iteritems())
+
+    def values(self):
+        self.database.parse_all()
+        return list(self.itervalues())
+
+
+class LazyDatabase(object):
+    """
+    BibliographyData-like view of a BibTeX file whose entries are parsed on
+    demand. Call start_warming() to parse the other entries in a thread.
+    """
+
+    def __init__(self, filename, batch_size=50):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.entries = LazyEntries(self)
+        self.lock = threading.RLock()
+        self.thread = None
+        self.stop_warming = threading.Event()
+        self.error = None
+        self.macros = list()
+        self.preamble_commands = list()
+        self._parsed_preamble = None
+        self.parser = None
+
+        with open(filename, 'rb') as bibtex_file:
+            try:
+                self.data = mmap.mmap(bibtex_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped:
+                self.data = b''
+        self.scan()
+
+    def scan(self):
+        """ Find the position and key of each entry in the mapped file. """
+        entries = self.entries
+        for entry_type, key, start, end in loader.scan_entries(self.data):
+            if key is None:
+                entry_type = entry_type.lower()
+                if entry_type == 'string':
+                    self.macros.append((start, end))
+                elif entry_type == 'preamble':
+                    self.preamble_commands.append((start, end))
+                continue
+            key = key.decode('utf-8')
+            lower_key = key.lower()
+            # pybtex keeps the first of repeated keys:
+            if lower_key not in entries.offsets:
+                entries.offsets[lower_key] = (start, end)
+                entries.order.append(key)
+
+    def text(self, start, end):
+        return self.data[start:end].decode('utf-8')
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_parser(self):
+        """ pybtex parser with all @string macros of the file defined. """
+        if self.parser is None:
+            self.parser = bibtex.Parser()
+            if self.macros:
+                self.parser.parse_string(u'\n'.join(self.text(start, end)
+                                                    for start, end in self.macros))
+        return self.parser
+
+    # -- Parsing:
+    def parse_keys(self, keys):
+        """ Parse the entries of `keys` which are not parsed yet. """
+        with self.lock:
+            entries = self.entries
+            lower_keys = [key.lower() for key in keys]
+            positions = sorted(set(entries.offsets[lower_key] for lower_key in lower_keys
+                                   if lower_key not in entries.parsed and
+                                   lower_key in entries.offsets))
+            if not positions:
+                return
+            parser = self.get_parser()
+            parser.data = BibliographyData()
+            parsed = parser.parse_string(u'\n'.join(self.text(start, end) for start, end in positions))
+            for key, bib_entry in parsed.entries.items():
+                lower_key = key.lower()
+                if lower_key in entries.offsets and lower_key not in entries.parsed:
+                    bib_entry.collection = self
+                    entries.parsed[lower_key] = bib_entry
+            # Entries skipped by pybtex cannot be looked up:
+            for lower_key in lower_keys:
+                if lower_key in entries.offsets and lower_key not in entries.parsed:
+                    raise KeyError("Cannot parse entry: %s" % lower_key)
+
+    def unparsed_keys(self):
+        parsed = self.entries.parsed
+        return [key for key in self.entries.order if key.lower() not in parsed]
+
+    def is_parsed(self, key):
+        return key.lower() in self.entries.parsed
+
+    @property
+    def parsed_count(self):
+        return len(self.entries.parsed)
+
+    def parse_all(self):
+        self.parse_keys(self.unparsed_keys())
+
+    # -- Background parsing:
+    def start_warming(self):
+        """ Parse the remaining entries in a daemon thread, `batch_size` at a time. """
+        if self.thread is not None:
+            return
+        self.stop_warming.clear()
+        self.thread = threading.Thread(target=self.warm, name='LazyDatabase.warm')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def warm(self):
+        keys = self.unparsed_keys()
+        for start in range(0, len(keys), self.batch_size):
+            if self.stop_warming.is_set():
+                break
+            try:
+                self.parse_keys(keys[start:start + self.batch_size])
+            except Exception as error:
+                self.error = error
+                break
+            # Give the main thread the interpreter between batches:
+            time.sleep(0.001)
+        self.thread = None
+
+    def stop(self):
+        """ Stop the background parsing. """
+        self.stop_warming.set()
+        thread = self.thread
+        if thread is not None:
+            thread.join()
+
+    def close(self):
+        """ Stop the background parsing and unmap the file. Unparsed entries are lost. """
+        self.stop()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    # -- BibliographyData interface:
+    @property
+    def _preamble(self):
+        if self._parsed_preamble is None:
+            self._parsed_preamble = list()
+            if self.preamble_commands:
+                text = u'\n'.join(self.text(start, end) for start, end in self.preamble_commands)
+                with self.lock:
+                    parser = self.get_parser()
+                    parser.data = BibliographyData()
+                    self._parsed_preamble = list(parser.parse_string(text)._preamble)
+        return self._parsed_preamble
+
+    @_preamble.setter
+    def _preamble(self, values):
+        self._parsed_preamble = list(values)
+
+    @property
+    def preamble(self):
+        return ''.join(self._preamble)
+
+    def add_to_preamble(self, *values):
+        self._preamble.extend(values)
+
+    def add_entry(self, key, bib_entry):
+        if key in self.entries:
+            from pybtex.database import BibliographyDataError
+            from pybtex.errors import report_error
+            report_error(BibliographyDataError('repeated bibliograhpy entry: %s' % key))
+            return
+        self.entries[key] = bib_entry
+
+    def to_bibliography_data(self):
+        bib_database = BibliographyData()
+        bib_database.add_to_preamble(*self._preamble)
+        for key, bib_entry in self.entries.items():
+            bib_database.add_entry(key, bib_entry)
+        return bib_database
+
+    def to_string(self, bib_format):
+        return self.to_bibliography_data().to_string(bib_format)
@@ -0,0 +1,206 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Incremental loading of BibTeX files.
+    The file is split at top-level entry boundaries and parsed in chunks,
+    so entries can be handed to the caller in batches while parsing.
+    Large files can be parsed with a pool of processes, one chunk each.
+"""
+
+import io
+import re
+import multiprocessing
+
+from pybtex.database import BibliographyData
+from pybtex.database.input import bibtex
+
+import dbcache
+
+entry_start = re.compile(r'@\s*(\w+)\s*([{(])')
+braces = re.compile(r'[{}]')
+braces_and_parens = re.compile(r'[{}()]')
+
+
+def read_bibtex(filename, encoding='utf-8'):
+    # Keep the original line endings, they are written back on save:
+    with io.open(filename, 'r', encoding=encoding, newline='') as bibtex_file:
+        return bibtex_file.read()
+
+
+def find_entry_end(text, body_start, delimiter):
+    """
+    Return the position just after the closing delimiter of the entry whose
+    body starts at `body_start`. Unterminated entries run to the end of text.
+    """
+    depth = 0
+    if delimiter == '{':
+        for match in braces.finditer(text, body_start):
+            if match.group() == '{':
+                depth += 1
+            elif depth == 0:
+                return match.end()
+            else:
+                depth -= 1
+    else:
+        for match in braces_and_parens.finditer(text, body_start):
+            char = match.group()
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+            elif char == ')' and depth == 0:
+                return match.end()
+    return len(text)
+
+
+def scan_entries(text, start=0):
+    """
+    Find the top-level entries of a BibTeX text without parsing the fields.
+    Yields tuples of (entry_type, key, start, end) where `key` is None
+    for @string, @preamble and @comment commands.
+    """
+    pos = start
+    while True:
+        match = entry_start.search(text, pos)
+        if match is None:
+            return
+        entry_type, delimiter = match.groups()
+        body_start = match.end()
+        end = find_entry_end(text, body_start, delimiter)
+        if entry_type.lower() in ('string', 'preamble', 'comment'):
+            key = None
+        else:
+            comma = text.find(',', body_start, end)
+            # Entries without fields have no comma: @misc{key}
+            key = text[body_start:comma if comma >= 0 else end - 1].strip()
+        yield (entry_type, key, match.start(), end)
+        pos = end
+
+
+def split_chunks(text, chunk_size=200000, entries=None):
+    """
+    Return (start, end) of consecutive chunks of about `chunk_size`
+    characters, with every boundary at the start of a top-level entry.
+    `entries` is the output of scan_entries(text) if already known.
+    """
+    if entries is None:
+        entries = scan_entries(text)
+    chunks = list()
+    chunk_start = 0
+    for entry_type, key, start, end in entries:
+        if end - chunk_start >= chunk_size:
+            chunks.append((chunk_start, end))
+            chunk_start = end
+    if chunk_start < len(text):
+        chunks.append((chunk_start, len(text)))
+    return chunks
+
+
+def merge_into(bib_database, chunk_database):
+    """
+    Add the entries and preamble of a parsed chunk to `bib_database`.
+    Repeated keys are reported as by pybtex when parsing a single file.
+    Returns the list of (key, entry) which were added.
+    """
+    entries = list()
+    for key, entry in chunk_database.entries.items():
+        is_new = key not in bib_database.entries
+        bib_database.add_entry(key, entry)
+        if is_new:
+            entries.append((entry.key, entry))
+    bib_database.add_to_preamble(*chunk_database._preamble)
+    return entries
+
+
+def iter_batches(text, chunk_size=200000):
+    """
+    Parse `text` chunk by chunk. Yields (chunk_database, end) for each chunk,
+    where `end` is the position in `text` parsed so far. @string macros carry
+    over from one chunk to the next as for a single parse.
+    """
+    parser = bibtex.Parser()
+    for start, end in split_chunks(text, chunk_size):
+        parser.data = BibliographyData()
+        yield parser.parse_string(text[start:end]), end
+
+
+def parse_job(job):
+    """
+    Parse a job of chunk_jobs(), i.e., a tuple of the text of the @string
+    commands preceding a chunk and the chunk itself, into a BibliographyData.
+    """
+    macros_text, chunk = job
+    parser = bibtex.Parser()
+    if macros_text:
+        parser.parse_string(macros_text)
+        parser.data = BibliographyData()
+    return parser.parse_string(chunk)
+
+
+def parse_chunk(job):
+    """
+    Parse a job of chunk_jobs() in a worker process. The entries are
+    returned in the compact form of dbcache to keep pickling cheap.
+    """
+    chunk_database = parse_job(job)
+    entries = [dbcache.pack_entry(bib_entry) for bib_entry in chunk_database.entries.values()]
+    return entries, list(chunk_database._preamble)
+
+
+def chunk_jobs(text, chunk_size=1000000):
+    """
+    Split `text` into jobs for parse_chunk(). Returns the list of jobs and
+    the list of the end position of each chunk in `text`.
+    """
+    entries = list(scan_entries(text))
+    macros = [(start, text[start:end]) for entry_type, key, start, end in entries
+              if entry_type.lower() == 'string']
+    jobs = list()
+    ends = list()
+    for start, end in split_chunks(text, chunk_size, entries):
+        macros_text = '\n'.join(macro for macro_start, macro in macros if macro_start < start)
+        jobs.append((macros_text, text[start:end]))
+        ends.append(end)
+    return jobs, ends
+
+
+def iter_batches_parallel(text, processes=None, chunk_size=1000000):
+    """
+    Same as iter_batches() but the chunks are parsed by a pool of
+    `processes` worker processes (default: number of CPUs). Each chunk is
+    parsed with all @string macros defined before it in the file.
+    """
+    jobs, ends = chunk_jobs(text, chunk_size)
+    pool = multiprocessing.Pool(processes)
+    try:
+        for end, (packed_entries, preamble) in zip(ends, pool.imap(parse_chunk, jobs)):
+            chunk_database = BibliographyData()
+            for packed in packed_entries:
+                bib_entry = dbcache.unpack_entry(packed)
+                chunk_database.add_entry(bib_entry.key, bib_entry)
+            chunk_database.add_to_preamble(*preamble)
+            yield chunk_database, end
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def parse_text(text, chunk_size=200000, processes=1):
+    """
+    Parse all of `text` into a single BibliographyData.
+    If `processes` is not 1, the chunks are parsed in parallel.
+    """
+    if processes == 1:
+        batches = iter_batches(text, chunk_size)
+    else:
+        batches = iter_batches_parallel(text, processes, chunk_size)
+
+    bib_database = BibliographyData()
+    for chunk_database, end in batches:
+        merge_into(bib_database, chunk_database)
+    return bib_database
+
+
+def parse_file(filename, processes=1, chunk_size=200000):
+    return parse_text(read_bibtex(filename), chunk_size, processes)
@@ -1,14 +1,25 @@
 # -*- coding: UTF-8 -*-
 
 import sys
-import time
-import copy
+import sqlite3
+import multiprocessing
+from array import array
 
-from PyQt4 import QtGui  # , QtCore
-import pybtex
-import pybtex.database
+from PyQt4 import QtGui, QtCore
+from pybtex.exceptions import PybtexError
 
+import fetch
 import formatting
+import instrument
+import journal
+import keyfilter
+import loader
+import query
+import refparse
+import sqlstore
+import watcher
+import workspace
+import writer
 
 """
 This is a test app to learn GUI programming in Python using PyQT4
@@ -17,6 +28,133 @@ This is a test app to learn GUI programming in Python using PyQT4
 __author__ = 'Jens-Kristian Krogager'
 
 
+class EntryListModel(QtCore.QAbstractListModel):
+    """
+    List model over a fixed array of entry keys. The rows shown are given
+    by an array of positions into the key array, so filtering the list only
+    swaps that array instead of creating new items.
+    """
+
+    def __init__(self, parent=None):
+        super(EntryListModel, self).__init__(parent)
+        self.keys = list()
+        self.rows = array('l')
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if index.isValid() and role == QtCore.Qt.DisplayRole:
+            return QtCore.QVariant(self.keys[self.rows[index.row()]])
+        return QtCore.QVariant()
+
+    @instrument.traced('list.set_keys')
+    def set_keys(self, keys):
+        self.beginResetModel()
+        self.keys = list(keys)
+        self.rows = array('l', range(len(self.keys)))
+        self.endResetModel()
+
+    @instrument.traced('list.append_keys')
+    def append_keys(self, keys):
+        """ Add keys at the end of the key array and show them. """
+        first = len(self.rows)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(keys) - 1)
+        self.rows.extend(range(len(self.keys), len(self.keys) + len(keys)))
+        self.keys.extend(keys)
+        self.endInsertRows()
+
+    @instrument.traced('list.set_rows')
+    def set_rows(self, rows):
+        """
+        Show the keys at the given positions of the key array. Only the rows
+        which changed are removed and inserted, so the view keeps its
+        scroll position and selection; the model is reset if the rows are not
+        in key order (ranked results) or too many ranges changed.
+        """
+        changes = keyfilter.row_changes(self.rows, rows)
+        if changes is None:
+            self.beginResetModel()
+            self.rows = array('l', rows)
+            self.endResetModel()
+            return
+
+        removed, inserted = changes
+        # Remove from the end, so the rows of earlier ranges do not move:
+        for first, last in reversed(removed):
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            del self.rows[first:last + 1]
+            self.endRemoveRows()
+        # The remaining rows are in the order of `rows`, insert the new ones in order:
+        for first, last in inserted:
+            self.beginInsertRows(QtCore.QModelIndex(), first, last)
+            self.rows[first:first] = array('l', rows[first:last + 1])
+            self.endInsertRows()
+
+    def key(self, row):
+        return self.keys[self.rows[row]]
+
+
+class EntryListView(QtGui.QListView):
+    """ List view whose repaints are timed by the instrumentation. """
+
+    @instrument.traced('list.paint')
+    def paintEvent(self, event):
+        super(EntryListView, self).paintEvent(event)
+
+
+class LoaderThread(QtCore.QThread):
+    """
+    Parse a BibTeX file in the background and emit the entries in batches.
+    Files larger than `parallel_size` characters are parsed by a process pool.
+    """
+    parallel_size = 4000000
+    batch_loaded = QtCore.pyqtSignal(object)
+    progress = QtCore.pyqtSignal(int)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, filename, parent=None):
+        super(LoaderThread, self).__init__(parent)
+        self.filename = filename
+        self.source_file = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            text = loader.read_bibtex(self.filename)
+            if len(text) > self.parallel_size and multiprocessing.cpu_count() > 1:
+                batches = loader.iter_batches_parallel(text)
+            else:
+                batches = loader.iter_batches(text)
+            for chunk_database, end in batches:
+                if self.cancelled:
+                    return
+                self.batch_loaded.emit(chunk_database)
+                self.progress.emit(100 * end // max(len(text), 1))
+            # Keep the original text and entry positions for incremental saving:
+            self.source_file = writer.SourceFile(text)
+        except (PybtexError, IOError, UnicodeDecodeError) as error:
+            self.failed.emit(unicode(error))
+
+
+class FetchThread(QtCore.QThread):
+    """ Fetch the BibTeX entries of DOIs and ADS bibcodes in the background. """
+    fetched = QtCore.pyqtSignal(object)
+
+    def __init__(self, fetcher, identifiers, parent=None):
+        super(FetchThread, self).__init__(parent)
+        self.fetcher = fetcher
+        self.identifiers = identifiers
+
+    def run(self):
+        self.fetched.emit(self.fetcher.fetch(self.identifiers))
+
+
 class Window(QtGui.QMainWindow):
 
     def __init__(self):
@@ -34,6 +172,15 @@ class Window(QtGui.QMainWindow):
         openFile.setStatusTip("Open File")
         openFile.triggered.connect(self.file_open)
 
+        addFile = QtGui.QAction("&Add File", self)
+        addFile.setShortcut("Ctrl+Shift+O")
+        addFile.setStatusTip("Add the entries of another file")
+        addFile.triggered.connect(self.file_add)
+
+        openedFiles = QtGui.QAction("Opened &Files", self)
+        openedFiles.setStatusTip("List the opened files and skipped duplicate entries")
+        openedFiles.triggered.connect(self.show_opened_files)
+
         saveFile = QtGui.QAction("&Save File", self)
         saveFile.setShortcut("Ctrl+S")
         saveFile.setStatusTip("Save File")
@@ -56,23 +203,124 @@ class Window(QtGui.QMainWindow):
         self.editEntry.setStatusTip("Edit the content of the current entry")
         self.editEntry.triggered.connect(self.create_edit_window)
 
+        self.undoAction = QtGui.QAction("&Undo Edit", self)
+        self.undoAction.setShortcut("Ctrl+Z")
+        self.undoAction.setStatusTip("Undo the last change of an entry")
+        self.undoAction.triggered.connect(self.undo_edit)
+
+        self.redoAction = QtGui.QAction("&Redo Edit", self)
+        self.redoAction.setShortcut("Ctrl+Shift+Z")
+        self.redoAction.setStatusTip("Redo the last undone change of an entry")
+        self.redoAction.triggered.connect(self.redo_edit)
+
+        self.fetchAction = QtGui.QAction("&Fetch from DOI/ADS", self)
+        self.fetchAction.setStatusTip("Add entries from a list of DOIs or ADS bibcodes")
+        self.fetchAction.triggered.connect(self.fetch_entries)
+
+        self.pasteAction = QtGui.QAction("Add from &Text", self)
+        self.pasteAction.setStatusTip("Add entries from pasted references, one per line")
+        self.pasteAction.triggered.connect(self.create_paste_window)
+
+        debugAction = QtGui.QAction("&Timings", self)
+        debugAction.setStatusTip("Record and show the time spent in loading, searching and display")
+        debugAction.triggered.connect(self.show_debug_panel)
+
+        self.compactAction = QtGui.QAction("&Compact Storage", self)
+        self.compactAction.setCheckable(True)
+        self.compactAction.setStatusTip("Keep entries packed in memory, for very large libraries "
+                                        "(from the next opened file)")
+        self.compactAction.toggled.connect(self.set_compact_storage)
+
+        self.lazyAction = QtGui.QAction("&Lazy Loading", self)
+        self.lazyAction.setCheckable(True)
+        self.lazyAction.setStatusTip("Show the keys of opened files at once and parse entries when needed")
+
+        self.sqliteAction = QtGui.QAction("S&QLite Library", self)
+        self.sqliteAction.setCheckable(True)
+        self.sqliteAction.setStatusTip("Import the next opened file into a local SQLite database "
+                                       "and search it there, for huge shared libraries")
+
+        memoryAction = QtGui.QAction("&Memory Usage", self)
+        memoryAction.setStatusTip("Show the memory used by the field columns")
+        memoryAction.triggered.connect(self.show_memory_usage)
+
         self.statusBar()
+        self.progress = QtGui.QProgressBar()
+        self.progress.setMaximumWidth(150)
+        self.progress.hide()
+        self.cancel_button = QtGui.QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_loading)
+        self.cancel_button.hide()
+        self.timing_label = QtGui.QLabel()
+        self.timing_label.hide()
+        self.statusBar().addPermanentWidget(self.timing_label)
+        self.statusBar().addPermanentWidget(self.progress)
+        self.statusBar().addPermanentWidget(self.cancel_button)
 
         self.mainMenu = self.menuBar()
         self.fileMenu = self.mainMenu.addMenu("&File")
         self.fileMenu.addAction(newFile)
         self.fileMenu.addAction(openFile)
+        self.fileMenu.addAction(addFile)
+        self.fileMenu.addAction(openedFiles)
         self.fileMenu.addAction(saveFile)
+        self.fileMenu.addAction(self.lazyAction)
+        self.fileMenu.addAction(self.compactAction)
+        self.fileMenu.addAction(self.sqliteAction)
+        self.fileMenu.addAction(memoryAction)
+        self.fileMenu.addAction(debugAction)
         self.fileMenu.addAction(exitAction)
         self.searchMenu = self.mainMenu.addMenu("&Search")
         self.searchMenu.addAction(self.searchContent)
         self.editMenu = self.mainMenu.addMenu("&Edit")
         self.editMenu.addAction(self.editEntry)
+        self.editMenu.addAction(self.undoAction)
+        self.editMenu.addAction(self.redoAction)
+        self.editMenu.addAction(self.fetchAction)
+        self.editMenu.addAction(self.pasteAction)
 
         # Define empty data containers
         self.search_form_fields = dict()
-        self.entryID_list = list()
-        self.bib_database = pybtex.database.BibliographyData()
+        self.search_query = None
+        self.rank_results = None
+        self.session = workspace.Workspace()
+        self.loader_thread = None
+        self.adding_file = False
+        self.debug_panel = None
+        self.fetcher = fetch.MetadataFetcher(cache=fetch.ResponseCache())
+        self.fetch_thread = None
+
+        # Reload entries changed in the opened files by other programs:
+        self.file_watcher = watcher.file_watcher()
+        # Files which could not be reloaded -> number of attempts, retried on the next ticks:
+        self.reload_attempts = dict()
+        self.max_reload_attempts = 5
+        self.watch_timer = QtCore.QTimer(self)
+        self.watch_timer.setInterval(1000)
+        self.watch_timer.timeout.connect(self.check_file_changes)
+        self.watch_timer.start()
+
+        # Index the entries of lazily opened files while the GUI is idle:
+        self.index_timer = QtCore.QTimer(self)
+        self.index_timer.setInterval(20)
+        self.index_timer.timeout.connect(self.index_pending)
+
+        # While the selection moves quickly (arrow key held down), only the
+        # first and the last selected entry are shown:
+        self.show_timer = QtCore.QTimer(self)
+        self.show_timer.setSingleShot(True)
+        self.show_timer.setInterval(50)
+        self.show_timer.timeout.connect(self.show_pending)
+        self.pending_key = None
+        self.shown_key = None
+        self.selected_row = None
+
+        # Render the entries next to the selected one while the GUI is idle:
+        self.prerender_rows = 5
+        self.prerender_keys = list()
+        self.prerender_timer = QtCore.QTimer(self)
+        self.prerender_timer.setInterval(0)
+        self.prerender_timer.timeout.connect(self.prerender_pending)
 
         self.home()
 
@@ -111,7 +359,11 @@ class Window(QtGui.QMainWindow):
         self.searchBar.returnPressed.connect(self.activate_list)
         self.searchBar.setFixedWidth(100)
         self.searchBar.setFixedHeight(22)
-        self.currentList = list()
+        # Wait for a pause in typing before filtering the list:
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.filter_entries)
         self.reset_list_button = QtGui.QPushButton("Reset")
         self.reset_list_button.clicked.connect(self.reset_list_view)
         self.reset_list_button.setFixedWidth(40)
@@ -128,11 +380,14 @@ class Window(QtGui.QMainWindow):
         self.searchMenu.addAction(searchAction)
 
         # List of Article Entries:
-        self.listView = QtGui.QListWidget(self.main_frame)
+        self.list_model = EntryListModel(self)
+        self.listView = EntryListView(self.main_frame)
+        self.listView.setModel(self.list_model)
+        self.listView.setUniformItemSizes(True)
         # listView.resize(70, 250)
         self.listView.setFixedWidth(140)
-        self.listView.itemClicked.connect(self.show_entry)
-        self.listView.currentItemChanged.connect(self.show_entry)
+        self.listView.clicked.connect(self.show_entry)
+        self.listView.selectionModel().currentChanged.connect(self.show_entry)
 
         # Collect Search Bar and List View:
         list_panel = QtGui.QVBoxLayout()
@@ -169,35 +424,30 @@ class Window(QtGui.QMainWindow):
         # checkBox = QtGui.QCheckBox('Enlarge Window', self)
         # checkBox.move(70, 50)
         # checkBox.stateChanged.connect(self.enlarge_window)
-        #
-        # self.progress = QtGui.QProgressBar(self)
-        # self.progress.setGeometry(200, 80, 250, 20)
-        #
-        # self.btn = QtGui.QPushButton("Download", self)
-        # self.btn.move(200, 120)
-        # self.btn.clicked.connect(self.download)
 
         # self.show()
 
     def activate_list(self):
-        self.listView.setCurrentRow(0)
+        if self.search_timer.isActive():
+            self.search_timer.stop()
+            self.filter_entries()
+        self.listView.setCurrentIndex(self.list_model.index(0))
         self.listView.setFocus()
 
     def search_entries(self, text):
-        QtGui.QApplication.processEvents()
-        text = str(text)
+        # Restart the debounce timer, the filter runs when typing pauses:
+        self.search_timer.start()
 
-        if text:
-            listToShow = list()
-            for articleID in self.currentList:
-                if text.lower() in articleID.lower():
-                    listToShow.append(articleID)
-            self.listView.clear()
-            self.listView.addItems(listToShow)
+    def filter_entries(self):
+        with instrument.span('gui.filter_entries'):
+            text = unicode(self.searchBar.text())
+            self.list_model.set_rows(self.session.filter_keys(text))
 
-        else:
-            self.listView.clear()
-            self.listView.addItems(self.currentList)
+    def current_entry_key(self):
+        index = self.listView.currentIndex()
+        if index.isValid():
+            return self.list_model.key(index.row())
+        return None
 
     def create_search_window(self):
         self.Spline_dialog = SearchWindow(self)
@@ -206,141 +456,409 @@ class Window(QtGui.QMainWindow):
         self.editor = EditWindow(self)
 
     def search_content(self):
-        matches = list()
-
-        # Go through criteria and collect matching entries:
-        for entry in self.bib_database.entries.values():
-            criteria = 1
-            for search_field_name in self.search_form_fields.keys():
-                query = str(self.search_form_fields[search_field_name].text())
-                if query:
-                    if search_field_name == 'author':
-                        content = entry.fields[search_field_name]
-                        criteria *= query.lower() in content.lower()
-
-                    elif search_field_name in entry.fields.keys():
-                        content = entry.fields[search_field_name]
-                        if search_field_name in ['title', 'keywords']:
-                            # split query and search for individual words:
-                            words = query.split()
-                            for word in words:
-                                if word.lower() in content.lower():
-                                    criteria *= True
-                                else:
-                                    criteria *= False
-                        else:
-                            criteria *= query.lower() in content.lower()
-                    else:
-                        criteria *= False
-            if criteria:
-                matches.append(entry.key)
+        queries = dict()
+        for search_field_name, search_field in self.search_form_fields.items():
+            queries[search_field_name] = unicode(search_field.text())
+
+        if self.session.unindexed:
+            # A lazily opened file must be fully indexed before searching:
+            self.statusBar().showMessage('Indexing the remaining entries...')
+            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+            try:
+                self.session.ensure_indexed()
+            finally:
+                QtGui.QApplication.restoreOverrideCursor()
+            self.index_pending()
+
+        # Look up matching entries in the inverted index:
+        if self.rank_results is not None and self.rank_results.isChecked():
+            self.session.rank_content(queries)
+        else:
+            # Combine the form fields with the structured query:
+            terms = [unicode(self.search_query.text())]
+            for field, text in sorted(queries.items()):
+                if text.strip():
+                    terms.append(u'%s:"%s"' % (field, text.replace('"', ' ')))
+            try:
+                self.session.query(u' '.join(terms))
+            except query.QuerySyntaxError as error:
+                QtGui.QMessageBox.warning(self, 'Error', 'Invalid query:\n' + unicode(error))
+                return
 
         # Present matching entries in self.listView:
-        self.listView.clear()
-        self.listView.addItems(matches)
-        self.currentList = matches
+        self.list_model.set_rows(self.session.key_filter.scope)
 
     def reset_search_form(self):
         for search_field in self.search_form_fields.values():
             search_field.clear()
-        self.listView.clear()
-        self.currentList = self.entryID_list
-        self.listView.addItems(self.currentList)
+        if self.search_query is not None:
+            self.search_query.clear()
+        self.session.reset_scope()
+        self.list_model.set_rows(self.session.key_filter.scope)
 
     def reset_list_view(self):
-        self.currentList = self.entryID_list
-        self.listView.clear()
-        self.listView.addItems(self.currentList)
+        self.session.reset_scope()
         self.searchBar.clear()
+        self.search_timer.stop()
+        self.list_model.set_rows(self.session.key_filter.scope)
 
-    def show_entry(self, item):
-        if item:
-            entryID = str(item.text())
-            for i, name in enumerate(self.form_entries):
-                bib_entry = self.bib_database.entries[entryID]
-                if name.lower() == 'author':
-                    field_text = formatting.format_author_list(bib_entry, showAll=True)
-
-                elif name.lower() in bib_entry.fields.keys():
-                    if name.lower() == 'journal':
-                        # Convert the LaTeX shorthand to real text:
-                        field_text = formatting.format_journal_name(bib_entry)
-
-                    elif name.lower() == 'adsurl':
-                        urlLink = bib_entry.fields[name.lower()].replace('\n', ' ')
-                        urlText = formatting.format_reference(bib_entry, 1, 2)
-                        field_text = "<a href=\"%s\">%s</a>" % (urlLink, urlText)
+    def show_entry(self, index, previous=None):
+        if not index.isValid():
+            return
+        key = self.list_model.key(index.row())
+        self.queue_prerender(index.row())
+        if self.show_timer.isActive():
+            # Show the entry when the selection stops moving:
+            self.pending_key = key
+        else:
+            self.show_key(key)
+        self.show_timer.start()
+
+    def show_key(self, entryID):
+        self.pending_key = None
+        self.shown_key = entryID
+        with instrument.span('gui.show_entry'):
+            self.display_entry(entryID)
+
+    def show_pending(self):
+        if self.pending_key is not None and self.pending_key != self.shown_key:
+            self.show_key(self.pending_key)
+        self.pending_key = None
+
+    def queue_prerender(self, row):
+        """ Queue the entries after and before `row`, first those in the direction the selection moves. """
+        step = -1 if self.selected_row is not None and row < self.selected_row else 1
+        self.selected_row = row
+        rows = [row + step * distance for distance in range(1, self.prerender_rows + 1)]
+        rows += [row - step * distance for distance in range(1, self.prerender_rows + 1)]
+        n_rows = self.list_model.rowCount()
+        self.prerender_keys = [self.list_model.key(other) for other in rows if 0 <= other < n_rows]
+        self.prerender_timer.start()
+
+    def prerender_pending(self):
+        """ Render one queued entry each time the event loop is idle. """
+        if not self.prerender_keys:
+            self.prerender_timer.stop()
+            return
+        try:
+            self.session.prerender([self.prerender_keys.pop(0)], self.form_entries)
+        except (PybtexError, KeyError, UnicodeDecodeError):
+            # Entries which cannot be parsed are skipped:
+            pass
 
-                    else:
-                        field_text = bib_entry.fields[name.lower()].replace('\n', ' ')
-                        field_text = formatting.clean_string(field_text)
+    def stop_prerender(self):
+        self.prerender_timer.stop()
+        self.prerender_keys = list()
+        self.show_timer.stop()
+        self.pending_key = None
+        self.shown_key = None
+        self.selected_row = None
+
+    def display_entry(self, entryID):
+        if entryID:
+            entry_view = self.session.render_entry(entryID, self.form_entries)
+            for i, field_text in enumerate(entry_view):
+                self.form_fields[i].setText(field_text)
+            if self.is_workspace() and len(self.session.files) > 1:
+                self.statusBar().showMessage('From: ' + self.session.source_of(entryID), 4000)
 
-                else:
-                    field_text = ''
+    def is_workspace(self):
+        return isinstance(self.session, workspace.Workspace)
 
-                self.form_fields[i].setText(field_text)
+    def new_session(self):
+        """ Session for the next opened file, as selected in the File menu. """
+        if self.sqliteAction.isChecked():
+            return sqlstore.SQLiteSession()
+        return workspace.Workspace(self.compactAction.isChecked())
 
     def file_new(self):
         pass
 
     def file_open(self):
+        self.load_file(add=False)
+
+    def file_add(self):
+        self.load_file(add=True)
+
+    def load_file(self, add=False):
         filters = "BibTeX files (*.bib);;All files (*.*)"
         selected_filter = "BibTeX (*.bib)"
-        database_file = QtGui.QFileDialog.getOpenFileName(self, 'Open File', filter=filters,
+        title = 'Add File' if add else 'Open File'
+        database_file = QtGui.QFileDialog.getOpenFileName(self, title, filter=filters,
                                                           selectedFilter=selected_filter)
 
         database_file = str(database_file)
-        if database_file:
-            self.statusBar().showMessage('Opened BibTeX database: ' + database_file, 8000)
+        if not database_file:
+            return
+        if add and not self.is_workspace():
+            QtGui.QMessageBox.warning(self, 'Error', 'Files cannot be added to an SQLite library.')
+            return
+        if not add and self.sqliteAction.isChecked() and not sqlstore.is_supported():
+            QtGui.QMessageBox.warning(self, 'Error', 'This SQLite version has no FTS5 full text '
+                                      'search with the trigram tokenizer.\n'
+                                      'The file is opened in memory instead.')
+            self.sqliteAction.setChecked(False)
+
+        if self.loader_thread is not None:
+            self.loader_thread.cancel()
+            self.loader_thread.wait()
+
+        self.index_timer.stop()
+        self.stop_prerender()
+        if not add and self.sqliteAction.isChecked() == self.is_workspace():
+            self.session.clear()
+            self.session = self.new_session()
+        # Reopen unchanged files from the binary cache without parsing:
+        self.adding_file = add
+        if add:
+            cached = self.session.begin_file(database_file)
         else:
+            try:
+                cached = self.session.open_cached(database_file)
+            except sqlite3.OperationalError as error:
+                self.clear_database()
+                self.loading_failed('Could not open the SQLite library: ' + unicode(error))
+                return
+        if cached:
+            self.database_loaded()
+            return
+        if not add and self.lazyAction.isChecked() and self.is_workspace():
+            try:
+                self.session.open_lazy(database_file)
+            except (PybtexError, IOError, UnicodeDecodeError) as error:
+                self.clear_database()
+                self.loading_failed(unicode(error))
+                return
+            self.database_loaded()
+            self.progress.setValue(0)
+            self.progress.show()
+            self.index_timer.start()
+            return
+        if not add:
+            self.list_model.set_keys([])
+
+        self.statusBar().showMessage('Loading BibTeX database: ' + database_file)
+        self.progress.setValue(0)
+        self.progress.show()
+        self.cancel_button.show()
+
+        # Parse the file in the background and show entries as they arrive:
+        self.loader_thread = LoaderThread(database_file, self)
+        self.loader_thread.batch_loaded.connect(self.add_loaded_entries)
+        self.loader_thread.progress.connect(self.progress.setValue)
+        self.loader_thread.failed.connect(self.loading_failed)
+        self.loader_thread.finished.connect(self.loading_finished)
+        self.loader_thread.start()
+
+    def clear_database(self):
+        self.session.clear()
+        self.list_model.set_keys(self.session.entryID_list)
+
+    def add_loaded_entries(self, chunk_database):
+        if self.loader_thread.cancelled:
+            return
+        try:
+            keys = self.session.add_batch(chunk_database)
+        except PybtexError as error:
+            self.loader_thread.cancel()
+            self.loading_failed(unicode(error))
             return
 
-        with open(database_file, 'r') as bibtex_file:
-            self.bib_database = pybtex.database.parse_file(bibtex_file)
-        self.entryID_list = sorted(self.bib_database.entries.keys())
-        self.currentList = self.entryID_list
-        self.listView.addItems(self.entryID_list)
+        if keys:
+            self.list_model.append_keys(keys)
+
+    def index_pending(self):
+        n_entries = len(self.session.entryID_list)
+        try:
+            left = self.session.index_pending()
+        except (PybtexError, KeyError, UnicodeDecodeError) as error:
+            self.index_timer.stop()
+            self.progress.hide()
+            self.statusBar().showMessage('Could not parse entries: ' + unicode(error), 8000)
+            return
+        self.progress.setValue(100 * (n_entries - left) // max(n_entries, 1))
+        if not left:
+            self.index_timer.stop()
+            self.progress.hide()
+
+    def loading_failed(self, message):
+        if self.loader_thread is not None:
+            self.loader_thread.cancel()
+        QtGui.QMessageBox.warning(self, 'Error', 'Could not load BibTeX database:\n' + message)
+
+    def cancel_loading(self):
+        if self.loader_thread is not None:
+            self.loader_thread.cancel()
+
+    def loading_finished(self):
+        self.progress.hide()
+        self.cancel_button.hide()
+        if self.loader_thread.cancelled:
+            # Do not keep a partially loaded database around:
+            database_file = self.session.database_file
+            if self.adding_file:
+                self.session.remove_file(database_file)
+                self.list_model.set_keys(self.session.entryID_list)
+            else:
+                self.clear_database()
+            self.statusBar().showMessage('Loading cancelled: ' + database_file, 8000)
+            return
 
-        self.listView.setCurrentRow(0)
+        self.session.finish_loading(self.loader_thread.source_file)
+        self.database_loaded()
+
+    def database_loaded(self):
+        message = 'Opened BibTeX database: ' + self.session.database_file
+        skipped = len(self.session.current_file.duplicates) if self.is_workspace() else 0
+        if skipped:
+            message += ' (%i duplicate entries skipped)' % skipped
+        self.statusBar().showMessage(message, 8000)
+        self.list_model.set_keys(self.session.entryID_list)
+        self.file_watcher.clear()
+        self.reload_attempts.clear()
+        for filename in self.session.watched_files():
+            self.file_watcher.add(filename)
+
+        self.listView.setCurrentIndex(self.list_model.index(0))
         self.listView.setFocus()
         self.raise_()
         self.activateWindow()
 
+    def check_file_changes(self):
+        if self.loader_thread is not None and self.loader_thread.isRunning():
+            return
+        filenames = self.file_watcher.changed()
+        filenames += [filename for filename in self.reload_attempts if filename not in filenames]
+        for filename in filenames:
+            try:
+                changes = self.session.reload_file(filename)
+            except (PybtexError, KeyError, IOError, OSError, UnicodeDecodeError) as error:
+                # The file may be half written or replaced, try again on the next tick:
+                attempts = self.reload_attempts.get(filename, 0) + 1
+                if attempts < self.max_reload_attempts:
+                    self.reload_attempts[filename] = attempts
+                else:
+                    # Give up until the file changes again:
+                    self.reload_attempts.pop(filename, None)
+                self.statusBar().showMessage('Could not reload %s: %s' % (filename, error), 8000)
+                continue
+            self.reload_attempts.pop(filename, None)
+            if not changes:
+                continue
+
+            current_key = self.current_entry_key()
+            self.list_model.set_keys(self.session.entryID_list)
+            if current_key in self.session.bib_database.entries:
+                row = self.session.key_filter.position[current_key]
+                self.listView.setCurrentIndex(self.list_model.index(row))
+            self.statusBar().showMessage('Reloaded %s: %s' % (filename, changes.summary()), 8000)
+
     def file_save(self):
-        name = QtGui.QFileDialog.getSaveFileName(self, 'Save File')
+        if self.is_workspace() and len(self.session.files) > 1:
+            # Write the edited entries back to the files they came from:
+            name = None
+        else:
+            name = str(QtGui.QFileDialog.getSaveFileName(self, 'Save File'))
+            if not name:
+                return
+
+        try:
+            self.session.save(name)
+        except (IOError, OSError) as error:
+            QtGui.QMessageBox.warning(self, 'Error', 'Could not save file:\n' + str(error))
+            return
 
-        with open(name, 'w') as bibtex_file:
-            self.bib_database.to_file(bibtex_file)
+        if name is None:
+            name = ', '.join(self.session.files.keys())
         new_msg = 'Saved current BibTeX database to file: ' + name
         self.statusBar().showMessage(new_msg, 8000)
 
     def update_entry(self):
-        edit_fields = self.editor.edit_fields
-        entryID = self.editor.original_entry.key
-        for field in edit_fields.keys():
-            if field not in self.editor.original_entry.persons.keys():
-                changed_data = str(edit_fields[field].text())
-                self.bib_database.entries[entryID].fields[field] = changed_data
-            else:
-                changed_data = str(edit_fields[field].text())
-                person_list = changed_data.split(' and ')
-                new_person_list = list()
-                for name in person_list:
-                    person = pybtex.database.Person(name)
-                    new_person_list.append(person)
-                self.bib_database.entries[entryID].persons[field] = new_person_list
+        values = dict()
+        for field, edit_field in self.editor.edit_fields.items():
+            values[field] = unicode(edit_field.text())
+        entryID = self.editor.entryID
+        self.session.update_entry(entryID, values)
         self.editor.close()
-        ID_as_listViewItem = QtGui.QListWidgetItem(entryID)
-        self.show_entry(ID_as_listViewItem)
+        self.display_entry(entryID)
+
+    def fetch_entries(self):
+        if not self.session.database_file:
+            QtGui.QMessageBox.warning(self, 'Error', 'Open a BibTeX file to add the entries to first.')
+            return
+        if self.fetch_thread is not None and self.fetch_thread.isRunning():
+            return
+        text, accepted = QtGui.QInputDialog.getText(self, 'Fetch from DOI/ADS',
+                                                    'DOIs, bibcodes or URLs (separated by spaces):')
+        identifiers = unicode(text).split()
+        if not accepted or not identifiers:
+            return
+        self.statusBar().showMessage('Fetching %i entries...' % len(identifiers))
+        self.fetch_thread = FetchThread(self.fetcher, identifiers, self)
+        self.fetch_thread.fetched.connect(self.add_fetched_entries)
+        self.fetch_thread.start()
+
+    def add_fetched_entries(self, result):
+        added = self.session.add_entries(result.bib_database)
+        self.list_model.set_keys(self.session.entryID_list)
+        message = '%s, %i added' % (result.summary(), len(added))
+        self.statusBar().showMessage(message, 8000)
+        if result.failed:
+            failures = [u'%s: %s' % item for item in sorted(result.failed.items())]
+            QtGui.QMessageBox.warning(self, 'Fetch from DOI/ADS', u'\n'.join([message] + failures))
+
+    def create_paste_window(self):
+        if not self.session.database_file:
+            QtGui.QMessageBox.warning(self, 'Error', 'Open a BibTeX file to add the entries to first.')
+            return
+        self.paste_window = PasteWindow(self)
+
+    def import_references(self):
+        lines = unicode(self.paste_window.text_edit.toPlainText()).splitlines()
+        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            report = refparse.import_references(self.session, lines)
+        finally:
+            QtGui.QApplication.restoreOverrideCursor()
+        self.paste_window.close()
+        self.list_model.set_keys(self.session.entryID_list)
+        self.statusBar().showMessage(report.summary(), 8000)
+        if report.errors:
+            errors = [u'line %i: %s' % (number, line) for number, line, error in report.errors]
+            QtGui.QMessageBox.warning(self, 'Add from Text', u'\n'.join([report.summary()] + errors))
+
+    def show_opened_files(self):
+        QtGui.QMessageBox.information(self, 'Opened Files', self.session.report())
+
+    def set_compact_storage(self, checked):
+        self.session.compact = checked
+
+    def show_memory_usage(self):
+        QtGui.QMessageBox.information(self, 'Memory Usage', self.session.memory_report())
+
+    def show_debug_panel(self):
+        if self.debug_panel is None:
+            self.debug_panel = DebugPanel(self)
+        self.debug_panel.show()
+        self.debug_panel.raise_()
+
+    def show_last_span(self):
+        if instrument.last_span is None:
+            return
+        name, duration = instrument.last_span
+        self.timing_label.setText('%s: %.1f ms' % (name, 1000 * duration))
 
-    def download(self):
-        self.completed = 0
+    def undo_edit(self):
+        changed_keys = self.session.undo()
+        if changed_keys:
+            self.display_entry(self.current_entry_key())
+            self.statusBar().showMessage('Undid changes to: ' + ', '.join(changed_keys), 8000)
 
-        while self.completed < 100 and self.completed > 0:
-            time.sleep(0.01)
-            self.completed += 1
-            QtGui.QApplication.processEvents()
-            self.progress.setValue(self.completed)
+    def redo_edit(self):
+        changed_keys = self.session.redo()
+        if changed_keys:
+            self.display_entry(self.current_entry_key())
+            self.statusBar().showMessage('Redid changes to: ' + ', '.join(changed_keys), 8000)
 
     def close_application(self):
         choice = QtGui.QMessageBox.question(self, 'Exit!',
@@ -365,10 +883,17 @@ class SearchWindow(QtGui.QDialog):
         self.reset_button.clicked.connect(parent.reset_search_form)
 
         # search_terms = ['author', 'journal', 'year', 'title', 'abstract', 'volume']
-        search_terms = ['author', 'title', 'journal', 'keyword']
+        search_terms = ['author', 'title', 'journal', 'keyword', 'abstract']
 
         searchGrid = QtGui.QGridLayout()
-        for row, term in enumerate(search_terms):
+        if parent.search_query is None:
+            parent.search_query = QtGui.QLineEdit()
+            parent.search_query.setPlaceholderText('author:fynbo year:2010..2015 journal:mnras -keyword:quasar')
+            parent.search_query.returnPressed.connect(parent.search_content)
+        searchGrid.addWidget(QtGui.QLabel("Query"), 0, 0)
+        searchGrid.addWidget(parent.search_query, 0, 1)
+
+        for row, term in enumerate(search_terms, 1):
             label = QtGui.QLabel(term.capitalize())
             if term in parent.search_form_fields.keys():
                 edit = parent.search_form_fields[term]
@@ -378,6 +903,10 @@ class SearchWindow(QtGui.QDialog):
             searchGrid.addWidget(label, row, 0)
             searchGrid.addWidget(edit, row, 1)
 
+        if parent.rank_results is None:
+            parent.rank_results = QtGui.QCheckBox("Rank by relevance (allows typos in author names)")
+        searchGrid.addWidget(parent.rank_results, len(search_terms) + 1, 1)
+
         vbox = QtGui.QVBoxLayout()
 
         hbox = QtGui.QHBoxLayout()
@@ -393,6 +922,106 @@ class SearchWindow(QtGui.QDialog):
         self.show()
 
 
+class DebugPanel(QtGui.QDialog):
+    """
+    Statistics of the timing spans and counters of instrument.py, updated
+    while recording. The spans can be exported as a Chrome/Perfetto trace.
+    """
+
+    def __init__(self, parent=None):
+        super(DebugPanel, self).__init__(parent)
+        self.setWindowTitle("Timings")
+        self.window = parent
+        self.record_box = QtGui.QCheckBox("Record timings")
+        self.record_box.setChecked(instrument.enabled)
+        self.record_box.toggled.connect(self.set_recording)
+        self.report_view = QtGui.QPlainTextEdit()
+        self.report_view.setReadOnly(True)
+        self.report_view.setFont(QtGui.QFont('Courier'))
+        self.reset_button = QtGui.QPushButton("Reset")
+        self.reset_button.clicked.connect(self.reset)
+        self.export_button = QtGui.QPushButton("Export Trace")
+        self.export_button.clicked.connect(self.export_trace)
+        self.quit_button = QtGui.QPushButton("Close")
+        self.quit_button.clicked.connect(self.close)
+
+        # Refresh the report and the status bar while recording:
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.setInterval(500)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.set_recording(instrument.enabled)
+
+        hbox = QtGui.QHBoxLayout()
+        hbox.addWidget(self.record_box)
+        hbox.addStretch(1)
+        hbox.addWidget(self.reset_button)
+        hbox.addWidget(self.export_button)
+        hbox.addWidget(self.quit_button)
+
+        vbox = QtGui.QVBoxLayout()
+        vbox.addWidget(self.report_view)
+        vbox.addLayout(hbox)
+        self.setLayout(vbox)
+        self.resize(600, 400)
+
+    def set_recording(self, checked):
+        if checked:
+            instrument.enable()
+            self.refresh_timer.start()
+            self.window.timing_label.show()
+        else:
+            instrument.disable()
+            self.refresh_timer.stop()
+            self.window.timing_label.hide()
+        self.refresh()
+
+    def refresh(self):
+        caches = {'render_cache': self.window.session.render_cache,
+                  'author_cache': formatting.author_cache,
+                  'query_cache': self.window.session.query_engine.cache}
+        self.report_view.setPlainText(instrument.report(caches))
+        self.window.show_last_span()
+
+    def reset(self):
+        instrument.reset()
+        self.window.timing_label.clear()
+        self.refresh()
+
+    def export_trace(self):
+        filename = str(QtGui.QFileDialog.getSaveFileName(self, 'Export Trace', 'pybib_trace.json'))
+        if not filename:
+            return
+        try:
+            instrument.export_trace(filename)
+        except (IOError, OSError) as error:
+            QtGui.QMessageBox.warning(self, 'Error', 'Could not write trace:\n' + str(error))
+
+
+class PasteWindow(QtGui.QDialog):
+    def __init__(self, parent=None):
+        super(PasteWindow, self).__init__(parent)
+        self.setWindowTitle("Add from Text")
+        self.text_edit = QtGui.QPlainTextEdit()
+        self.text_edit.setPlaceholderText("Fynbo, J. P. U. et al. 2011, MNRAS, 413, 2481")
+        self.add_button = QtGui.QPushButton("Add Entries")
+        self.add_button.clicked.connect(parent.import_references)
+        self.quit_button = QtGui.QPushButton("Cancel")
+        self.quit_button.clicked.connect(self.close)
+
+        hbox = QtGui.QHBoxLayout()
+        hbox.addWidget(self.add_button)
+        hbox.addWidget(self.quit_button)
+
+        vbox = QtGui.QVBoxLayout()
+        vbox.addWidget(QtGui.QLabel("Paste references, one per line:"))
+        vbox.addWidget(self.text_edit)
+        vbox.addLayout(hbox)
+        self.setLayout(vbox)
+        self.resize(600, 400)
+
+        self.show()
+
+
 class EditWindow(QtGui.QDialog):
     def __init__(self, parent=None):
         super(EditWindow, self).__init__(parent)
@@ -404,11 +1033,12 @@ class EditWindow(QtGui.QDialog):
         self.reset_button = QtGui.QPushButton("Recover Original")
         self.reset_button.clicked.connect(self.recover_entry)
 
-        entryID = str(parent.listView.currentItem().text())
-        self.original_entry = copy.deepcopy(parent.bib_database.entries[entryID])
+        self.entryID = parent.current_entry_key()
+        # Keep only the original text of each field for "Recover Original":
+        self.original_values = dict()
         self.edit_fields = dict()
 
-        grid_layout = self.display_all_fields(parent.bib_database.entries[entryID])
+        grid_layout = self.display_all_fields(parent.session.bib_database.entries[self.entryID])
 
         hbox = QtGui.QHBoxLayout()
         hbox.addWidget(self.save_button)
@@ -437,7 +1067,8 @@ class EditWindow(QtGui.QDialog):
         #         all_fields.append(field)
 
         for row, field in enumerate(fields_in_entry):
-            data = bib_entry.fields[field]
+            data = journal.field_value(bib_entry, field)
+            self.original_values[field] = data
 
             label = QtGui.QLabel(field.capitalize() + ': ')
             line_edit = QtGui.QLineEdit(data)
@@ -448,10 +1079,7 @@ class EditWindow(QtGui.QDialog):
         return grid_layout
 
     def recover_entry(self):
-        fields_in_entry = self.original_entry.fields.keys()
-        fields_in_entry += self.original_entry.persons.keys()
-        for field in fields_in_entry:
-            orig_data = self.original_entry.fields[field]
+        for field, orig_data in self.original_values.items():
             self.edit_fields[field].clear()
             self.edit_fields[field].setText(orig_data)
 
@@ -464,4 +1092,5 @@ def main():
     sys.exit(app.exec_())
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Structured search queries, e.g.:
+
+        author:fynbo year:2010..2015 journal:mnras -keyword:quasar
+
+    Terms are `field:value` (or bare words matching any field), quoted
+    values are matched as phrases and a leading '-' excludes the matches.
+    Years are given as 2010, 2010..2015, 2010.. or ..2015.
+    A query is compiled once into a plan of predicates which is run with
+    the most selective predicate first, using the content index for words,
+    a sorted array for year ranges and a hash index for journals.
+    Results are cached per query string until the database changes.
+"""
+
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+
+import formatting
+import searchindex
+from rendercache import LRUCache
+
+__author__ = 'Jens-Kristian Krogager'
+
+term_pattern = re.compile(r'(-?)(?:(\w+):)?(?:"([^"]*)"|(\S+))', re.UNICODE)
+year_pattern = re.compile(r'\d{4}')
+year_range_pattern = re.compile(r'^(\d{4})?(\.\.)?(\d{4})?$')
+
+word_fields = ['author', 'title', 'keywords', 'abstract']
+query_fields = word_fields + ['journal', 'year']
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+def parse_terms(text):
+    """
+    Split a query string into terms. Returns a list of (negate, field,
+    value, phrase) where `field` is a name of `query_fields`, or None for
+    bare words, and `phrase` is True for quoted values.
+    Raises QuerySyntaxError.
+    """
+    terms = list()
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        if text[position].isspace():
+            position += 1
+            continue
+        match = term_pattern.match(text, position)
+        if not match or match.end() == position:
+            raise QuerySyntaxError("Cannot parse query at: %s" % text[position:])
+        position = match.end()
+
+        negate, field, quoted, value = match.groups()
+        if quoted is not None:
+            value = quoted
+        if field is not None:
+            field = searchindex.field_aliases.get(field.lower(), field.lower())
+            if field not in query_fields:
+                raise QuerySyntaxError("Unknown field: %s" % field)
+        terms.append((bool(negate), field, value, quoted is not None))
+    return terms
+
+
+def entry_year(bib_entry):
+    """ Return the year of the entry as an integer, or None. """
+    match = year_pattern.search(bib_entry.fields.get('year', ''))
+    if match:
+        return int(match.group())
+    return None
+
+
+def entry_journals(bib_entry):
+    """ Normalized names of the journal of an entry: the macro and the journal name. """
+    if 'journal' not in bib_entry.fields.keys():
+        return set()
+    names = set([formatting.normalize_journal(bib_entry.fields['journal'])])
+    names.add(formatting.normalize_journal(formatting.format_journal_name(bib_entry)))
+    names.discard(u'')
+    return names
+
+
+class YearIndex(object):
+    """ Keys sorted by year, looked up by bisection. Re-sorted lazily after changes. """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.years = dict()
+        self._sorted = None
+
+    def add_entry(self, key, bib_entry):
+        year = entry_year(bib_entry)
+        if year is not None:
+            self.years[key] = year
+            self._sorted = None
+
+    def remove_entry(self, key):
+        if self.years.pop(key, None) is not None:
+            self._sorted = None
+
+    def sorted_arrays(self):
+        if self._sorted is None:
+            items = sorted((year, key) for key, year in self.years.items())
+            self._sorted = (array('l', [year for year, key in items]),
+                            [key for year, key in items])
+        return self._sorted
+
+    def span(self, first, last):
+        """ Return the slice (start, end) of the sorted keys with first <= year <= last. """
+        years, keys = self.sorted_arrays()
+        start = 0 if first is None else bisect_left(years, first)
+        end = len(years) if last is None else bisect_right(years, last)
+        return start, max(start, end)
+
+    def count(self, first, last):
+        start, end = self.span(first, last)
+        return end - start
+
+    def lookup(self, first, last):
+        start, end = self.span(first, last)
+        return set(self.sorted_arrays()[1][start:end])
+
+
+class JournalIndex(object):
+    """ Normalized journal name -> set of keys. """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.keys = dict()
+        self.journals = dict()
+
+    def add_entry(self, key, bib_entry):
+        names = entry_journals(bib_entry)
+        for name in names:
+            self.keys.setdefault(name, set()).add(key)
+        self.journals[key] = names
+
+    def remove_entry(self, key):
+        for name in self.journals.pop(key, ()):
+            self.keys[name].discard(key)
+            if not self.keys[name]:
+                del self.keys[name]
+
+    def lookup(self, name):
+        return self.keys.get(formatting.normalize_journal(name), set())
+
+
+class WordPredicate(object):
+    """
+    All words of `value` must match in `field`, or in any field if `field` is None.
+    If `phrase` is True, the words must also follow each other in the text.
+    """
+
+    def __init__(self, engine, field, value, phrase=False):
+        self.engine = engine
+        self.field = field
+        tokens = searchindex.tokenize(value)
+        self.words = sorted(set(tokens), key=len, reverse=True)
+        if field is None:
+            self.fields = word_fields + ['journal']
+        else:
+            self.fields = [field]
+        self.phrase = None
+        if phrase and len(tokens) > 1:
+            # The last word is a prefix, as for single words:
+            self.phrase = re.compile(r'(?<!\w)' + r'\W+'.join(re.escape(token) for token in tokens),
+                                     re.UNICODE)
+
+    def estimate(self):
+        # Size of the exact posting of the most selective word:
+        index = self.engine.content_index
+        if not self.words:
+            return len(index.entry_tokens)
+        return min(sum(len(index.postings[field].get(word, ())) for field in self.fields)
+                   for word in self.words)
+
+    def evaluate(self):
+        index = self.engine.content_index
+        matches = None
+        for word in self.words:
+            word_matches = set()
+            for field in self.fields:
+                word_matches |= index.match_token(field, word)
+            matches = word_matches if matches is None else matches & word_matches
+            if not matches:
+                return set()
+        if matches is None:
+            return index.keys()
+
+        columns = self.engine.columns
+        if self.phrase is not None and columns is not None:
+            search = self.phrase.search
+            matches = set(key for key in matches
+                          if any(search(columns.search_text(key, field)) for field in self.fields))
+        return matches
+
+
+class YearPredicate(object):
+
+    def __init__(self, engine, value):
+        self.engine = engine
+        match = year_range_pattern.match(value)
+        if not match or not (match.group(1) or match.group(3)):
+            raise QuerySyntaxError("Invalid year: %s" % value)
+        first, dots, last = match.groups()
+        self.first = int(first) if first else None
+        self.last = int(last) if last else None
+        if not dots:
+            self.last = self.first
+
+    def estimate(self):
+        return self.engine.year_index.count(self.first, self.last)
+
+    def evaluate(self):
+        return self.engine.year_index.lookup(self.first, self.last)
+
+
+class JournalPredicate(object):
+    """ Exact journal name or macro, falling back to words in the journal field. """
+
+    def __init__(self, engine, value):
+        self.engine = engine
+        self.value = value
+        self.words = WordPredicate(engine, 'journal', value, phrase=True)
+
+    def estimate(self):
+        matches = self.engine.journal_index.lookup(self.value)
+        if matches:
+            return len(matches)
+        return self.words.estimate()
+
+    def evaluate(self):
+        matches = self.engine.journal_index.lookup(self.value)
+        if matches:
+            return set(matches)
+        return self.words.evaluate()
+
+
+class QueryPlan(object):
+    """ Compiled query: predicates to intersect and predicates to exclude. """
+
+    def __init__(self, engine, required, excluded):
+        self.engine = engine
+        self.required = required
+        self.excluded = excluded
+
+    def execute(self):
+        """ Return the set of matching keys. """
+        matches = None
+        # Start with the smallest result and stop as soon as nothing is left:
+        for predicate in sorted(self.required, key=lambda predicate: predicate.estimate()):
+            if matches is None:
+                matches = predicate.evaluate()
+            else:
+                matches &= predicate.evaluate()
+            if not matches:
+                return set()
+
+        if matches is None:
+            matches = self.engine.content_index.keys()
+        for predicate in self.excluded:
+            matches -= predicate.evaluate()
+            if not matches:
+                break
+        return matches
+
+
+class QueryEngine(object):
+    """
+    Compile and run query strings against a ContentIndex and its own year
+    and journal indexes. Phrases are checked in the search text of a
+    columns.FieldColumns, if given.
+    """
+
+    def __init__(self, content_index, columns=None, cache_size=100):
+        self.content_index = content_index
+        self.columns = columns
+        self.year_index = YearIndex()
+        self.journal_index = JournalIndex()
+        self.cache = LRUCache(maxsize=cache_size)
+
+    def clear(self):
+        self.year_index.clear()
+        self.journal_index.clear()
+        self.cache.clear()
+
+    def build(self, bib_database):
+        self.clear()
+        for key, bib_entry in bib_database.entries.items():
+            self.add_entry(key, bib_entry)
+
+    def add_entry(self, key, bib_entry):
+        self.year_index.add_entry(key, bib_entry)
+        self.journal_index.add_entry(key, bib_entry)
+        self.cache.clear()
+
+    def remove_entry(self, key):
+        self.year_index.remove_entry(key)
+        self.journal_index.remove_entry(key)
+        self.cache.clear()
+
+    def update_entry(self, key, bib_entry):
+        self.remove_entry(key)
+        self.add_entry(key, bib_entry)
+
+    def compile(self, text):
+        """ Parse the query string into a QueryPlan. Raises QuerySyntaxError. """
+        required = list()
+        excluded = list()
+        for negate, field, value, phrase in parse_terms(text):
+            if field == 'year':
+                predicate = YearPredicate(self, value)
+            elif field == 'journal':
+                predicate = JournalPredicate(self, value)
+            else:
+                predicate = WordPredicate(self, field, value, phrase=phrase)
+
+            if negate:
+                excluded.append(predicate)
+            else:
+                required.append(predicate)
+        return QueryPlan(self, required, excluded)
+
+    def search(self, text):
+        """ Return the set of keys matching the query string `text`. """
+        text = text.strip()
+        matches = self.cache.get(text)
+        if matches is None:
+            matches = self.compile(text).execute()
+            self.cache.put(text, matches)
+        return set(matches)
@@ -0,0 +1,152 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Relevance ranked search over a searchindex.ContentIndex.
+    Words in the title, abstract and keywords are scored by BM25, author
+    names are matched allowing a few typos (bounded edit distance), and
+    only the best `k` entries are picked from a heap instead of sorting
+    every matching entry.
+"""
+
+import heapq
+from math import log
+from operator import itemgetter
+
+import searchindex
+
+__author__ = 'Jens-Kristian Krogager'
+
+# Weight of each ranked field in the total score:
+field_weights = {'title': 2.0, 'keywords': 1.5, 'abstract': 1.0}
+author_weight = 3.0
+
+# Tokens which only start with the query word count less than exact matches:
+prefix_weight = 0.5
+
+# BM25 parameters:
+k1 = 1.2
+b = 0.75
+
+
+def max_typos(word):
+    """ Number of typos allowed when matching an author name of this length. """
+    if len(word) <= 3:
+        return 0
+    elif len(word) <= 6:
+        return 1
+    return 2
+
+
+def edit_distance(word, token, max_distance):
+    """
+    Levenshtein distance between `word` and `token`.
+    Returns max_distance + 1 as soon as the distance is known to be larger.
+    """
+    if abs(len(word) - len(token)) > max_distance:
+        return max_distance + 1
+
+    previous = range(len(token) + 1)
+    for i, char in enumerate(word, 1):
+        current = [i]
+        for j, token_char in enumerate(token, 1):
+            current.append(min(previous[j] + 1,
+                               current[j-1] + 1,
+                               previous[j-1] + (char != token_char)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class RankedSearch(object):
+    """ Score the entries of a ContentIndex against a dictionary of field queries. """
+
+    def __init__(self, index):
+        self.index = index
+
+    def idf(self, field, token):
+        n_entries = self.index.field_counts[field]
+        n_matches = len(self.index.postings[field].get(token, ()))
+        return log(1. + (n_entries - n_matches + 0.5) / (n_matches + 0.5))
+
+    def fuzzy_tokens(self, field, word):
+        """ Return a list of (token, similarity) of tokens in `field` close to `word`. """
+        max_distance = max_typos(word)
+        matches = dict((token, prefix_weight) for token in self.index.prefix_tokens(field, word))
+        by_length = self.index.vocabulary_by_length(field)
+        for length in range(len(word) - max_distance, len(word) + max_distance + 1):
+            for token in by_length.get(length, ()):
+                distance = edit_distance(word, token, max_distance)
+                if distance <= max_distance:
+                    similarity = 1. - float(distance) / (len(word) + 1)
+                    matches[token] = max(similarity, matches.get(token, 0.))
+        return matches.items()
+
+    def score_word(self, scores, field, word, weight):
+        """ Add the BM25 score of `word` in `field` to the `scores` of each entry. """
+        n_entries = self.index.field_counts[field]
+        if not n_entries:
+            return
+        average_length = float(self.index.field_lengths[field]) / n_entries
+        postings = self.index.postings[field]
+        entry_tokens = self.index.entry_tokens
+        entry_lengths = self.index.entry_lengths
+
+        if field == 'author':
+            tokens = self.fuzzy_tokens(field, word)
+        else:
+            tokens = [(token, 1. if token == word else prefix_weight)
+                      for token in self.index.prefix_tokens(field, word)]
+
+        # Length normalization of BM25: k1 * (1 - b + b * length / average_length)
+        norm_constant = k1 * (1 - b)
+        norm_length = k1 * b / average_length
+
+        # Only the best matching token of each entry counts for the word:
+        best = dict()
+        for token, similarity in tokens:
+            idf = self.idf(field, token) * similarity * (k1 + 1)
+            for key in postings[token]:
+                tf = entry_tokens[key][field][token]
+                score = idf * tf / (tf + norm_constant + norm_length * entry_lengths[key][field])
+                if score > best.get(key, 0.):
+                    best[key] = score
+
+        for key, score in best.items():
+            scores[key] = scores.get(key, 0.) + weight * score
+
+    def search(self, queries, k=100):
+        """
+        Input is a dictionary of field name -> query string, as for
+        ContentIndex.search(). Fields without a ranking (e.g., journal) are
+        used as filters. Returns a list of (key, score) of the `k` best
+        entries with the highest score first.
+        """
+        scores = dict()
+        required = None
+        ranked = False
+        for field, query in queries.items():
+            if not query.strip():
+                continue
+            field = searchindex.field_aliases.get(field, field)
+            if field == 'author':
+                weight = author_weight
+            elif field in field_weights:
+                weight = field_weights[field]
+            else:
+                field_matches = self.index.search_field(field, query)
+                required = field_matches if required is None else required & field_matches
+                continue
+            ranked = True
+            if field not in self.index.postings:
+                continue
+            for word in set(searchindex.tokenize(query)):
+                self.score_word(scores, field, word, weight)
+
+        if required is not None:
+            if ranked:
+                scores = dict((key, score) for key, score in scores.items() if key in required)
+            else:
+                # Only filters were given, all matching entries rank the same:
+                scores = dict.fromkeys(required, 0.)
+        return heapq.nlargest(k, scores.items(), key=itemgetter(1))
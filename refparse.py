@@ -0,0 +1,315 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Parse formatted references, as pasted from the reference list of a
+    paper, back into BibTeX entries.
+
+    Usage:
+        python refparse.py references.txt -o references.bib
+
+    Each line holds one reference in the style of
+    formatting.format_reference() or of the journals, e.g.:
+
+        Arabsalmani, M.; Moller, P. and Fynbo, J. P. U. 2015, MNRAS, 446, 990
+        Fynbo J. P. U., et al., 2011, MNRAS, 413, 2481
+        [12] Krogager, J.-K., Fynbo, J. P. U., et al. 2015, ApJS, 217, 5
+        Smith, J. et al. 2016, arXiv:1602.01234
+
+    Journal names are turned back into the LaTeX macros of
+    formatting.journal_transform. Lines are parsed one at a time with
+    precompiled patterns by iter_references(). import_references() adds
+    the entries to a session in batches, skipping references to entries
+    already in the database (same first author, year, journal, volume and
+    first page, or arXiv number).
+"""
+
+import io
+import re
+import sys
+import argparse
+
+import columns
+import dbcache
+import duplicates
+import formatting
+import searchindex
+
+__author__ = 'Jens-Kristian Krogager'
+
+label_pattern = re.compile(u'^\\s*(?:\\[\\d+\\]|\\(\\d+\\)|\\d+[.)]|[-*•])\\s+', re.UNICODE)
+reference_pattern = re.compile(r'^(?P<authors>.+?)[\s,]*\(?(?<!\d)(?P<year>(?:1[89]|20)\d\d)[a-z]?\)?'
+                               r'(?!\d)(?:[\s,.:;]+(?P<rest>.*))?$', re.UNICODE)
+article_pattern = re.compile(u'^(?P<journal>.*?[^\\W\\d_].*?)[\\s,]+(?P<volume>[A-Za-z]?\\d+[A-Za-z]?)'
+                             u'[\\s,:]+(?P<pages>[A-Za-z]?\\d+[A-Za-z]?)'
+                             u'(?:\\s*[-–]+\\s*[A-Za-z]?\\d+)?\\.?$', re.UNICODE)
+arxiv_pattern = re.compile(r'^(?:arXiv e-prints,?\s*)?arXiv:\s*(?P<eprint>[\w./-]+?)\.?$',
+                           re.UNICODE | re.IGNORECASE)
+et_al_pattern = re.compile(r'[\s,]*\bet\.?\s*al\.?[\s,]*$', re.UNICODE)
+name_separator = re.compile(r'\s*(?:;|,|&|\band\b)\s*', re.UNICODE)
+initials = r'(?:(?:[^\W\d_]{1,2}\.|[A-Z])[\s~-]*)+'
+initials_pattern = re.compile(r'^%s$' % initials, re.UNICODE)
+trailing_initials = re.compile(r'^(?P<last>.+?)\s+(?P<first>%s)$' % initials, re.UNICODE)
+leading_initials = re.compile(r'^(?P<first>(?:[^\W\d_]{1,2}\.[\s~-]*)+)\s*(?P<last>\S.*)$', re.UNICODE)
+key_characters = re.compile(r'[^A-Za-z0-9]')
+
+# Journal name -> LaTeX macro, the reverse of formatting.journal_transform:
+journal_macros = dict()
+for macro, name in sorted(formatting.journal_transform.items()):
+    journal_macros.setdefault(formatting.normalize_journal(name), u'\\' + macro)
+
+
+class ReferenceSyntaxError(ValueError):
+    pass
+
+
+def journal_field(name):
+    """ BibTeX journal field of a journal name: the macro if it has one, e.g. 'A&A' -> '\\aap'. """
+    return journal_macros.get(formatting.normalize_journal(name), name)
+
+
+def parse_authors(text):
+    """
+    Return the list of (surname, first names or initials) of the authors
+    in `text`, with ('others', '') for 'et al.'.
+    """
+    text, n_et_al = et_al_pattern.subn(u'', text.strip())
+    names = list()
+    for chunk in name_separator.split(text):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        if initials_pattern.match(chunk) and names and names[-1][1] is None:
+            # Initials following the surname: 'Fynbo, J. P. U.'
+            names[-1] = (names[-1][0], chunk)
+            continue
+        match = trailing_initials.match(chunk) or leading_initials.match(chunk)
+        if match:
+            names.append((match.group('last'), match.group('first').strip()))
+        else:
+            names.append((chunk.rstrip(u'.'), None))
+    authors = [(last, first or u'') for last, first in names]
+    if n_et_al:
+        authors.append((u'others', u''))
+    return authors
+
+
+def make_person(last, first):
+    """
+    pybtex Person from a surname and first names, without parsing a name
+    string. Leading lowercase words of the surname are the 'von' part.
+    """
+    words = last.split()
+    n_prelast = 0
+    while n_prelast < len(words) - 1 and words[n_prelast][:1].islower():
+        n_prelast += 1
+    return dbcache.unpack_person((first.split(), [], words[:n_prelast], words[n_prelast:], []))
+
+
+def parse_reference(line):
+    """ Return a pybtex Entry (without key) for one formatted reference. Raises ReferenceSyntaxError. """
+    from pybtex.database import Entry
+    text = label_pattern.sub(u'', line).strip()
+    match = reference_pattern.match(text)
+    if match is None:
+        raise ReferenceSyntaxError("No year found in reference: %s" % text)
+    authors = parse_authors(match.group('authors'))
+    if not authors:
+        raise ReferenceSyntaxError("No authors found in reference: %s" % text)
+
+    fields = [('year', match.group('year'))]
+    rest = (match.group('rest') or u'').strip()
+    article = article_pattern.match(rest)
+    arxiv = arxiv_pattern.match(rest)
+    if arxiv:
+        fields += [('journal', u'ArXiv e-prints'), ('eprint', arxiv.group('eprint'))]
+    elif article:
+        fields += [('journal', journal_field(article.group('journal').strip(u' ,.'))),
+                   ('volume', article.group('volume')), ('pages', article.group('pages'))]
+    elif rest.strip(u' .'):
+        fields.append(('journal', journal_field(rest.strip(u' ,.'))))
+
+    bib_entry = Entry('article', fields=fields)
+    bib_entry.persons['author'] = [make_person(last, first) for last, first in authors]
+    return bib_entry
+
+
+def iter_references(lines):
+    """
+    Parse an iterable of lines one at a time. Yields (line number, line,
+    Entry or None, error message or None); blank lines are skipped.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, line, parse_reference(line), None
+        except ReferenceSyntaxError as error:
+            yield number, line, None, unicode(error)
+
+
+def make_key(bib_entry, used):
+    """ Key from the first author and year ('Fynbo2011'), with a suffix if it is in `used`. """
+    surname = bib_entry.persons['author'][0].last_names
+    base = key_characters.sub(u'', searchindex.fold_accents(u''.join(surname)))
+    base = (base[:1].upper() + base[1:] or u'Ref') + bib_entry.fields['year']
+    key = base
+    suffix = 0
+    while key in used:
+        key = base + u'abcdefghijklmnopqrstuvwxyz'[suffix % 26] * (suffix // 26 + 1)
+        suffix += 1
+    return key
+
+
+def signature(author_text, year, journal, volume, pages, eprint=u''):
+    """
+    Tuple identifying a published paper from the normalized author search
+    text (see columns.search_text), year, journal display name, volume,
+    pages and arXiv number. Returns None if there is not enough to compare.
+    """
+    first_author = author_text.split(u';')[0].split(u' and ')[0].strip()
+    if u',' in first_author:
+        surname = first_author.split(u',')[0].strip()
+    else:
+        surname = first_author.split()[-1] if first_author else u''
+    journal = formatting.normalize_journal(journal)
+    if eprint and 'arxiv' in journal:
+        return (surname, year.strip(), u'arxiv', duplicates.normalize_eprint(eprint))
+    if not (surname and volume.strip() and pages.strip()):
+        return None
+    return (surname, year.strip(), journal, volume.strip().lower(),
+            pages.split(u'-')[0].strip().lower())
+
+
+def entry_signature(bib_entry):
+    if 'author' not in bib_entry.persons.keys() or 'year' not in bib_entry.fields.keys():
+        return None
+    fields = bib_entry.fields
+    return signature(columns.search_text(bib_entry, 'author'), fields['year'],
+                     columns.display_text(bib_entry, 'journal'), fields.get('volume', u''),
+                     fields.get('pages', u''), fields.get('eprint', u''))
+
+
+class ReferenceIndex(object):
+    """ Signature -> key of the entries of a session, for finding references already in the database. """
+
+    def __init__(self, session=None):
+        self.keys = dict()
+        if session is not None:
+            self.add_session(session)
+
+    def add_session(self, session):
+        """ Index all entries, from the field columns where possible. """
+        session.ensure_indexed()
+        column_data = session.columns
+        for key, bib_entry in session.bib_database.entries.items():
+            if key in column_data and 'arxiv' not in column_data.search_text(key, 'journal'):
+                entry_id = signature(column_data.search_text(key, 'author'),
+                                     column_data.display_text(key, 'year'),
+                                     column_data.display_text(key, 'journal'),
+                                     column_data.display_text(key, 'volume'),
+                                     column_data.display_text(key, 'pages'))
+            else:
+                entry_id = entry_signature(bib_entry)
+            if entry_id is not None:
+                self.keys.setdefault(entry_id, key)
+
+    def add_entry(self, key, bib_entry):
+        entry_id = entry_signature(bib_entry)
+        if entry_id is not None:
+            self.keys.setdefault(entry_id, key)
+
+    def find(self, bib_entry):
+        """ Return the key of an entry for the same paper, or None. """
+        entry_id = entry_signature(bib_entry)
+        if entry_id is None:
+            return None
+        return self.keys.get(entry_id)
+
+
+class ImportReport(object):
+    """ Keys added, (line, key) of references already in the database and (line number, line, error). """
+
+    def __init__(self):
+        self.added = list()
+        self.duplicates = list()
+        self.errors = list()
+
+    def summary(self):
+        return u"%i added, %i already in the database, %i not understood" % (
+            len(self.added), len(self.duplicates), len(self.errors))
+
+
+class UsedKeys(object):
+    """ Keys of a session and of the batch of entries being added to it. """
+
+    def __init__(self, session, batch):
+        self.session = session
+        self.batch = batch
+
+    def __contains__(self, key):
+        return key in self.batch.entries or key in self.session.bib_database.entries
+
+
+def import_references(session, lines, batch_size=1000):
+    """
+    Parse `lines` and add the new entries to `session` (see
+    DatabaseSession.add_entries), `batch_size` entries at a time.
+    Returns an ImportReport.
+    """
+    from pybtex.database import BibliographyData
+    report = ImportReport()
+    index = ReferenceIndex(session)
+    batch = BibliographyData()
+    for number, line, bib_entry, error in iter_references(lines):
+        if bib_entry is None:
+            report.errors.append((number, line, error))
+            continue
+        original = index.find(bib_entry)
+        if original is not None:
+            report.duplicates.append((line, original))
+            continue
+        key = make_key(bib_entry, UsedKeys(session, batch))
+        batch.add_entry(key, bib_entry)
+        index.add_entry(key, bib_entry)
+        if len(batch.entries) >= batch_size:
+            report.added.extend(session.add_entries(batch))
+            batch = BibliographyData()
+    if batch.entries:
+        report.added.extend(session.add_entries(batch))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert formatted references to BibTeX entries")
+    parser.add_argument('filename', nargs='?', default=None,
+                        help="Text file with one reference per line (default: stdin)")
+    parser.add_argument('-o', '--output', default=None, help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    import writer
+    if args.filename:
+        lines = io.open(args.filename, encoding='utf-8')
+    else:
+        lines = io.open(sys.stdin.fileno(), encoding='utf-8', closefd=False)
+    if args.output:
+        output = io.open(args.output, 'w', encoding='utf-8')
+    else:
+        output = io.open(sys.stdout.fileno(), 'w', encoding='utf-8', closefd=False)
+
+    used = set()
+    n_errors = 0
+    with lines, output:
+        for number, line, bib_entry, error in iter_references(lines):
+            if bib_entry is None:
+                sys.stderr.write((u"line %i: %s\n" % (number, error)).encode('utf-8'))
+                n_errors += 1
+                continue
+            key = make_key(bib_entry, used)
+            used.add(key)
+            output.write(writer.format_entry(key, bib_entry) + u'\n\n')
+    return 1 if n_errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Bounded least-recently-used caches for rendered text.
+    Values can be stored together with a digest of the data they were
+    rendered from; a lookup with a different digest counts as a miss.
+"""
+
+from collections import OrderedDict
+
+
+def entry_digest(bib_entry):
+    """ Hash of the type, fields and persons of a pybtex Entry. """
+    persons = tuple((role, tuple(unicode(person) for person in person_list))
+                    for role, person_list in bib_entry.persons.items())
+    return hash((bib_entry.type, tuple(bib_entry.fields.items()), persons))
+
+
+class LRUCache(object):
+    """ Mapping of at most `maxsize` items, evicting the least recently used. """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, digest=None):
+        """ Return the cached value of `key` or None if missing or stale. """
+        try:
+            cached_digest, value = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        if cached_digest != digest:
+            self.misses += 1
+            return None
+
+        # Re-insert to mark as most recently used:
+        self.data[key] = (cached_digest, value)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, digest=None):
+        self.data.pop(key, None)
+        self.data[key] = (digest, value)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def items(self):
+        """ Return the cached (key, value) pairs, least recently used first. """
+        return [(key, value) for key, (digest, value) in self.data.items()]
+
+    def update(self, items):
+        for key, value in items:
+            self.put(key, value)
+
+    def invalidate(self, key):
+        self.data.pop(key, None)
+
+    def clear(self):
+        self.data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        if lookups:
+            hit_rate = float(self.hits) / lookups
+        else:
+            hit_rate = 0.
+        return {'size': len(self.data), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses, 'hit_rate': hit_rate}
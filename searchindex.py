@@ -0,0 +1,253 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Inverted full-text index over a pybtex BibliographyData.
+    Each indexed field maps a normalized token to the set of entry keys
+    containing it, so content searches become set operations instead of
+    substring scans over every entry.
+    Tokens are folded to plain ASCII letters where possible, so 'Moller'
+    finds '{M{\\o}ller}' and 'Perou' finds 'P{\\'e}roux'.
+"""
+
+import re
+import unicodedata
+from bisect import bisect_left
+
+import formatting
+import texconvert
+
+indexed_fields = ['author', 'title', 'journal', 'keywords', 'abstract']
+
+# Names used in the SearchWindow which differ from the BibTeX field names:
+field_aliases = {'keyword': 'keywords'}
+
+token_pattern = re.compile(r'\w+', re.UNICODE)
+
+# Letters which have no decomposition into a base letter and an accent:
+special_letters = {u'\xf8': u'o', u'\xd8': u'O', u'\xe6': u'ae', u'\xc6': u'AE',
+                   u'\xdf': u'ss', u'\u0142': u'l', u'\u0141': u'L', u'\u0111': u'd',
+                   u'\u0110': u'D', u'\xf0': u'd', u'\xfe': u'th', u'\u0131': u'i',
+                   u'\u0153': u'oe', u'\u0152': u'OE'}
+
+
+def fold_accents(text):
+    """ Remove accents and replace special letters by their ASCII equivalents. """
+    if all(ord(char) < 128 for char in text):
+        return text
+    text = unicodedata.normalize('NFKD', text)
+    return u''.join(special_letters.get(char, char) for char in text
+                    if not unicodedata.combining(char))
+
+
+def normalize_text(text):
+    """ Convert LaTeX to Unicode, remove grouping braces and accents and lowercase. """
+    if '\\' in text:
+        text = texconvert.latex2text(text)
+    return fold_accents(formatting.clean_string(text.replace('\n', ' '))).lower()
+
+
+def tokenize(text):
+    return token_pattern.findall(normalize_text(text))
+
+
+def count_tokens(tokens):
+    counts = dict()
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+def entry_tokens(bib_entry, field, text=None):
+    """
+    Return the normalized tokens of `field` in the given entry as a dict of token -> count.
+    `text` is the already normalized text of the field, if available (see columns.py).
+    """
+    if text is not None and field != 'journal':
+        return count_tokens(token_pattern.findall(text))
+
+    elif field == 'author':
+        if 'author' not in bib_entry.persons.keys():
+            return dict()
+        tokens = list()
+        for author_field in bib_entry.fields['author'].split(' and '):
+            tokens.extend(tokenize(author_field))
+        return count_tokens(tokens)
+
+    elif field not in bib_entry.fields.keys():
+        return dict()
+
+    elif field == 'journal':
+        # Index both the LaTeX macro and the journal name it stands for:
+        tokens = set(tokenize(bib_entry.fields['journal'].strip('\\')))
+        tokens.update(tokenize(formatting.format_journal_name(bib_entry)))
+        return count_tokens(tokens)
+
+    else:
+        return count_tokens(tokenize(bib_entry.fields[field]))
+
+
+class ContentIndex(object):
+    """
+    Token -> posting list (set of entry keys) for each of the `indexed_fields`.
+    Tokens are normalized once when an entry is added, queries are matched
+    as token prefixes against a sorted vocabulary of each field.
+    The token counts and the total number of tokens per field are kept for
+    relevance ranking (see ranking.py).
+    """
+
+    def __init__(self, fields=indexed_fields):
+        self.fields = list(fields)
+        self.clear()
+
+    def clear(self):
+        self.postings = dict((field, dict()) for field in self.fields)
+        self.entry_tokens = dict()
+        # Number of tokens in each field of an entry, the document length of BM25:
+        self.entry_lengths = dict()
+        # Number of entries having each field and their total number of tokens:
+        self.field_counts = dict((field, 0) for field in self.fields)
+        self.field_lengths = dict((field, 0) for field in self.fields)
+        self._vocabulary = dict()
+        self._lengths = dict()
+
+    def _invalidate(self, field):
+        self._vocabulary.pop(field, None)
+        self._lengths.pop(field, None)
+
+    def build(self, bib_database):
+        self.clear()
+        for key, bib_entry in bib_database.entries.items():
+            self.add_entry(key, bib_entry)
+
+    def load_tokens(self, entry_tokens):
+        """ Fill the index from the `entry_tokens` of a previously built index. """
+        self.clear()
+        for key, tokens_by_field in entry_tokens.items():
+            self.add_tokens(key, tokens_by_field)
+
+    def add_entry(self, key, bib_entry, texts=None):
+        """ Index the entry. `texts` is an optional dictionary of normalized text of each field. """
+        tokens_by_field = dict()
+        for field in self.fields:
+            if texts is not None:
+                tokens_by_field[field] = entry_tokens(bib_entry, field, texts.get(field))
+            else:
+                tokens_by_field[field] = entry_tokens(bib_entry, field)
+        self.add_tokens(key, tokens_by_field)
+
+    def add_tokens(self, key, tokens_by_field):
+        """ Index an entry from a dictionary of field -> token counts. """
+        lengths = dict()
+        for field, tokens in tokens_by_field.items():
+            postings = self.postings[field]
+            for token in tokens:
+                if token not in postings:
+                    postings[token] = set()
+                    self._invalidate(field)
+                postings[token].add(key)
+            lengths[field] = sum(tokens.values())
+            if tokens:
+                self.field_counts[field] += 1
+                self.field_lengths[field] += lengths[field]
+        self.entry_tokens[key] = tokens_by_field
+        self.entry_lengths[key] = lengths
+
+    def remove_entry(self, key):
+        tokens_by_field = self.entry_tokens.pop(key, None)
+        if tokens_by_field is None:
+            return
+        lengths = self.entry_lengths.pop(key)
+        for field, tokens in tokens_by_field.items():
+            postings = self.postings[field]
+            for token in tokens:
+                postings[token].discard(key)
+                if not postings[token]:
+                    del postings[token]
+                    self._invalidate(field)
+            if tokens:
+                self.field_counts[field] -= 1
+                self.field_lengths[field] -= lengths[field]
+
+    def update_entry(self, key, bib_entry, texts=None):
+        self.remove_entry(key)
+        self.add_entry(key, bib_entry, texts)
+
+    def keys(self):
+        return set(self.entry_tokens.keys())
+
+    def vocabulary(self, field):
+        """ Sorted list of all tokens in `field`, rebuilt only after changes. """
+        if field not in self._vocabulary:
+            self._vocabulary[field] = sorted(self.postings[field].keys())
+        return self._vocabulary[field]
+
+    def vocabulary_by_length(self, field):
+        """ Dictionary of token length -> list of tokens in `field`, used for fuzzy matching. """
+        if field not in self._lengths:
+            by_length = dict()
+            for token in self.postings[field]:
+                by_length.setdefault(len(token), []).append(token)
+            self._lengths[field] = by_length
+        return self._lengths[field]
+
+    def prefix_tokens(self, field, word):
+        """ Return the tokens in `field` starting with `word`. """
+        vocabulary = self.vocabulary(field)
+        start = bisect_left(vocabulary, word)
+        tokens = list()
+        for token in vocabulary[start:]:
+            if not token.startswith(word):
+                break
+            tokens.append(token)
+        return tokens
+
+    def match_token(self, field, word):
+        """ Return the keys of entries having a token in `field` starting with `word`. """
+        postings = self.postings[field]
+        matches = set()
+        for token in self.prefix_tokens(field, word):
+            matches |= postings[token]
+        return matches
+
+    def search_field(self, field, query):
+        """ Keys of entries where every word of `query` matches in `field`. """
+        field = field_aliases.get(field, field)
+        if field not in self.postings:
+            return set()
+
+        matches = None
+        # Longer words are usually more selective, match those first:
+        words = sorted(set(tokenize(query)), key=len, reverse=True)
+        for word in words:
+            word_matches = self.match_token(field, word)
+            if matches is None:
+                matches = word_matches
+            else:
+                matches &= word_matches
+            if not matches:
+                return set()
+
+        if matches is None:
+            return set()
+        return matches
+
+    def search(self, queries):
+        """
+        Input is a dictionary of field name -> query string.
+        Returns the set of keys matching all non-empty queries.
+        """
+        matches = None
+        for field, query in queries.items():
+            if not query.strip():
+                continue
+            field_matches = self.search_field(field, query)
+            if matches is None:
+                matches = field_matches
+            else:
+                matches &= field_matches
+            if not matches:
+                return set()
+
+        if matches is None:
+            return self.keys()
+        return matches
@@ -0,0 +1,532 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    GUI-free core of PyBib.
+    A DatabaseSession holds an open BibTeX database together with its search
+    indexes, render cache, edit journal and the original file text used for
+    incremental saving. The Qt Window in pybib.py is a front-end on top of it,
+    but the session can be used from scripts without importing PyQt4:
+
+        from session import DatabaseSession
+        bib = DatabaseSession()
+        bib.open('test.bib')
+        matches = bib.search_content({'author': 'fynbo'})
+
+    pybtex and pylatexenc are only imported once they are needed, so
+    importing this module is cheap.
+"""
+
+import os
+
+import columns
+import formatting
+import instrument
+import journal
+import keyfilter
+import query
+import ranking
+import rendercache
+import searchindex
+
+__author__ = 'Jens-Kristian Krogager'
+
+
+class DatabaseSession(object):
+    """
+    With `compact` set, entries are stored in a compactstore.CompactDatabase
+    instead of a pybtex BibliographyData, to save memory for very large
+    libraries. The setting applies to the next opened file.
+    Files opened by open_lazy() are parsed and indexed entry by entry when
+    the entries are first needed, see lazyload.py.
+    """
+
+    def __init__(self, compact=False):
+        self.compact = compact
+        self.string_table = None
+        self._bib_database = None
+        self.lazy_database = None
+        self.unindexed = set()
+        self.index_order = list()
+        self.database_file = ''
+        self.database_info = None
+        self.source_file = None
+        self.dirty_entries = set()
+        self.edit_journal = journal.EditJournal()
+        self.content_index = searchindex.ContentIndex()
+        self.columns = columns.FieldColumns()
+        self.ranked_search = ranking.RankedSearch(self.content_index)
+        self.query_engine = query.QueryEngine(self.content_index, self.columns)
+        self.key_filter = keyfilter.KeyFilter()
+        self.render_cache = rendercache.LRUCache(maxsize=2000)
+        self.entryID_list = list()
+
+    @property
+    def bib_database(self):
+        if self._bib_database is None:
+            self._bib_database = self.new_database()
+        return self._bib_database
+
+    @bib_database.setter
+    def bib_database(self, bib_database):
+        self._bib_database = bib_database
+
+    def new_database(self):
+        """ Return an empty BibliographyData, or CompactDatabase if the session is compact. """
+        if self.compact:
+            import compactstore
+            if self.string_table is None:
+                self.string_table = compactstore.StringTable()
+            return compactstore.CompactDatabase(self.string_table)
+        from pybtex.database import BibliographyData
+        return BibliographyData()
+
+    def clear(self):
+        if self.lazy_database is not None:
+            # Unmap the file, which is locked on Windows while it is mapped:
+            self.lazy_database.close()
+        self.lazy_database = None
+        self.unindexed = set()
+        self.index_order = list()
+        self._bib_database = None
+        self.string_table = None
+        self.database_file = ''
+        self.database_info = None
+        self.source_file = None
+        self.dirty_entries.clear()
+        self.edit_journal.clear()
+        self.content_index.clear()
+        self.columns.clear()
+        self.query_engine.clear()
+        self.render_cache.clear()
+        self.entryID_list = list()
+        self.key_filter.set_keys(self.entryID_list)
+
+    # -- Loading:
+    @instrument.traced('session.open')
+    def open(self, filename, processes=1):
+        """ Load `filename`, from the binary cache if it is up to date. """
+        if self.open_cached(filename):
+            return
+
+        import loader
+        import writer
+        text = loader.read_bibtex(filename)
+        if processes == 1:
+            batches = loader.iter_batches(text)
+        else:
+            batches = loader.iter_batches_parallel(text, processes)
+        for chunk_database, end in batches:
+            self.add_batch(chunk_database)
+        self.finish_loading(writer.SourceFile(text))
+
+    @instrument.traced('session.open_cached')
+    def open_cached(self, filename):
+        """
+        Start a new session for `filename` and load it from the binary cache.
+        Returns False if there is no valid cache, in which case the file must
+        be parsed and passed to add_batch() and finish_loading().
+        """
+        import dbcache
+        self.clear()
+        self.database_file = filename
+        self.database_info = dbcache.file_info(filename)
+        cached = dbcache.load_cache(filename, self.database_info, self.new_database())
+        if cached is None:
+            return False
+
+        self.bib_database = cached['bib_database']
+        self.content_index.load_tokens(cached['entry_tokens'])
+        self.columns.set_state(cached['columns'])
+        self.query_engine.build(self.bib_database)
+        self.sort_keys()
+        return True
+
+    @instrument.traced('session.add_batch')
+    def add_batch(self, chunk_database):
+        """ Add the entries of a parsed chunk. Returns the list of added keys. """
+        import loader
+        entries = loader.merge_into(self.bib_database, chunk_database)
+        instrument.count('load.entries', len(entries))
+        for key, bib_entry in entries:
+            self.index_entry(key, bib_entry)
+        return [key for key, bib_entry in entries]
+
+    def index_entry(self, key, bib_entry):
+        # Normalize the fields once for both the columns and the index:
+        self.columns.add_entry(key, bib_entry)
+        self.content_index.add_entry(key, bib_entry, self.columns.search_texts(key))
+        self.query_engine.add_entry(key, bib_entry)
+
+    @instrument.traced('session.finish_loading')
+    def finish_loading(self, source_file=None, write_cache=True):
+        """ Sort the keys after the last batch and update the binary cache. """
+        self.source_file = source_file
+        self.sort_keys()
+        if write_cache:
+            self.write_cache()
+
+    def write_cache(self):
+        import dbcache
+        dbcache.save_cache(self.database_file, self.bib_database,
+                           self.content_index.entry_tokens, self.database_info,
+                           self.columns.get_state())
+
+    @instrument.traced('session.open_lazy')
+    def open_lazy(self, filename):
+        """
+        Open `filename` without parsing it. Only the keys are read at once,
+        entries are parsed and indexed when first displayed or edited, and
+        all of them before a search. The remaining entries are parsed by a
+        background thread; call index_pending() regularly to index them.
+        """
+        import dbcache
+        import lazyload
+        self.clear()
+        self.database_file = filename
+        self.database_info = dbcache.file_info(filename)
+        self.lazy_database = lazyload.LazyDatabase(filename)
+        self.bib_database = self.lazy_database
+        # Reversed, so index_pending() pops the keys in file order as they are parsed:
+        self.index_order = self.lazy_database.entries.keys()[::-1]
+        self.unindexed = set(self.index_order)
+        self.sort_keys()
+        self.lazy_database.start_warming()
+
+    def ensure_indexed(self, keys=None):
+        """ Parse and index the entries of `keys` (default: all) not indexed yet after open_lazy(). """
+        if not self.unindexed:
+            return
+        if keys is None:
+            keys = [key for key in self.index_order if key in self.unindexed]
+        else:
+            keys = [key for key in keys if key in self.unindexed]
+        if not keys:
+            return
+        if self.bib_database is self.lazy_database:
+            self.lazy_database.parse_keys(keys)
+        for key in keys:
+            self.index_entry(key, self.bib_database.entries[key])
+            self.unindexed.discard(key)
+        instrument.count('lazy.indexed', len(keys))
+        if not self.unindexed:
+            self.index_order = list()
+            self.write_cache()
+
+    def index_pending(self, count=200):
+        """ Index the next `count` entries of a lazily opened file. Returns the number left. """
+        keys = list()
+        while self.index_order and len(keys) < count:
+            key = self.index_order.pop()
+            if key in self.unindexed:
+                keys.append(key)
+        self.ensure_indexed(keys)
+        return len(self.unindexed)
+
+    def sort_keys(self):
+        self.entryID_list = sorted(self.bib_database.entries.keys())
+        self.key_filter.set_keys(self.entryID_list)
+
+    # -- Searching:
+    @instrument.traced('session.search_content')
+    def search_content(self, queries):
+        """
+        Input is a dictionary of field name -> query string.
+        Returns the sorted list of matching keys, which also becomes the
+        scope of filter_keys().
+        """
+        self.ensure_indexed()
+        matches = sorted(self.content_index.search(queries))
+        instrument.count('search.matches', len(matches))
+        self.key_filter.set_scope(matches)
+        return matches
+
+    @instrument.traced('session.query')
+    def query(self, text):
+        """
+        Search with a query string such as 'author:fynbo year:2010..2015 -keyword:quasar'
+        (see query.py). Returns the sorted list of matching keys, which also
+        becomes the scope of filter_keys(). Raises query.QuerySyntaxError.
+        """
+        self.ensure_indexed()
+        matches = sorted(self.query_engine.search(text))
+        instrument.count('search.matches', len(matches))
+        self.key_filter.set_scope(matches)
+        return matches
+
+    @instrument.traced('session.rank_content')
+    def rank_content(self, queries, k=200):
+        """
+        Relevance ranked version of search_content(). Returns a list of
+        (key, score) of the `k` best entries, best first, and restricts
+        filter_keys() to these keys in the same order.
+        """
+        self.ensure_indexed()
+        ranked = self.ranked_search.search(queries, k)
+        self.key_filter.set_scope([key for key, score in ranked], ordered=True)
+        return ranked
+
+    def reset_scope(self):
+        self.key_filter.set_scope(None)
+
+    @instrument.traced('session.filter_keys')
+    def filter_keys(self, text):
+        """ Return the positions in self.entryID_list of the keys in scope containing `text`. """
+        return self.key_filter.filter(text)
+
+    # -- Display:
+    @instrument.traced('session.render_entry')
+    def render_entry(self, entryID, field_names):
+        """
+        Return the display text of `field_names` for the entry. Fields in the
+        columns are looked up directly, the others use the render cache.
+        """
+        self.ensure_indexed([entryID])
+        names = [name for name in field_names if name.lower() not in self.columns.fields]
+        if names:
+            bib_entry = self.bib_database.entries[entryID]
+            digest = rendercache.entry_digest(bib_entry)
+            rendered = self.render_cache.get(entryID, digest)
+            if rendered is None or not all(name in rendered for name in names):
+                instrument.count('render.misses')
+                rendered = dict(zip(names, formatting.format_entry_view(bib_entry, names)))
+                self.render_cache.put(entryID, rendered, digest)
+
+        entry_view = list()
+        for name in field_names:
+            if name.lower() in self.columns.fields:
+                entry_view.append(self.columns.display_text(entryID, name.lower()))
+            else:
+                entry_view.append(rendered[name])
+        return entry_view
+
+    @instrument.traced('session.prerender')
+    def prerender(self, entryIDs, field_names):
+        """
+        Render entries before they are displayed, e.g. the neighbours of the
+        selected entry, so render_entry() finds them parsed and in the cache.
+        """
+        for entryID in entryIDs:
+            self.render_entry(entryID, field_names)
+        instrument.count('render.prerendered', len(entryIDs))
+
+    def memory_report(self):
+        """ Text report of the memory used by the field columns. """
+        return self.columns.memory_report()
+
+    # -- Editing:
+    @instrument.traced('session.update_entry')
+    def update_entry(self, entryID, values):
+        """
+        Set the fields of an entry from a dictionary of field name -> text.
+        Only changed fields are applied and recorded in the edit journal.
+        Returns True if the entry was changed.
+        """
+        self.ensure_indexed([entryID])
+        bib_entry = self.bib_database.entries[entryID]
+        deltas = list()
+        for field, changed_data in values.items():
+            old_data = journal.field_value(bib_entry, field)
+            if changed_data != old_data:
+                journal.set_field_value(bib_entry, field, changed_data)
+                deltas.append((entryID, field, old_data, changed_data))
+        self.edit_journal.record(deltas)
+        if deltas:
+            self.entry_changed(entryID)
+        return bool(deltas)
+
+    @instrument.traced('session.add_entries')
+    def add_entries(self, bib_database):
+        """
+        Add the entries of `bib_database` (e.g., fetched by fetch.py) in one
+        update of the indexes and the key list. Entries whose key is already
+        used are skipped. The added entries are saved with the file.
+        Returns the list of added keys.
+        """
+        from pybtex.database import BibliographyData
+        self.ensure_indexed()
+        new_entries = BibliographyData()
+        for key, bib_entry in bib_database.entries.items():
+            if key not in self.bib_database.entries and key not in new_entries.entries:
+                new_entries.add_entry(key, bib_entry)
+        added = self.add_batch(new_entries)
+        self.key_filter.add_keys(added)
+        self.entryID_list = self.key_filter.keys
+        self.dirty_entries.update(added)
+        return added
+
+    def entry_changed(self, entryID):
+        """ Update indexes and caches after the entry has been modified. """
+        self.reindex_entry(entryID)
+        self.dirty_entries.add(entryID)
+
+    def reindex_entry(self, entryID):
+        self.unindexed.discard(entryID)
+        bib_entry = self.bib_database.entries[entryID]
+        self.columns.update_entry(entryID, bib_entry)
+        self.content_index.update_entry(entryID, bib_entry, self.columns.search_texts(entryID))
+        self.query_engine.update_entry(entryID, bib_entry)
+        self.render_cache.invalidate(entryID)
+
+    def remove_entries(self, keys):
+        """
+        Remove the entries of `keys` from the database and all indexes.
+        Unsaved edits of the entries are dropped, and the entries are not
+        removed from the file by save().
+        """
+        from pybtex.database import BibliographyData
+        removed = set(keys)
+        if not removed:
+            return
+        for key in removed:
+            self.content_index.remove_entry(key)
+            self.columns.remove_entry(key)
+            self.query_engine.remove_entry(key)
+            self.render_cache.invalidate(key)
+        self.dirty_entries -= removed
+        self.unindexed -= removed
+        self.edit_journal.forget(removed)
+
+        if isinstance(self.bib_database, BibliographyData):
+            # pybtex does not support removing entries, make a new database instead:
+            bib_database = self.new_database()
+            for key, bib_entry in self.bib_database.entries.items():
+                if key not in removed:
+                    bib_database.add_entry(key, bib_entry)
+            bib_database.add_to_preamble(*self.bib_database._preamble)
+            self.bib_database = bib_database
+        else:
+            # The compact and lazily loaded databases remove entries in place:
+            entries = self.bib_database.entries
+            for key in removed:
+                if key in entries:
+                    del entries[key]
+        self.key_filter.remove_keys(removed)
+        self.entryID_list = self.key_filter.keys
+
+    @instrument.traced('session.undo')
+    def undo(self):
+        """ Undo the last edit. Returns the keys of the changed entries. """
+        changed_keys = set(self.edit_journal.undo(self.bib_database))
+        for entryID in changed_keys:
+            self.entry_changed(entryID)
+        return sorted(changed_keys)
+
+    @instrument.traced('session.redo')
+    def redo(self):
+        """ Redo the last undone edit. Returns the keys of the changed entries. """
+        changed_keys = set(self.edit_journal.redo(self.bib_database))
+        for entryID in changed_keys:
+            self.entry_changed(entryID)
+        return sorted(changed_keys)
+
+    # -- Reloading:
+    def load_source_file(self):
+        """
+        Read the original text of a file opened from the binary cache, if it
+        is still unchanged on disk. Returns the SourceFile or None.
+        """
+        import dbcache
+        import writer
+        if self.source_file is None and self.database_info is not None:
+            if dbcache.file_info(self.database_file)['sha1'] == self.database_info['sha1']:
+                self.source_file = writer.SourceFile.from_file(self.database_file)
+        return self.source_file
+
+    def check_unchanged(self, filename):
+        """
+        Read the original text of the opened file as load_source_file().
+        Raises IOError if `filename` is the opened file and it was changed by
+        another program since it was read, as saving would overwrite the
+        changes with entries spliced at their old positions.
+        """
+        source_file = self.load_source_file()
+        if (self.database_file and os.path.exists(filename) and
+                os.path.abspath(filename) == os.path.abspath(self.database_file)):
+            if source_file is None:
+                changed = self.database_info is not None
+            else:
+                changed = not source_file.is_current(filename)
+            if changed:
+                raise IOError("File changed on disk: %s" % filename)
+        return source_file
+
+    def watched_files(self):
+        """ Return the files to watch for reload_file(), reading their original text if needed. """
+        if not self.database_file or self.load_source_file() is None:
+            return []
+        return [self.database_file]
+
+    @instrument.traced('session.reload_file')
+    def reload_file(self, filename=None):
+        """
+        Apply the changes made to the opened file by another program. Only
+        the added, removed and changed entries are parsed and re-indexed.
+        Entries with unsaved edits are kept as edited and reported as
+        conflicts. Returns a watcher.FileChanges, or None if the previous
+        text of the file is not known. If the new entries cannot be parsed,
+        the error is raised before the session is changed.
+        """
+        import dbcache
+        import loader
+        import watcher
+        import writer
+        if self.source_file is None:
+            return None
+
+        text = loader.read_bibtex(self.database_file)
+        changes = watcher.diff_entries(self.source_file.text, text)
+        if not changes:
+            self.source_file = writer.SourceFile(text)
+            return changes
+
+        changes.conflicts = (changes.changed | changes.removed) & self.dirty_entries
+        changes.conflicts.update(key for key in changes.added if key in self.bib_database.entries)
+        removed = changes.removed - changes.conflicts
+        changed = changes.changed - changes.conflicts
+        added = changes.added - changes.conflicts
+
+        parsed = watcher.parse_entries(text, added | changed)
+        self.remove_entries(removed)
+        for key in changed:
+            # Replace the entry in place, keeping the order of the database:
+            self.bib_database.entries[key] = parsed.entries[key]
+            self.reindex_entry(key)
+        for key in added:
+            bib_entry = parsed.entries[key]
+            self.bib_database.add_entry(key, bib_entry)
+            self.columns.add_entry(key, bib_entry)
+            self.content_index.add_entry(key, bib_entry, self.columns.search_texts(key))
+            self.query_engine.add_entry(key, bib_entry)
+        self.key_filter.add_keys(added)
+        self.entryID_list = self.key_filter.keys
+
+        # Undo steps of replaced entries no longer apply:
+        self.edit_journal.forget(removed | changed)
+        self.source_file = writer.SourceFile(text)
+        self.database_info = dbcache.file_info(self.database_file)
+        return changes
+
+    # -- Saving:
+    @instrument.traced('session.save')
+    def save(self, filename):
+        """
+        Write the database to `filename`. If the original text of the opened
+        file is available, only the edited entries are re-formatted.
+        Raises IOError or OSError if the file cannot be written, or if it
+        was changed by another program and not reloaded yet.
+        """
+        import dbcache
+        import writer
+        # Opened from the cache, read the original text only if unchanged:
+        self.check_unchanged(filename)
+
+        if self.source_file is not None:
+            # Only re-format the edited entries, copy the rest of the file:
+            writer.save_incremental(filename, self.source_file, self.bib_database,
+                                    self.dirty_entries)
+        else:
+            writer.save_full(filename, self.bib_database)
+
+        self.dirty_entries.clear()
+        self.database_file = filename
+        self.database_info = dbcache.file_info(filename)
@@ -0,0 +1,862 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    SQLite storage of large, shared BibTeX libraries.
+    The .bib file is imported once into a local SQLite file (one per user
+    and library, see library_filename()) holding the packed fields and
+    persons of every entry, the display text of the field columns and an
+    FTS5 full text index over the normalized author, title, journal,
+    keywords and abstract. A second FTS5 table with the trigram tokenizer
+    indexes the keys for the search bar. The library is imported again
+    only when the SHA1 hash of the .bib file changes.
+
+    An SQLiteSession is a DatabaseSession whose searches, key filtering
+    and entry display run as indexed queries, so the entries never have to
+    be held in memory as pybtex objects. Export streams the rows to the
+    file in the format of writer.format_entry().
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+from collections import OrderedDict
+
+import columns
+import dbcache
+import formatting
+import instrument
+import keyfilter
+import query
+import ranking
+import rendercache
+import searchindex
+import session
+import writer
+
+__author__ = 'Jens-Kristian Krogager'
+
+SCHEMA_VERSION = 1
+
+library_directory = os.path.join(os.path.expanduser('~'), '.pybib', 'libraries')
+
+# Columns of the full text index, in the order of the bm25() weights:
+text_fields = ['author', 'title', 'journal', 'keywords', 'abstract']
+rank_weights = [ranking.author_weight, ranking.field_weights['title'], 0.,
+                ranking.field_weights['keywords'], ranking.field_weights['abstract']]
+
+schema = """
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE COLLATE NOCASE,
+    rank INTEGER,
+    type TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    persons TEXT NOT NULL,
+    year_number INTEGER,
+    journal_key TEXT,
+    journal_name_key TEXT,
+    %s
+);
+CREATE INDEX IF NOT EXISTS entries_rank ON entries (rank);
+CREATE INDEX IF NOT EXISTS entries_year ON entries (year_number);
+CREATE INDEX IF NOT EXISTS entries_journal ON entries (journal_key);
+CREATE INDEX IF NOT EXISTS entries_journal_name ON entries (journal_name_key);
+CREATE VIRTUAL TABLE IF NOT EXISTS entry_text USING fts5(%s);
+CREATE VIRTUAL TABLE IF NOT EXISTS key_text USING fts5(key, tokenize='trigram');
+""" % (',\n    '.join('%s TEXT' % field for field in columns.column_fields),
+       ', '.join(text_fields))
+
+
+def is_supported():
+    """ True if the SQLite library has FTS5 and the trigram tokenizer (SQLite 3.34+). """
+    connection = sqlite3.connect(':memory:')
+    try:
+        connection.execute("CREATE VIRTUAL TABLE test USING fts5(key, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        connection.close()
+    return True
+
+
+def library_filename(filename, directory=None):
+    """ SQLite file of the library imported from the .bib file `filename`. """
+    path = os.path.abspath(filename)
+    digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:10]
+    name = '%s.%s.sqlite' % (os.path.splitext(os.path.basename(path))[0], digest)
+    return os.path.join(directory or library_directory, name)
+
+
+def person_text(name_parts):
+    """ Name of a packed person (see dbcache.pack_person) as written by pybtex: 'von Last, Jr, First'. """
+    first, middle, prelast, last, lineage = name_parts
+    return u', '.join(part for part in (u' '.join(list(prelast) + list(last)),
+                                         u' '.join(lineage),
+                                         u' '.join(list(first) + list(middle))) if part)
+
+
+def fts_string(text):
+    return u'"%s"' % text.replace(u'"', u'""')
+
+
+def fts_words(text, field=None, phrase=False):
+    """
+    FTS5 expression matching all words of `text` as prefixes, in the column
+    `field` (default: any). Returns None if `text` has no words.
+    """
+    tokens = searchindex.tokenize(text)
+    if not tokens:
+        return None
+    if phrase:
+        # The last word is a prefix, as for single words:
+        terms = [fts_string(u' '.join(tokens)) + u'*']
+    else:
+        terms = [fts_string(token) + u'*' for token in sorted(set(tokens))]
+    if field is not None:
+        terms = [u'%s : %s' % (field, term) for term in terms]
+    return u' AND '.join(terms)
+
+
+class SQLiteLibrary(object):
+    """ Entries of one .bib file and their search indexes in an SQLite file. """
+
+    def __init__(self, filename):
+        self.filename = filename
+        dirname = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.connection = sqlite3.connect(filename)
+        try:
+            self.connection.executescript(schema)
+        except sqlite3.OperationalError:
+            # FTS5 or its trigram tokenizer is missing from this SQLite build:
+            self.connection.close()
+            raise
+        self.next_id = self.scalar("SELECT max(id) FROM entries") or 0
+
+    def close(self):
+        self.connection.close()
+
+    def execute(self, sql, params=()):
+        return self.connection.execute(sql, params)
+
+    def scalar(self, sql, params=()):
+        row = self.execute(sql, params).fetchone()
+        return row[0] if row else None
+
+    def commit(self):
+        self.connection.commit()
+
+    # -- Metadata:
+    def get_meta(self, name, default=None):
+        value = self.scalar("SELECT value FROM meta WHERE name = ?", (name,))
+        return default if value is None else json.loads(value)
+
+    def set_meta(self, name, value):
+        self.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                     (name, json.dumps(value)))
+
+    def is_current(self, info):
+        """ True if the library was fully imported from the file described by `info` (see dbcache.file_info). """
+        return (self.get_meta('version') == SCHEMA_VERSION and
+                self.get_meta('sha1') == info['sha1'])
+
+    def reset(self):
+        """ Remove all entries, before importing the file again. """
+        for table in ('meta', 'entries', 'entry_text', 'key_text'):
+            self.execute("DELETE FROM %s" % table)
+        self.commit()
+        self.next_id = 0
+
+    # -- Import:
+    def entry_row(self, bib_entry):
+        """ Column values of `bib_entry` other than id, key and rank. """
+        fields = list(bib_entry.fields.items())
+        persons = [(role, [dbcache.pack_person(person) for person in person_list])
+                   for role, person_list in bib_entry.persons.items()]
+        display = [columns.display_text(bib_entry, field) for field in columns.column_fields]
+        if 'journal' in bib_entry.fields.keys():
+            journal_key = formatting.normalize_journal(bib_entry.fields['journal'])
+            journal_name = columns.display_text(bib_entry, 'journal')
+            # Words of both the LaTeX macro and the journal name, as in the content index:
+            journal_text = searchindex.normalize_text(bib_entry.fields['journal'].strip('\\') +
+                                                      u' ' + journal_name)
+            journal_name_key = formatting.normalize_journal(journal_name)
+        else:
+            journal_key = journal_name_key = journal_text = u''
+        text = list()
+        for field in text_fields:
+            if field == 'journal':
+                text.append(journal_text)
+            else:
+                text.append(columns.search_text(bib_entry, field))
+        row = [bib_entry.original_type, json.dumps(fields), json.dumps(persons),
+               query.entry_year(bib_entry), journal_key, journal_name_key] + display
+        return row, text
+
+    def insert_entry(self, key, bib_entry, rank=None):
+        """ Add an entry. Returns False if the key is already used (the first entry is kept, as by pybtex). """
+        row, text = self.entry_row(bib_entry)
+        entry_id = self.next_id + 1
+        cursor = self.execute("INSERT OR IGNORE INTO entries (id, key, rank, type, fields, persons, "
+                              "year_number, journal_key, journal_name_key, %s) VALUES (%s)"
+                              % (', '.join(columns.column_fields),
+                                 ', '.join('?' * (9 + len(columns.column_fields)))),
+                              [entry_id, key, rank] + row)
+        if cursor.rowcount != 1:
+            return False
+        self.next_id = entry_id
+        self.execute("INSERT INTO entry_text (rowid, %s) VALUES (?, %s)"
+                     % (', '.join(text_fields), ', '.join('?' * len(text_fields))),
+                     [entry_id] + text)
+        self.execute("INSERT INTO key_text (rowid, key) VALUES (?, ?)", (entry_id, key))
+        return True
+
+    def finish_import(self, info, preamble):
+        """ Number the keys in sorted order and mark the library as imported from `info`. """
+        self.update_ranks()
+        self.set_meta('preamble', preamble)
+        self.set_source(info)
+
+    def update_ranks(self):
+        """ Number the keys in sorted order, after entries were added. """
+        keys = sorted(self.execute("SELECT key, id FROM entries"))
+        self.connection.executemany("UPDATE entries SET rank = ? WHERE id = ?",
+                                    ((rank, entry_id) for rank, (key, entry_id) in enumerate(keys)))
+
+    def set_source(self, info):
+        """ Record that the library holds the content of the file described by `info`, and commit. """
+        self.set_meta('version', SCHEMA_VERSION)
+        self.set_meta('sha1', info['sha1'])
+        self.set_meta('path', info['path'])
+        self.commit()
+
+    def set_modified(self):
+        """ Record that the library has changes not saved to the file, so it is imported again. """
+        self.execute("DELETE FROM meta WHERE name = 'sha1'")
+
+    # -- Entries:
+    def __len__(self):
+        return self.scalar("SELECT count(*) FROM entries")
+
+    def __contains__(self, key):
+        return self.scalar("SELECT 1 FROM entries WHERE key = ?", (key,)) is not None
+
+    def keys(self, order='rank'):
+        """ All keys, sorted (order='rank') or in file order (order='id'). """
+        return [key for key, in self.execute("SELECT key FROM entries ORDER BY %s" % order)]
+
+    def rank_of(self, key):
+        return self.scalar("SELECT rank FROM entries WHERE key = ?", (key,))
+
+    def entry(self, key):
+        """ Return the entry of `key` as a new pybtex Entry. Raises KeyError. """
+        row = self.execute("SELECT key, type, fields, persons FROM entries WHERE key = ?",
+                           (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        key, entry_type, fields, persons = row
+        return dbcache.unpack_entry((key, entry_type, json.loads(fields), json.loads(persons)))
+
+    def iter_packed(self):
+        """ Yield all entries as (key, type, fields, persons) in file order, without creating Entry objects. """
+        for key, entry_type, fields, persons in self.execute("SELECT key, type, fields, persons "
+                                                             "FROM entries ORDER BY id"):
+            yield key, entry_type, json.loads(fields), json.loads(persons)
+
+    def update_entry(self, key, bib_entry):
+        """ Store the edited entry of `key`, or add it if the key is new. Changes are committed. """
+        self.set_modified()
+        entry_id = self.scalar("SELECT id FROM entries WHERE key = ?", (key,))
+        if entry_id is None:
+            self.insert_entry(key, bib_entry)
+        else:
+            row, text = self.entry_row(bib_entry)
+            self.execute("UPDATE entries SET type = ?, fields = ?, persons = ?, year_number = ?, "
+                         "journal_key = ?, journal_name_key = ?, %s WHERE id = ?"
+                         % ', '.join('%s = ?' % field for field in columns.column_fields),
+                         row + [entry_id])
+            self.execute("DELETE FROM entry_text WHERE rowid = ?", (entry_id,))
+            self.execute("INSERT INTO entry_text (rowid, %s) VALUES (?, %s)"
+                         % (', '.join(text_fields), ', '.join('?' * len(text_fields))),
+                         [entry_id] + text)
+        self.commit()
+
+    def delete_entries(self, keys):
+        """ Remove the entries of `keys` and their full text rows. Changes are committed. """
+        self.set_modified()
+        for key in keys:
+            entry_id = self.scalar("SELECT id FROM entries WHERE key = ?", (key,))
+            if entry_id is None:
+                continue
+            self.execute("DELETE FROM entry_text WHERE rowid = ?", (entry_id,))
+            self.execute("DELETE FROM key_text WHERE rowid = ?", (entry_id,))
+            self.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+        self.commit()
+
+    def display(self, key, fields):
+        """ Dictionary of field -> display text of the column `fields` of an entry. """
+        if not fields:
+            return dict()
+        row = self.execute("SELECT %s FROM entries WHERE key = ?" % ', '.join(fields),
+                           (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return dict(zip(fields, row))
+
+    # -- Searching:
+    def content_condition(self, queries):
+        """
+        SQL condition and parameters for a dictionary of field name -> query
+        string, as for searchindex.ContentIndex.search().
+        """
+        terms = list()
+        for field, text in queries.items():
+            if not text.strip():
+                continue
+            field = searchindex.field_aliases.get(field, field)
+            if field not in text_fields:
+                return "0", []
+            expression = fts_words(text, field)
+            if expression is None:
+                return "0", []
+            terms.append(expression)
+        if not terms:
+            return "1", []
+        return ("id IN (SELECT rowid FROM entry_text WHERE entry_text MATCH ?)",
+                [u' AND '.join(terms)])
+
+    def query_condition(self, text):
+        """ SQL condition and parameters for a query string (see query.py). Raises query.QuerySyntaxError. """
+        conditions = list()
+        params = list()
+        words = list()
+        for negate, field, value, phrase in query.parse_terms(text):
+            if field == 'year':
+                predicate = query.YearPredicate(None, value)
+                if predicate.first is None:
+                    condition, values = "year_number <= ?", [predicate.last]
+                elif predicate.last is None:
+                    condition, values = "year_number >= ?", [predicate.first]
+                else:
+                    condition, values = "year_number BETWEEN ? AND ?", [predicate.first,
+                                                                        predicate.last]
+            elif field == 'journal':
+                name = formatting.normalize_journal(value)
+                condition = ("(journal_key = ? OR journal_name_key = ? OR id IN "
+                             "(SELECT rowid FROM entry_text WHERE entry_text MATCH ?))")
+                values = [name, name, fts_words(value, 'journal', phrase=True) or u'""']
+            else:
+                expression = fts_words(value, field, phrase=phrase)
+                if expression is None:
+                    continue
+                if not negate:
+                    # Required words are matched in a single full text query:
+                    words.append(expression)
+                    continue
+                condition = "id IN (SELECT rowid FROM entry_text WHERE entry_text MATCH ?)"
+                values = [expression]
+
+            if negate:
+                condition = "NOT coalesce(%s, 0)" % condition
+            conditions.append(condition)
+            params.extend(values)
+
+        if words:
+            conditions.insert(0, "id IN (SELECT rowid FROM entry_text WHERE entry_text MATCH ?)")
+            params.insert(0, u' AND '.join(words))
+        if not conditions:
+            return "1", []
+        return ' AND '.join(conditions), params
+
+    def select_ranks(self, condition, params, offset=0, limit=-1):
+        return [rank for rank, in self.execute("SELECT rank FROM entries WHERE %s ORDER BY rank "
+                                               "LIMIT ? OFFSET ?" % condition,
+                                               list(params) + [limit, offset])]
+
+    def count(self, condition, params):
+        return self.scalar("SELECT count(*) FROM entries WHERE %s" % condition, params)
+
+    def search(self, queries, offset=0, limit=-1):
+        """ Sorted positions (ranks) of the entries matching the content `queries`, for one page of results. """
+        condition, params = self.content_condition(queries)
+        return self.select_ranks(condition, params, offset, limit)
+
+    def query(self, text, offset=0, limit=-1):
+        """ Sorted positions of the entries matching the query string. Raises query.QuerySyntaxError. """
+        condition, params = self.query_condition(text)
+        return self.select_ranks(condition, params, offset, limit)
+
+    def rank(self, queries, k=200):
+        """
+        Relevance ranked search with the bm25() function of FTS5, weighted as
+        in ranking.py. Fields without a weight (journal) are used as filters.
+        Returns a list of (key, rank, score) of the `k` best entries, best first.
+        """
+        words = list()
+        required = list()
+        for field, text in queries.items():
+            if not text.strip():
+                continue
+            field = searchindex.field_aliases.get(field, field)
+            if field not in text_fields:
+                return []
+            tokens = sorted(set(searchindex.tokenize(text)))
+            if field == 'journal':
+                if not tokens:
+                    return []
+                required.append(fts_words(text, field))
+            else:
+                words.extend(u'%s : %s*' % (field, fts_string(token)) for token in tokens)
+        if words:
+            # Any word adds to the score, as in ranking.RankedSearch:
+            required.insert(0, u'(%s)' % u' OR '.join(words))
+        if not required:
+            return []
+        rows = self.execute("SELECT entries.key, entries.rank, bm25(entry_text, %s) AS score "
+                            "FROM entry_text JOIN entries ON entries.id = entry_text.rowid "
+                            "WHERE entry_text MATCH ? ORDER BY score, entries.rank LIMIT ?"
+                            % ', '.join(str(weight) for weight in rank_weights),
+                            (u' AND '.join(required), k))
+        # bm25() is lower for better matches:
+        return [(key, rank, -score) for key, rank, score in rows]
+
+    def filter_keys(self, text):
+        """ Set of positions of the keys containing `text`, ignoring case. """
+        if len(text) >= 3:
+            rows = self.execute("SELECT entries.rank FROM key_text JOIN entries "
+                                "ON entries.id = key_text.rowid WHERE key_text MATCH ?",
+                                (fts_string(text),))
+        else:
+            pattern = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            rows = self.execute("SELECT rank FROM entries WHERE key LIKE ? ESCAPE '\\'",
+                                (u'%' + pattern + u'%',))
+        return set(rank for rank, in rows)
+
+    # -- Export:
+    def preamble(self):
+        return u''.join(self.get_meta('preamble', []))
+
+    def export(self, filename):
+        """ Write all entries to `filename`, streaming the rows in file order. """
+        with writer.atomic_file(filename) as output:
+            preamble = self.preamble()
+            if preamble:
+                from pybtex.database.output.bibtex import Writer
+                output.write(u'@preamble{%s}\n\n' % Writer().quote(preamble))
+            for num, (key, entry_type, fields, persons) in enumerate(self.iter_packed()):
+                names = [(role, [person_text(person) for person in person_list])
+                         for role, person_list in persons]
+                if num:
+                    output.write(u'\n')
+                output.write(writer.format_fields(entry_type, key, names, fields))
+                output.write(u'\n')
+
+    def report(self):
+        return u"%s: %i entries, %.1f MB" % (self.filename, len(self),
+                                             os.path.getsize(self.filename) / 1e6)
+
+
+class LibraryEntries(object):
+    """
+    Case-insensitive mapping of key -> entry like the `entries` of a
+    BibliographyData, reading the entries from an SQLiteLibrary. The most
+    recently used entries are kept as Entry objects, so the editor and the
+    edit journal can change them in place; changes are written to the
+    library by SQLiteSession.reindex_entry().
+    """
+
+    def __init__(self, database, max_live=200):
+        self.database = database
+        self.library = database.library
+        self.max_live = max_live
+        self.live = OrderedDict()
+
+    def __len__(self):
+        return len(self.library)
+
+    def __contains__(self, key):
+        return key.lower() in self.live or key in self.library
+
+    def __iter__(self):
+        return iter(self.library.keys('id'))
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.live.pop(key.lower(), None)
+        self.library.delete_entries([key])
+
+    def keys(self):
+        return self.library.keys('id')
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def __getitem__(self, key):
+        lower_key = key.lower()
+        bib_entry = self.live.pop(lower_key, None)
+        if bib_entry is None:
+            bib_entry = self.library.entry(key)
+            bib_entry.collection = self.database
+            if len(self.live) >= self.max_live:
+                self.live.popitem(last=False)
+        self.live[lower_key] = bib_entry
+        return bib_entry
+
+    def __setitem__(self, key, bib_entry):
+        bib_entry.key = key
+        bib_entry.collection = self.database
+        self.library.update_entry(key, bib_entry)
+        self.live.pop(key.lower(), None)
+        self.live[key.lower()] = bib_entry
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def iteritems(self):
+        """ Yield (key, entry) in file order. Entries which are not live are temporary copies. """
+        for packed in self.library.iter_packed():
+            key = packed[0]
+            bib_entry = self.live.get(key.lower())
+            if bib_entry is None:
+                bib_entry = dbcache.unpack_entry(packed)
+            yield key, bib_entry
+
+    def itervalues(self):
+        for key, bib_entry in self.iteritems():
+            yield bib_entry
+
+    items = iteritems
+    values = itervalues
+
+
+class LibraryDatabase(object):
+    """ Drop-in replacement of a pybtex BibliographyData over an SQLiteLibrary. """
+
+    def __init__(self, library):
+        self.library = library
+        self.entries = LibraryEntries(self)
+
+    def __len__(self):
+        return len(self.library)
+
+    @property
+    def _preamble(self):
+        return self.library.get_meta('preamble', [])
+
+    @_preamble.setter
+    def _preamble(self, values):
+        self.library.set_meta('preamble', list(values))
+
+    @property
+    def preamble(self):
+        return self.library.preamble()
+
+    def add_to_preamble(self, *values):
+        if values:
+            self._preamble = self._preamble + list(values)
+
+    def add_entry(self, key, bib_entry):
+        """ Add an Entry. Repeated keys are reported as by pybtex. """
+        if not self.library.insert_entry(key, bib_entry):
+            from pybtex.database import BibliographyDataError
+            from pybtex.errors import report_error
+            report_error(BibliographyDataError('repeated bibliograhpy entry: %s' % key))
+
+    def to_string(self, bib_format):
+        from pybtex.database import BibliographyData
+        bib_database = BibliographyData()
+        bib_database.add_to_preamble(*self._preamble)
+        for key, bib_entry in self.entries.items():
+            bib_database.add_entry(key, bib_entry)
+        return bib_database.to_string(bib_format)
+
+
+class Positions(object):
+    """ Read-only mapping of key -> position in the sorted key list, looked up in the library. """
+
+    def __init__(self, library):
+        self.library = library
+
+    def __contains__(self, key):
+        return key in self.library
+
+    def __getitem__(self, key):
+        rank = self.library.rank_of(key)
+        if rank is None:
+            raise KeyError(key)
+        return rank
+
+    def get(self, key, default=None):
+        rank = self.library.rank_of(key)
+        return default if rank is None else rank
+
+
+class LibraryKeyFilter(object):
+    """
+    keyfilter.KeyFilter over the keys of an SQLiteLibrary: keys containing
+    the query text are found with the trigram index of the library.
+    """
+
+    def __init__(self, library, keys=()):
+        self.library = library
+        self.position = Positions(library)
+        self.set_keys(keys)
+
+    def set_keys(self, keys):
+        self.keys = keys
+        self.set_scope(None)
+
+    def add_keys(self, keys):
+        # New keys are numbered when the key list is read again:
+        self.library.update_ranks()
+        self.set_keys(self.library.keys())
+
+    def remove_keys(self, keys):
+        # The positions of the remaining keys are numbered again:
+        self.library.update_ranks()
+        self.set_keys(self.library.keys())
+
+    def set_scope(self, keys=None, ordered=False):
+        self.set_positions(None if keys is None else
+                           [self.position[key] for key in keys if key in self.position], ordered)
+
+    def set_positions(self, positions=None, ordered=False):
+        """ Restrict the filter to the given positions in `keys`, see KeyFilter.set_scope(). """
+        self.ordered = ordered and positions is not None
+        if positions is None:
+            self.scope = range(len(self.keys))
+            self.scope_set = None
+        else:
+            self.scope = list(positions)
+            if not self.ordered:
+                self.scope.sort()
+            self.scope_set = set(self.scope)
+        self.reset()
+
+    def reset(self):
+        self.last_query = None
+        self.last_result = self.scope
+
+    def filter(self, text):
+        query_text = text.lower()
+        if not query_text:
+            result = self.scope
+        elif self.last_query is not None and self.last_query in query_text:
+            result = [num for num in self.last_result if query_text in self.keys[num].lower()]
+        else:
+            matches = self.library.filter_keys(query_text)
+            instrument.count('keyfilter.scanned', len(matches))
+            if self.scope_set is not None:
+                matches &= self.scope_set
+            if self.ordered:
+                result = [num for num in self.scope if num in matches]
+            else:
+                result = sorted(matches)
+        self.last_query = query_text
+        self.last_result = result
+        return result
+
+
+class SQLiteSession(session.DatabaseSession):
+    """
+    DatabaseSession storing the opened file in an SQLiteLibrary in
+    `directory` (default: ~/.pybib/libraries). Loading works as for a
+    DatabaseSession: if open_cached() returns False, the parsed batches
+    passed to add_batch() are imported and finish_loading() indexes them.
+    Edits are written to the library at once and saved to the .bib file
+    by save(). Ranked search uses the BM25 of SQLite and, unlike
+    ranking.py, does not allow typos in author names.
+    """
+
+    def __init__(self, directory=None):
+        super(SQLiteSession, self).__init__()
+        self.directory = directory
+        self.library = None
+
+    def clear(self):
+        super(SQLiteSession, self).clear()
+        if self.library is not None:
+            self.library.close()
+        self.library = None
+        self.key_filter = keyfilter.KeyFilter()
+
+    def new_database(self):
+        return LibraryDatabase(self.library)
+
+    # -- Loading:
+    @instrument.traced('sqlite.open_cached')
+    def open_cached(self, filename):
+        """
+        Open the library of `filename`. Returns False if it has to be
+        imported again, in which case the file must be parsed and passed to
+        add_batch() and finish_loading().
+        """
+        self.clear()
+        self.database_file = filename
+        self.database_info = dbcache.file_info(filename)
+        self.library = SQLiteLibrary(library_filename(filename, self.directory))
+        self.bib_database = self.new_database()
+        self.key_filter = LibraryKeyFilter(self.library)
+        if not self.library.is_current(self.database_info):
+            self.library.reset()
+            return False
+        self.sort_keys()
+        return True
+
+    def open_lazy(self, filename):
+        """ Libraries are read from SQLite on demand already; parse and import the file if needed. """
+        self.open(filename)
+
+    @instrument.traced('sqlite.add_batch')
+    def add_batch(self, chunk_database):
+        """ Import the entries of a parsed chunk. Returns the list of added keys. """
+        import loader
+        entries = loader.merge_into(self.bib_database, chunk_database)
+        instrument.count('load.entries', len(entries))
+        return [key for key, bib_entry in entries]
+
+    def add_entries(self, bib_database):
+        added = super(SQLiteSession, self).add_entries(bib_database)
+        if added:
+            self.library.set_modified()
+            self.library.commit()
+        return added
+
+    @instrument.traced('sqlite.finish_loading')
+    def finish_loading(self, source_file=None, write_cache=True):
+        """ Index the keys of the imported file and mark the library as up to date. """
+        self.source_file = source_file
+        self.library.finish_import(self.database_info, self.bib_database._preamble)
+        self.sort_keys()
+
+    def write_cache(self):
+        pass
+
+    def index_entry(self, key, bib_entry):
+        pass
+
+    def sort_keys(self):
+        self.entryID_list = self.library.keys()
+        self.key_filter.set_keys(self.entryID_list)
+
+    # -- Searching:
+    @instrument.traced('sqlite.search_content')
+    def search_content(self, queries):
+        """ As DatabaseSession.search_content(), as one full text query. """
+        positions = self.library.search(queries)
+        instrument.count('search.matches', len(positions))
+        self.key_filter.set_positions(positions)
+        return [self.entryID_list[num] for num in positions]
+
+    def search_page(self, queries, offset=0, limit=100):
+        """
+        One page of search_content() results without changing the scope:
+        returns the total number of matches and the sorted list of at most
+        `limit` keys starting at `offset`.
+        """
+        condition, params = self.library.content_condition(queries)
+        total = self.library.count(condition, params)
+        positions = self.library.select_ranks(condition, params, offset, limit)
+        return total, [self.entryID_list[num] for num in positions]
+
+    @instrument.traced('sqlite.query')
+    def query(self, text):
+        """ As DatabaseSession.query(). Raises query.QuerySyntaxError. """
+        positions = self.library.query(text)
+        instrument.count('search.matches', len(positions))
+        self.key_filter.set_positions(positions)
+        return [self.entryID_list[num] for num in positions]
+
+    @instrument.traced('sqlite.rank_content')
+    def rank_content(self, queries, k=200):
+        """ As DatabaseSession.rank_content(), scored by the BM25 of SQLite FTS5. """
+        ranked = self.library.rank(queries, k)
+        self.key_filter.set_positions([rank for key, rank, score in ranked], ordered=True)
+        return [(key, score) for key, rank, score in ranked]
+
+    # -- Display:
+    @instrument.traced('sqlite.render_entry')
+    def render_entry(self, entryID, field_names):
+        """ Return the display text of `field_names`, from the columns stored in the library. """
+        in_columns = [name.lower() for name in field_names if name.lower() in columns.column_fields]
+        names = [name for name in field_names if name.lower() not in columns.column_fields]
+        display = self.library.display(entryID, in_columns)
+        if names:
+            bib_entry = self.bib_database.entries[entryID]
+            digest = rendercache.entry_digest(bib_entry)
+            rendered = self.render_cache.get(entryID, digest)
+            if rendered is None or not all(name in rendered for name in names):
+                instrument.count('render.misses')
+                rendered = dict(zip(names, formatting.format_entry_view(bib_entry, names)))
+                self.render_cache.put(entryID, rendered, digest)
+            display.update(rendered)
+        return [display[name.lower()] if name.lower() in display else display[name]
+                for name in field_names]
+
+    def memory_report(self):
+        return self.library.report() if self.library is not None else u''
+
+    def report(self):
+        """ Text summary of the opened file and its library. """
+        if self.library is None:
+            return u''
+        return u"%s\n%s" % (self.database_file, self.library.report())
+
+    # -- Editing:
+    def reindex_entry(self, entryID):
+        self.bib_database.entries[entryID] = self.bib_database.entries[entryID]
+        self.render_cache.invalidate(entryID)
+
+    def remove_entries(self, keys):
+        """
+        Remove the entries of `keys` from the library. As for a
+        DatabaseSession, they are not removed from the file by save(), and
+        the library is imported again when the file is opened next.
+        """
+        removed = set(keys)
+        if not removed:
+            return
+        for key in removed:
+            self.bib_database.entries.live.pop(key.lower(), None)
+            self.render_cache.invalidate(key)
+        self.library.delete_entries(removed)
+        self.dirty_entries -= removed
+        self.edit_journal.forget(removed)
+        self.key_filter.remove_keys(removed)
+        self.entryID_list = self.key_filter.keys
+
+    # -- Reloading:
+    def watched_files(self):
+        """ A changed .bib file is imported again when it is opened next, it is not reloaded. """
+        return []
+
+    # -- Saving:
+    @instrument.traced('sqlite.save')
+    def save(self, filename):
+        """
+        Write the library to `filename`. If the original text of the opened
+        file is available, only the edited entries are re-formatted,
+        otherwise all rows are streamed to the file.
+        Raises IOError or OSError if the file cannot be written, or if it
+        was changed by another program and not reloaded yet.
+        """
+        self.check_unchanged(filename)
+        if self.source_file is not None:
+            writer.save_incremental(filename, self.source_file, self.bib_database,
+                                    self.dirty_entries)
+        else:
+            self.library.export(filename)
+
+        self.dirty_entries.clear()
+        info = dbcache.file_info(filename)
+        if info['path'] == self.library.get_meta('path'):
+            # The library holds the content of the saved file, no import is needed next time:
+            self.library.set_source(info)
+        self.database_file = filename
+        self.database_info = info
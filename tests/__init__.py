@@ -0,0 +1,9 @@
+import atexit
+import shutil
+import tempfile
+
+import dbcache
+
+# Keep the binary caches of the test files out of the user's cache directory:
+dbcache.cache_directory = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, dbcache.cache_directory, True)
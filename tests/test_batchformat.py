@@ -0,0 +1,79 @@
+# -*- coding: UTF-8 -*-
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import batchformat
+import loader
+
+text = u'''@article{fynbo,
+  author = {{Fynbo}, J.~P.~U.},
+  title = {Dust in quasar absorbers},
+  journal = {MNRAS},
+  year = 2011
+}
+
+@inproceedings{proceedings,
+  author = {{Krogager}, J.-K.},
+  title = {Quasar absorbers},
+  booktitle = {Proceedings of the IAU},
+  year = 2015
+}
+
+@inbook{chapter,
+  title = {A chapter without authors},
+  publisher = {Springer},
+  year = 2010
+}
+
+@article{noyear,
+  author = {{Ledoux}, C.},
+  title = {Molecular hydrogen},
+  journal = {A\\&A}
+}
+
+@misc{website,
+  title = {A website}
+}
+
+@phdthesis{thesis,
+  author = {{Heintz}, K. E.},
+  title = {Dusty absorbers},
+  school = {University of Copenhagen},
+  year = 2018
+}
+'''
+
+
+class FormatDatabaseTest(unittest.TestCase):
+
+    def test_mixed_entry_types(self):
+        references, unknown_types, errors = batchformat.format_database(loader.parse_job((u'', text)))
+        self.assertEqual([key for key, entry_type, ref in references],
+                         [u'fynbo', u'proceedings', u'website', u'thesis'])
+        self.assertEqual(references[1][2],
+                         u"Krogager, J.-K. (2015), Quasar absorbers. In Proceedings of the IAU")
+        self.assertEqual(unknown_types, [(u'website', u'misc')])
+        self.assertEqual([key for key, error in errors], [u'chapter', u'noyear'])
+        self.assertEqual(errors[1][1], u"missing field: year")
+
+    def test_format_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'library.bib')
+            with open(filename, 'wb') as bibtex_file:
+                bibtex_file.write(text.encode('utf-8'))
+            output = io.StringIO()
+            report = batchformat.format_file(filename, output, 'jsonl', processes=2)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(report.n_entries, 4)
+        self.assertEqual(len(output.getvalue().splitlines()), 4)
+        self.assertIn(u"could not be formatted: 2", report.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+import columns
+import loader
+
+text = u'''@article{moller,
+  author = {{M{\\o}ller}, P. and {Fynbo}, J.~P.~U.},
+  title = {{Metal} abundances of
+           damped absorbers},
+  journal = {\\mnras},
+  year = 2001
+}
+
+@article{ledoux,
+  author = {{Ledoux}, C.},
+  title = {Molecular hydrogen in damped absorbers},
+  journal = {A\\&A},
+  year = 2003
+}
+
+@misc{note,
+  title = {A note}
+}
+'''
+
+
+class FieldColumnsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bib_database = loader.parse_job((u'', text))
+        self.columns = columns.FieldColumns()
+        self.columns.build(self.bib_database)
+
+    def test_text(self):
+        self.assertEqual(len(self.columns), 3)
+        self.assertEqual(self.columns.display_text(u'moller', 'title'),
+                         u'Metal abundances of damped absorbers')
+        self.assertEqual(self.columns.search_text(u'moller', 'author'),
+                         u'moller, p.; fynbo, j. p. u.')
+        self.assertEqual(self.columns.display_text(u'moller', 'journal'), u'MNRAS')
+        self.assertEqual(self.columns.search_text(u'ledoux', 'journal'), u'a&a')
+        self.assertEqual(self.columns.display_text(u'note', 'author'), u'')
+        self.assertEqual(self.columns.search_text(u'note', 'year'), u'')
+        self.assertEqual(self.columns.journal_key[self.columns.row[u'moller']], u'mnras')
+        self.assertEqual(self.columns.journal_key[self.columns.row[u'note']], u'')
+        # Equal display and search text is stored once:
+        self.assertIs(self.columns.display_text(u'ledoux', 'year'),
+                      self.columns.search_text(u'ledoux', 'year'))
+
+    def test_update_in_place(self):
+        row = self.columns.row[u'ledoux']
+        bib_entry = self.bib_database.entries[u'ledoux']
+        bib_entry.fields['title'] = u'{\\AA}str{\\"o}m {DLAs}'
+        self.columns.update_entry(u'ledoux', bib_entry)
+        self.assertEqual(self.columns.row[u'ledoux'], row)
+        self.assertTrue(self.columns.display_text(u'ledoux', 'title').endswith(u'm DLAs'))
+        self.assertEqual(self.columns.search_texts(u'ledoux')['title'], u'astrom dlas')
+
+    def test_remove_reuses_row(self):
+        row = self.columns.row[u'moller']
+        self.columns.remove_entry(u'moller')
+        self.columns.remove_entry(u'moller')
+        self.assertNotIn(u'moller', self.columns)
+        self.assertEqual(self.columns.display[u'title'][row], u'')
+        self.columns.add_entry(u'other', self.bib_database.entries[u'moller'])
+        self.assertEqual(self.columns.row[u'other'], row)
+        self.assertEqual(len(self.columns.journal_key), 3)
+
+    def test_state(self):
+        other = columns.FieldColumns()
+        other.set_state(self.columns.subset_state([u'note', u'ledoux']))
+        self.assertEqual(len(other), 2)
+        self.assertEqual(other.row[u'note'], 0)
+        for field in columns.column_fields:
+            self.assertEqual(other.search_text(u'ledoux', field),
+                             self.columns.search_text(u'ledoux', field))
+        usage = self.columns.memory_usage()
+        self.assertIn('title.search', usage)
+        self.assertIn('Columns of 3 entries', self.columns.memory_report())
+
+
+if __name__ == '__main__':
+    unittest.main()
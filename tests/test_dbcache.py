@@ -0,0 +1,86 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import shutil
+import pickle
+import tempfile
+import unittest
+
+import dbcache
+import formatting
+import session
+
+text = u'''@article{fynbo,
+  author = {{Fynbo}, J.~P.~U.},
+  title = {Dust in quasar absorbers},
+  year = 2011
+}
+'''
+
+calls = list()
+
+
+def record_call():
+    calls.append(True)
+    return {}
+
+
+class Payload(object):
+    """ Runs record_call() when unpickled. """
+
+    def __reduce__(self):
+        return (record_call, ())
+
+
+class CacheLocationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'library.bib')
+        with open(self.filename, 'wb') as bibtex_file:
+            bibtex_file.write(text.encode('utf-8'))
+        del calls[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cache_is_not_next_to_file(self):
+        bib = session.DatabaseSession()
+        bib.open(self.filename)
+        cache_file = dbcache.cache_filename(self.filename)
+        self.assertTrue(os.path.exists(cache_file))
+        self.assertEqual(os.path.dirname(cache_file), dbcache.cache_directory)
+        self.assertEqual(os.listdir(self.directory), ['library.bib'])
+        self.assertIsNotNone(dbcache.load_cache(self.filename))
+
+    def test_sidecar_file_is_not_loaded(self):
+        sidecar = os.path.join(self.directory, '.library.bib.pybibcache')
+        with open(sidecar, 'wb') as output:
+            pickle.dump(Payload(), output, pickle.HIGHEST_PROTOCOL)
+        bib = session.DatabaseSession()
+        bib.open(self.filename)
+        self.assertEqual(calls, [])
+        self.assertEqual(bib.entryID_list, [u'fynbo'])
+
+    def test_files_with_same_name(self):
+        other_directory = os.path.join(self.directory, 'other')
+        os.mkdir(other_directory)
+        other = os.path.join(other_directory, 'library.bib')
+        shutil.copy(self.filename, other)
+        self.assertNotEqual(dbcache.cache_filename(self.filename), dbcache.cache_filename(other))
+        session.DatabaseSession().open(self.filename)
+        # A cache of the same content at another path is not used:
+        self.assertIsNone(dbcache.load_cache(other))
+
+    def test_other_authors_are_not_cached(self):
+        for i in range(1000):
+            formatting.format_author(u'{Author %i}, A.' % i)
+        session.DatabaseSession().open(self.filename)
+        with open(dbcache.cache_filename(self.filename), 'rb') as cache:
+            content = cache.read()
+        self.assertNotIn(b'Author 999', content)
+        self.assertEqual(session.DatabaseSession().open_cached(self.filename), True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+from pybtex.database import Entry
+
+import duplicates
+
+
+def make_entry(**fields):
+    return Entry('article', fields=fields)
+
+
+class IdentifierTest(unittest.TestCase):
+
+    def test_normalize(self):
+        self.assertEqual(duplicates.normalize_doi(u' https://doi.org/10.1093/MNRAS/stv1146'),
+                         u'10.1093/mnras/stv1146')
+        self.assertEqual(duplicates.normalize_doi(u'doi:10.1051/0004-6361'), u'10.1051/0004-6361')
+        self.assertEqual(duplicates.normalize_eprint(u'arXiv:1505.01234v2'), u'1505.01234')
+
+    def test_entry_identifiers(self):
+        bib_entry = make_entry(doi=u'10.1093/mnras/stv1146', eprint=u'1505.01234',
+                               adsurl=u'https://ui.adsabs.harvard.edu/abs/2015MNRAS.451.3286A/abstract')
+        self.assertEqual(duplicates.entry_identifiers(bib_entry),
+                         [('doi', u'10.1093/mnras/stv1146'), ('eprint', u'1505.01234'),
+                          ('bibcode', u'2015MNRAS.451.3286A')])
+        self.assertEqual(duplicates.entry_identifiers(make_entry(doi=u'  ')), [])
+
+
+class DuplicateIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = duplicates.DuplicateIndex()
+        self.index.add_entry(u'fynbo', make_entry(doi=u'10.1093/mnras/stv1146'))
+        self.index.add_entry(u'ledoux', make_entry(eprint=u'astro-ph/0302582'))
+
+    def test_find(self):
+        self.assertEqual(self.index.find(make_entry(doi=u'https://doi.org/10.1093/MNRAS/STV1146')),
+                         u'fynbo')
+        self.assertEqual(self.index.find(make_entry(eprint=u'arXiv:astro-ph/0302582v1')), u'ledoux')
+        self.assertIsNone(self.index.find(make_entry(doi=u'10.1000/other')))
+
+    def test_update_and_remove(self):
+        self.index.update_entry(u'fynbo', make_entry(doi=u'10.1000/new'))
+        self.assertIsNone(self.index.find(make_entry(doi=u'10.1093/mnras/stv1146')))
+        self.assertEqual(self.index.find(make_entry(doi=u'10.1000/new')), u'fynbo')
+        self.index.remove_entry(u'fynbo')
+        self.assertIsNone(self.index.find(make_entry(doi=u'10.1000/new')))
+
+    def test_first_entry_is_kept(self):
+        self.index.add_entry(u'copy', make_entry(doi=u'10.1093/mnras/stv1146'))
+        self.index.remove_entry(u'copy')
+        self.assertEqual(self.index.find(make_entry(doi=u'10.1093/mnras/stv1146')), u'fynbo')
+
+
+if __name__ == '__main__':
+    unittest.main()
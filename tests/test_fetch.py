@@ -0,0 +1,128 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+import SocketServer
+from StringIO import StringIO
+
+import fetch
+
+doi_entry = u'''@article{Fynbo_2011,
+  author = {Fynbo, J. P. U.},
+  title = {Dust in quasar absorbers},
+  doi = {10.1093/mnras/stv1146},
+  year = 2011
+}'''
+
+ads_entry = u'''@ARTICLE{2015MNRAS.451.3286A,
+  author = {{Krogager}, J.-K.},
+  title = "{Dusty quasar hosts}",
+  year = 2015
+}'''
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Crossref and ADS stand-in, with keep-alive connections as the real servers. """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path == '/works/10.1093/mnras/stv1146':
+            self.reply(200, doi_entry.encode('utf-8'))
+        else:
+            self.reply(404, b'Resource not found.')
+
+    def do_POST(self):
+        self.server.requests.append(self.path)
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        bibcodes = json.loads(body)['bibcode']
+        export = ads_entry if u'2015MNRAS.451.3286A' in bibcodes else u''
+        self.reply(200, json.dumps({'export': export}))
+
+    def reply(self, status, data):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.requests = list()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.directory = tempfile.mkdtemp()
+        self.cache = fetch.ResponseCache(os.path.join(self.directory, 'cache'))
+        self.fetcher = self.make_fetcher(self.cache)
+
+    def make_fetcher(self, cache):
+        base_url = 'http://127.0.0.1:%i' % self.server.server_address[1]
+        return fetch.MetadataFetcher(workers=2, cache=cache, doi_url=base_url + '/works/%s',
+                                     ads_url=base_url + '/export', ads_token='token')
+
+    def tearDown(self):
+        self.fetcher.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_fetch(self):
+        result = self.fetcher.fetch([u'https://doi.org/10.1093/mnras/stv1146',
+                                     u'2015MNRAS.451.3286A', u'10.1000/missing', u'nonsense'])
+        self.assertEqual(sorted(result.bib_database.entries.keys()),
+                         [u'2015MNRAS.451.3286A', u'Fynbo_2011'])
+        self.assertEqual(sorted(result.failed), [u'10.1000/missing', u'nonsense'])
+        self.assertEqual(result.failed[u'10.1000/missing'], u'HTTP 404')
+
+    def test_connections_are_reused(self):
+        dois = [u'10.1093/mnras/stv1146'] + [u'10.1000/missing%i' % num for num in range(10)]
+        fetcher = self.make_fetcher(None)
+        try:
+            fetcher.workers = 1
+            fetcher.fetch(dois)
+            self.assertEqual(len(self.server.requests), 11)
+            self.assertEqual(fetcher.pool.created, 1)
+        finally:
+            fetcher.pool.close()
+
+    def test_cached_responses(self):
+        identifiers = [u'10.1093/mnras/stv1146', u'2015MNRAS.451.3286A']
+        self.fetcher.fetch(identifiers)
+        self.assertEqual(len(self.server.requests), 2)
+        result = self.fetcher.fetch(identifiers)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len(result.bib_database.entries), 2)
+
+    def test_cache_write_error(self):
+        # The cache directory cannot be created where a file is in the way:
+        with open(self.cache.directory, 'w') as blocking_file:
+            blocking_file.write('not a directory')
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            result = self.fetcher.fetch([u'10.1093/mnras/stv1146', u'2015MNRAS.451.3286A'])
+            messages = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(result.failed, {})
+        self.assertIn('Could not cache doi:10.1093/mnras/stv1146', messages)
+        self.assertEqual(len(result.bib_database.entries), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
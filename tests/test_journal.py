@@ -0,0 +1,64 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import session
+
+text = u'''@article{fynbo,
+  author = {{Fynbo}, J.~P.~U.},
+  title = {Dust in quasar absorbers},
+  year = 2011
+}
+
+@article{ledoux,
+  author = {{Ledoux}, C.},
+  title = {Molecular hydrogen in damped absorbers},
+  year = 2003
+}
+'''
+
+
+class UndoAddedFieldTest(unittest.TestCase):
+    compact = False
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        filename = os.path.join(self.directory, 'library.bib')
+        with open(filename, 'wb') as bibtex_file:
+            bibtex_file.write(text.encode('utf-8'))
+        self.session = session.DatabaseSession(self.compact)
+        self.session.open(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_add_field_undo_redo(self):
+        fields = ['Author', 'Title', 'Keywords', 'Year']
+        self.assertTrue(self.session.update_entry('fynbo', {'keywords': u'galaxies: dust'}))
+        self.assertEqual(self.session.search_content({'keyword': u'dust'}), [u'fynbo'])
+
+        self.assertEqual(self.session.undo(), [u'fynbo'])
+        self.assertNotIn('keywords', self.session.bib_database.entries['fynbo'].fields)
+        self.assertEqual(self.session.search_content({'keyword': u'dust'}), [])
+        self.assertEqual(self.session.render_entry('fynbo', fields)[2], u'')
+
+        self.assertEqual(self.session.redo(), [u'fynbo'])
+        self.assertEqual(self.session.search_content({'keyword': u'dust'}), [u'fynbo'])
+        self.assertEqual(self.session.render_entry('fynbo', fields)[2], u'galaxies: dust')
+
+    def test_add_person_role_undo(self):
+        self.session.update_entry('ledoux', {'editor': u'Smith, J.'})
+        self.session.undo()
+        self.assertNotIn('editor', self.session.bib_database.entries['ledoux'].persons)
+        self.assertEqual(self.session.search_content({'title': u'hydrogen'}), [u'ledoux'])
+
+
+class CompactUndoAddedFieldTest(UndoAddedFieldTest):
+    compact = True
+
+
+if __name__ == '__main__':
+    unittest.main()
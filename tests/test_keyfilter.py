@@ -0,0 +1,71 @@
+# -*- coding: UTF-8 -*-
+
+import random
+import unittest
+
+import keyfilter
+
+keys = [u'fynbo2011', u'fynbo2013', u'heintz2018', u'krogager2015', u'ledoux2003']
+
+
+def apply_changes(old, new, changes):
+    """ Apply the changes as EntryListModel.set_rows() does. """
+    rows = list(old)
+    removed, inserted = changes
+    for first, last in reversed(removed):
+        del rows[first:last + 1]
+    for first, last in inserted:
+        rows[first:first] = new[first:last + 1]
+    return rows
+
+
+class KeyFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.key_filter = keyfilter.KeyFilter(keys)
+
+    def matches(self, text):
+        return [keys[num] for num in self.key_filter.filter(text)]
+
+    def test_filter(self):
+        self.assertEqual(self.matches(u'FYN'), [u'fynbo2011', u'fynbo2013'])
+        self.assertEqual(self.matches(u'fynbo201'), [u'fynbo2011', u'fynbo2013'])
+        self.assertEqual(self.matches(u'fynbo2013'), [u'fynbo2013'])
+        self.assertEqual(self.matches(u'20'), keys)
+        self.assertEqual(self.matches(u''), keys)
+
+    def test_scope(self):
+        self.key_filter.set_scope([u'ledoux2003', u'fynbo2011'], ordered=True)
+        self.assertEqual(self.matches(u'0'), [u'ledoux2003', u'fynbo2011'])
+        self.key_filter.set_scope([u'ledoux2003', u'fynbo2011'])
+        self.assertEqual(self.matches(u'0'), [u'fynbo2011', u'ledoux2003'])
+
+
+class RowChangesTest(unittest.TestCase):
+
+    def test_runs(self):
+        self.assertEqual(keyfilter.runs([0, 1, 2, 5, 7, 8]), [(0, 2), (5, 5), (7, 8)])
+
+    def test_narrowing(self):
+        old = range(10)
+        new = [1, 2, 6]
+        changes = keyfilter.row_changes(old, new)
+        self.assertEqual(changes, ([(0, 0), (3, 5), (7, 9)], []))
+        self.assertEqual(apply_changes(old, new, changes), new)
+
+    def test_random_changes(self):
+        rng = random.Random(1)
+        for _ in range(200):
+            old = sorted(rng.sample(range(30), rng.randint(0, 30)))
+            new = sorted(rng.sample(range(30), rng.randint(0, 30)))
+            changes = keyfilter.row_changes(old, new)
+            self.assertIsNotNone(changes)
+            self.assertEqual(apply_changes(old, new, changes), new)
+
+    def test_full_update(self):
+        self.assertIsNone(keyfilter.row_changes([0, 1, 2], [2, 0]))
+        self.assertIsNone(keyfilter.row_changes(range(0, 400, 2), range(0, 400, 3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
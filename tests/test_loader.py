@@ -0,0 +1,83 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import lazyload
+import loader
+import session
+import watcher
+import writer
+
+# An entry without fields in the middle of a file:
+text = u'''@article{first,
+  title = {First},
+  year = 2001
+}
+
+@misc{empty}
+
+@article{last,
+  title = {Last},
+  year = 2003
+}
+'''
+
+
+class ScanEntriesTest(unittest.TestCase):
+
+    def test_entry_without_fields(self):
+        keys = [key for entry_type, key, start, end in loader.scan_entries(text)]
+        self.assertEqual(keys, [u'first', u'empty', u'last'])
+
+    def test_entry_without_fields_in_parentheses(self):
+        keys = [key for entry_type, key, start, end in loader.scan_entries(u'@misc(empty)\n@misc{b, year=1}')]
+        self.assertEqual(keys, [u'empty', u'b'])
+
+    def test_incremental_save_replaces_entry(self):
+        source = writer.SourceFile(text)
+        bib_database = loader.parse_job((u'', text))
+        bib_database.entries['empty'].fields['year'] = u'2002'
+        new_text = source.splice(bib_database, set([u'empty']))
+        self.assertEqual(new_text.count(u'{empty'), 1)
+        self.assertIn(u'2002', new_text)
+        self.assertTrue(new_text.startswith(text[:text.index(u'@misc')]))
+
+    def test_lazy_database_keys(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'library.bib')
+            with open(filename, 'wb') as bibtex_file:
+                bibtex_file.write(text.encode('utf-8'))
+            lazy_database = lazyload.LazyDatabase(filename)
+            self.assertEqual(lazy_database.entries.keys(), [u'first', u'empty', u'last'])
+            self.assertEqual(lazy_database.entries['last'].fields['year'], u'2003')
+            lazy_database.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_clear_closes_lazy_database(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'library.bib')
+            with open(filename, 'wb') as bibtex_file:
+                bibtex_file.write(text.encode('utf-8'))
+            bib = session.DatabaseSession()
+            bib.open_lazy(filename)
+            lazy_database = bib.lazy_database
+            bib.clear()
+            self.assertIsNone(bib.lazy_database)
+            # The file is no longer mapped:
+            self.assertRaises(ValueError, lazy_database.data.__getitem__, 0)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_changes_next_to_entry_without_fields(self):
+        changes = watcher.diff_entries(text, text.replace(u'{Last}', u'{Changed}'))
+        self.assertEqual((changes.added, changes.removed, changes.changed), (set(), set(), set([u'last'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import session
+
+text = u''.join(u'''@article{entry%i,
+  author = {{Fynbo}, J.~P.~U.},
+  title = {Paper number %i},
+  journal = {\\mnras},
+  adsurl = {https://ui.adsabs.harvard.edu/abs/%i},
+  doi = {10.1000/%i},
+  year = 2011
+}
+
+''' % (i, i, i, i) for i in range(10))
+
+field_names = ['author', 'title', 'journal', 'doi', 'adsurl']
+
+
+class PrerenderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'library.bib')
+        with open(self.filename, 'wb') as bibtex_file:
+            bibtex_file.write(text.encode('utf-8'))
+        self.session = self.open_session()
+
+    def open_session(self):
+        bib = session.DatabaseSession()
+        bib.open(self.filename)
+        return bib
+
+    def tearDown(self):
+        self.session.clear()
+        shutil.rmtree(self.directory)
+
+    def test_prerendered_entries_are_cached(self):
+        render_cache = self.session.render_cache
+        neighbours = [u'entry3', u'entry4', u'entry5']
+        self.session.prerender(neighbours, field_names)
+        for key in neighbours:
+            self.assertIn(key, render_cache)
+        self.assertNotIn(u'entry6', render_cache)
+
+        misses = render_cache.misses
+        view = self.session.render_entry(u'entry4', field_names)
+        self.assertEqual(render_cache.misses, misses)
+        self.assertEqual(view[1], u'Paper number 4')
+        self.assertEqual(view[3], u'10.1000/4')
+
+    def test_edited_entry_is_rendered_again(self):
+        self.session.prerender([u'entry4'], field_names)
+        self.session.update_entry(u'entry4', {'doi': u'10.1000/changed'})
+        self.assertEqual(self.session.render_entry(u'entry4', field_names)[3], u'10.1000/changed')
+
+    def test_columns_only(self):
+        self.session.prerender([u'entry1'], ['author', 'title'])
+        self.assertNotIn(u'entry1', self.session.render_cache)
+
+
+class LazyPrerenderTest(PrerenderTest):
+
+    def open_session(self):
+        bib = session.DatabaseSession()
+        bib.open_lazy(self.filename)
+        return bib
+
+    def test_prerender_parses_entries(self):
+        self.session.prerender([u'entry8', u'entry9'], field_names)
+        self.assertNotIn(u'entry8', self.session.unindexed)
+        self.assertNotIn(u'entry9', self.session.unindexed)
+        self.assertIn(u'entry0', self.session.unindexed)
+        self.assertEqual(self.session.columns.display_text(u'entry9', 'title'), u'Paper number 9')
+
+
+if __name__ == '__main__':
+    unittest.main()
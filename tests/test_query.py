@@ -0,0 +1,194 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import loader
+import query
+import searchindex
+import session
+import sqlstore
+
+text = u'''@string{mnras = {Monthly Notices of the RAS}}
+
+@article{fynbo,
+  author = {{Fynbo}, J.~P.~U. and {Krogager}, J.-K.},
+  title = {Dust in quasar absorbers},
+  journal = mnras,
+  keywords = {quasars: absorption lines},
+  year = 2011
+}
+
+@article{krogager,
+  author = {{Krogager}, J.-K.},
+  title = {Dusty quasar hosts and damped absorbers},
+  journal = {MNRAS},
+  year = 2015
+}
+
+@article{ledoux,
+  author = {{Ledoux}, C.},
+  title = {Molecular hydrogen in damped absorbers},
+  journal = {A\\&A},
+  year = 2003
+}
+'''
+
+queries = [
+    (u'author:fynbo', [u'fynbo']),
+    (u'krogager', [u'fynbo', u'krogager']),
+    (u'author:krogager year:2012..', [u'krogager']),
+    (u'year:..2011 -author:fynbo', [u'ledoux']),
+    (u'year:2003..2011', [u'fynbo', u'ledoux']),
+    (u'journal:mnras', [u'krogager']),
+    (u'journal:"monthly notices"', [u'fynbo']),
+    (u'journal:"A&A"', [u'ledoux']),
+    (u'title:"damped absorbers"', [u'krogager', u'ledoux']),
+    (u'title:"absorbers damped"', []),
+    (u'title:absorbers -keyword:quasars', [u'krogager', u'ledoux']),
+    (u'Title:Hydrogen', [u'ledoux']),
+]
+
+
+class ParseTermsTest(unittest.TestCase):
+
+    def test_terms(self):
+        self.assertEqual(query.parse_terms(u' -keyword:"dust grains"  year:2010.. quasar '),
+                         [(True, 'keywords', u'dust grains', True),
+                          (False, 'year', u'2010..', False),
+                          (False, None, u'quasar', False)])
+
+    def test_errors(self):
+        self.assertRaises(query.QuerySyntaxError, query.parse_terms, u'colour:red')
+
+
+class PredicateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bib_database = loader.parse_job((u'', text))
+        self.content_index = searchindex.ContentIndex()
+        self.content_index.build(self.bib_database)
+        self.engine = query.QueryEngine(self.content_index)
+        self.engine.build(self.bib_database)
+
+    def year_range(self, value):
+        predicate = query.YearPredicate(self.engine, value)
+        return predicate.first, predicate.last
+
+    def test_year_predicate(self):
+        self.assertEqual(self.year_range(u'2011'), (2011, 2011))
+        self.assertEqual(self.year_range(u'2003..'), (2003, None))
+        self.assertEqual(self.year_range(u'..2011'), (None, 2011))
+        self.assertEqual(self.year_range(u'2003..2011'), (2003, 2011))
+        for value in (u'..', u'recent', u'2011-2015'):
+            self.assertRaises(query.QuerySyntaxError, query.YearPredicate, self.engine, value)
+
+        predicate = query.YearPredicate(self.engine, u'2004..2015')
+        self.assertEqual(predicate.estimate(), 2)
+        self.assertEqual(predicate.evaluate(), set([u'fynbo', u'krogager']))
+
+    def test_year_index(self):
+        year_index = self.engine.year_index
+        self.assertEqual(year_index.lookup(None, None), set([u'fynbo', u'krogager', u'ledoux']))
+        self.assertEqual(year_index.count(2012, 2014), 0)
+        self.engine.remove_entry(u'krogager')
+        self.assertEqual(year_index.lookup(2011, None), set([u'fynbo']))
+        self.engine.add_entry(u'krogager', self.bib_database.entries[u'krogager'])
+        self.assertEqual(year_index.lookup(2011, None), set([u'fynbo', u'krogager']))
+
+    def test_journal_predicate(self):
+        # The macro and the journal name are looked up exactly:
+        self.assertEqual(self.engine.journal_index.lookup(u'A&A'), set([u'ledoux']))
+        predicate = query.JournalPredicate(self.engine, u'mnras')
+        self.assertEqual(predicate.estimate(), 1)
+        self.assertEqual(predicate.evaluate(), set([u'krogager']))
+        # Other names fall back to the words of the journal field:
+        predicate = query.JournalPredicate(self.engine, u'monthly notices')
+        self.assertEqual(predicate.evaluate(), set([u'fynbo']))
+
+        self.engine.remove_entry(u'ledoux')
+        self.assertEqual(self.engine.journal_index.lookup(u'A&A'), set())
+        self.assertNotIn(u'ledoux', self.engine.journal_index.journals)
+
+    def test_word_predicate(self):
+        predicate = query.WordPredicate(self.engine, None, u'quasar krogager')
+        self.assertEqual(predicate.words, [u'krogager', u'quasar'])
+        self.assertEqual(predicate.evaluate(), set([u'fynbo', u'krogager']))
+        predicate = query.WordPredicate(self.engine, 'title', u'damped')
+        self.assertEqual(predicate.estimate(), 2)
+        self.assertEqual(query.WordPredicate(self.engine, 'title', u'!!').evaluate(),
+                         set([u'fynbo', u'krogager', u'ledoux']))
+
+    def test_plan(self):
+        plan = self.engine.compile(u'-title:hydrogen year:2003.. absorbers')
+        self.assertEqual([type(predicate) for predicate in plan.required],
+                         [query.YearPredicate, query.WordPredicate])
+        self.assertEqual(len(plan.excluded), 1)
+        self.assertEqual(plan.execute(), set([u'fynbo', u'krogager']))
+        self.assertEqual(self.engine.compile(u'-author:fynbo').execute(),
+                         set([u'krogager', u'ledoux']))
+        self.assertEqual(self.engine.compile(u'').execute(),
+                         set([u'fynbo', u'krogager', u'ledoux']))
+
+    def test_cache(self):
+        self.assertEqual(self.engine.search(u'year:2003'), set([u'ledoux']))
+        self.engine.search(u'year:2003').add(u'fynbo')
+        self.assertEqual(self.engine.search(u'year:2003'), set([u'ledoux']))
+        bib_entry = self.bib_database.entries[u'fynbo']
+        bib_entry.fields['year'] = u'2003'
+        self.engine.update_entry(u'fynbo', bib_entry)
+        self.assertEqual(self.engine.search(u' year:2003 '), set([u'fynbo', u'ledoux']))
+
+
+class QueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'library.bib')
+        with open(self.filename, 'wb') as bibtex_file:
+            bibtex_file.write(text.encode('utf-8'))
+        self.session = self.open_session()
+
+    def open_session(self):
+        bib = session.DatabaseSession()
+        bib.open(self.filename)
+        return bib
+
+    def tearDown(self):
+        self.session.clear()
+        shutil.rmtree(self.directory)
+
+    def test_queries(self):
+        for text, expected in queries:
+            self.assertEqual(sorted(self.session.query(text)), expected, text)
+
+    def test_syntax_error(self):
+        self.assertRaises(query.QuerySyntaxError, self.session.query, u'colour:red')
+        self.assertRaises(query.QuerySyntaxError, self.session.query, u'year:recent')
+
+
+class SQLiteQueryTest(QueryTest):
+
+    def open_session(self):
+        bib = sqlstore.SQLiteSession(os.path.join(self.directory, 'libraries'))
+        bib.open(self.filename)
+        return bib
+
+    def test_unsupported_sqlite(self):
+        self.assertTrue(sqlstore.is_supported())
+        schema = sqlstore.schema
+        sqlstore.schema = schema.replace("tokenize='trigram'", "tokenize='missing'")
+        try:
+            bib = sqlstore.SQLiteSession(os.path.join(self.directory, 'other'))
+            self.assertRaises(sqlite3.OperationalError, bib.open_cached, self.filename)
+            self.assertIsNone(bib.library)
+            bib.clear()
+        finally:
+            sqlstore.schema = schema
+
+
+if __name__ == '__main__':
+    unittest.main()
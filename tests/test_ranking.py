@@ -0,0 +1,69 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+import loader
+import ranking
+import searchindex
+
+text = u'''@article{fynbo,
+  author = {{Fynbo}, J.~P.~U. and {Krogager}, J.-K.},
+  title = {Dust in quasar absorbers},
+  journal = {\\mnras},
+  year = 2011
+}
+
+@article{krogager,
+  author = {{Krogager}, J.-K.},
+  title = {Dusty quasar hosts and damped absorbers in a survey},
+  journal = {\\mnras},
+  year = 2015
+}
+
+@article{ledoux,
+  author = {{Ledoux}, C.},
+  title = {Molecular hydrogen in damped absorbers},
+  journal = {\\aap},
+  year = 2003
+}
+'''
+
+
+class RankedSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bib_database = loader.parse_job((u'', text))
+        self.index = searchindex.ContentIndex()
+        self.index.build(self.bib_database)
+        self.ranked_search = ranking.RankedSearch(self.index)
+
+    def keys(self, queries):
+        return [key for key, score in self.ranked_search.search(queries)]
+
+    def test_unmatched_ranked_field_with_filter(self):
+        queries = {'author': u'qqqqqqq', 'journal': u'mnras'}
+        self.assertEqual(self.keys(queries), [])
+        self.assertEqual(self.index.search(queries), set())
+
+    def test_filter_only(self):
+        self.assertEqual(sorted(self.keys({'journal': u'mnras'})), [u'fynbo', u'krogager'])
+
+    def test_ranked_field_with_filter(self):
+        self.assertEqual(self.keys({'title': u'damped', 'journal': u'mnras'}), [u'krogager'])
+
+    def test_shorter_title_ranks_higher(self):
+        self.assertEqual(self.keys({'title': u'absorbers'})[0], u'fynbo')
+
+    def test_entry_lengths_follow_updates(self):
+        bib_entry = self.bib_database.entries['ledoux']
+        bib_entry.fields['title'] = u'Hydrogen'
+        self.index.update_entry('ledoux', bib_entry)
+        self.assertEqual(self.index.entry_lengths['ledoux']['title'], 1)
+        self.index.remove_entry('fynbo')
+        self.assertNotIn('fynbo', self.index.entry_lengths)
+        self.assertEqual(self.index.field_lengths['title'],
+                         sum(lengths['title'] for lengths in self.index.entry_lengths.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import refparse
+import session
+
+text = u'''@article{fynbo,
+  author = {{Fynbo}, J.~P.~U. and {M{\\o}ller}, P.},
+  title = {Dust in quasar absorbers},
+  journal = {\\mnras},
+  volume = 413,
+  pages = {2481--2490},
+  year = 2011
+}
+
+@article{moller,
+  author = {{M{\\o}ller}, P.},
+  title = {A preprint},
+  journal = {ArXiv e-prints},
+  eprint = {1602.01234},
+  year = 2016
+}
+'''
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_parse_reference(self):
+        bib_entry = refparse.parse_reference(u'[12] Krogager, J.-K., Fynbo, J. P. U., et al. 2015, ApJS, 217, 5')
+        self.assertEqual([unicode(person) for person in bib_entry.persons['author']],
+                         [u'Krogager, J.-K.', u'Fynbo, J. P. U.', u'others'])
+        self.assertEqual(dict(bib_entry.fields), {'year': u'2015', 'journal': u'\\apjs',
+                                                  'volume': u'217', 'pages': u'5'})
+        self.assertRaises(refparse.ReferenceSyntaxError, refparse.parse_reference, u'Smith, J., ApJ')
+
+    def test_signature(self):
+        published = refparse.parse_reference(u'Fynbo J. P. U., et al., 2011, MNRAS, 413, 2481')
+        self.assertEqual(refparse.entry_signature(published),
+                         (u'fynbo', u'2011', u'mnras', u'413', u'2481'))
+        preprint = refparse.parse_reference(u'Smith, J. et al. 2016, arXiv:1602.01234')
+        self.assertEqual(refparse.entry_signature(preprint), (u'smith', u'2016', u'arxiv', u'1602.01234'))
+        # Without volume and pages a reference cannot be compared:
+        self.assertIsNone(refparse.entry_signature(refparse.parse_reference(u'Smith, J. 2016, Nature')))
+
+
+class DuplicateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        filename = os.path.join(self.directory, 'library.bib')
+        with open(filename, 'wb') as bibtex_file:
+            bibtex_file.write(text.encode('utf-8'))
+        self.session = session.DatabaseSession()
+        self.session.open(filename)
+
+    def tearDown(self):
+        self.session.clear()
+        shutil.rmtree(self.directory)
+
+    def test_existing_entries(self):
+        index = refparse.ReferenceIndex(self.session)
+        for line in (u'Fynbo, J. P. U.; Moller, P. 2011, MNRAS, 413, 2481-2490',
+                     u'1. J. P. U. Fynbo et al. (2011) MNRAS 413, 2481',
+                     u'Fynbo J. P. U., et al., 2011, MNRAS, 413, 2481'):
+            self.assertEqual(index.find(refparse.parse_reference(line)), u'fynbo', line)
+        for line in (u'Moller, P. 2016, arXiv:1602.01234', u'Moller, P. 2016, arXiv:1602.01234v2'):
+            self.assertEqual(index.find(refparse.parse_reference(line)), u'moller', line)
+        for line in (u'Fynbo J. P. U. 2011, MNRAS, 413, 2482',
+                     u'Fynbo J. P. U. 2012, MNRAS, 413, 2481',
+                     u'Moller P. 2011, MNRAS, 413, 2481'):
+            self.assertIsNone(index.find(refparse.parse_reference(line)), line)
+
+    def test_import(self):
+        lines = [u'Fynbo J. P. U., et al., 2011, MNRAS, 413, 2481',
+                 u'Fynbo J. P. U., et al., 2011, A&A, 526, 142',
+                 u'',
+                 u'[3] Fynbo, J. P. U. 2011, A&A, 526, 142',
+                 u'Fynbo J. P. U. 2011, ApJ, 700, 1',
+                 u'no year here']
+        report = refparse.import_references(self.session, lines, batch_size=1)
+        self.assertEqual(report.added, [u'Fynbo2011', u'Fynbo2011a'])
+        self.assertEqual(report.duplicates, [(lines[0], u'fynbo'), (lines[3], u'Fynbo2011')])
+        self.assertEqual([number for number, line, error in report.errors], [6])
+        self.assertEqual(self.session.bib_database.entries[u'Fynbo2011a'].fields['journal'], u'\\apj')
+        self.assertEqual(report.summary(), u'2 added, 2 already in the database, 1 not understood')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import session
+import sqlstore
+
+text = u'''@article{fynbo,
+  author = {{Fynbo}, J.~P.~U.},
+  title = {Dust in quasar absorbers},
+  year = 2011
+}
+
+@article{krogager,
+  author = {{Krogager}, J.-K.},
+  title = {Dusty quasar hosts},
+  year = 2015
+}
+
+@article{ledoux,
+  author = {{Ledoux}, C.},
+  title = {Molecular hydrogen in damped absorbers},
+  year = 2003
+}
+'''
+
+
+class RemoveEntriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'library.bib')
+        with open(self.filename, 'wb') as bibtex_file:
+            bibtex_file.write(text.encode('utf-8'))
+        self.session = self.open_session()
+
+    def open_session(self):
+        bib = session.DatabaseSession()
+        bib.open(self.filename)
+        return bib
+
+    def tearDown(self):
+        self.session.clear()
+        shutil.rmtree(self.directory)
+
+    def test_remove_entries(self):
+        self.session.update_entry('fynbo', {'title': u'Dust in absorbers'})
+        self.session.remove_entries([u'fynbo'])
+        self.assertEqual(self.session.entryID_list, [u'krogager', u'ledoux'])
+        self.assertEqual(sorted(self.session.bib_database.entries.keys()), [u'krogager', u'ledoux'])
+        self.assertNotIn('fynbo', self.session.bib_database.entries)
+        self.assertEqual(self.session.filter_keys(u'fyn'), [])
+        self.assertEqual([self.session.entryID_list[num] for num in self.session.filter_keys(u'led')], [u'ledoux'])
+        self.assertEqual(self.session.search_content({'title': u'dust'}), [u'krogager'])
+        self.assertEqual(self.session.undo(), [])
+
+    def test_add_after_remove(self):
+        self.session.remove_entries([u'ledoux'])
+        self.session.update_entry('krogager', {'title': u'Dusty hydrogen'})
+        self.assertEqual(self.session.search_content({'title': u'hydrogen'}), [u'krogager'])
+
+
+class CompactRemoveEntriesTest(RemoveEntriesTest):
+
+    def open_session(self):
+        bib = session.DatabaseSession(compact=True)
+        bib.open(self.filename)
+        return bib
+
+
+class LazyRemoveEntriesTest(RemoveEntriesTest):
+
+    def open_session(self):
+        bib = session.DatabaseSession()
+        bib.open_lazy(self.filename)
+        return bib
+
+
+class SQLiteRemoveEntriesTest(RemoveEntriesTest):
+
+    def open_session(self):
+        bib = sqlstore.SQLiteSession(os.path.join(self.directory, 'libraries'))
+        bib.open(self.filename)
+        return bib
+
+    def test_rows_are_deleted(self):
+        self.session.remove_entries([u'fynbo'])
+        library = self.session.library
+        for table in ('entries', 'entry_text', 'key_text'):
+            self.assertEqual(library.scalar("SELECT count(*) FROM %s" % table), 2)
+        self.assertEqual(library.keys(), [u'krogager', u'ledoux'])
+
+
+if __name__ == '__main__':
+    unittest.main()
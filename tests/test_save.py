@@ -0,0 +1,140 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import loader
+import session
+import sqlstore
+import workspace
+import writer
+
+text = u'''@string{mnras = {Monthly Notices of the RAS}}
+
+@article{fynbo,
+  author = {{Fynbo}, J.~P.~U. and {Krogager}, J.-K.},
+  title = {Dust in quasar absorbers},
+  journal = mnras,
+  month = aug,
+  pages = "12--" # "20",
+  year = 2011
+}
+
+@article{ledoux,
+  author = {{Ledoux}, C.},
+  title = {Molecular hydrogen in damped absorbers},
+  year = 2003
+}
+'''
+
+
+class RawValuesTest(unittest.TestCase):
+
+    def test_raw_values(self):
+        start, end = writer.SourceFile(text).offsets['fynbo']
+        values = writer.raw_values(text[start:end])
+        self.assertEqual(values['author'], u'{{Fynbo}, J.~P.~U. and {Krogager}, J.-K.}')
+        self.assertEqual(values['journal'], u'mnras')
+        self.assertEqual(values['month'], u'aug')
+        self.assertEqual(values['pages'], u'"12--" # "20"')
+        self.assertEqual(values['year'], u'2011')
+
+    def test_unreadable_fields(self):
+        self.assertEqual(writer.raw_values(u'@misc{key, title = {Open}'), {})
+        self.assertEqual(writer.raw_values(u'@misc{key}'), {})
+
+    def test_splice_keeps_unedited_fields(self):
+        source = writer.SourceFile(text)
+        bib_database = loader.parse_job((u'', text))
+        bib_database.entries['fynbo'].fields['title'] = u'Dust in absorbers'
+        new_text = source.splice(bib_database, set([u'fynbo']))
+        start, end = source.offsets['fynbo']
+        entry_text = new_text[start:end]
+        self.assertIn(u'title = {Dust in absorbers}', entry_text)
+        self.assertIn(u'author = {{Fynbo}, J.~P.~U. and {Krogager}, J.-K.}', entry_text)
+        self.assertIn(u'journal = mnras,', entry_text)
+        self.assertIn(u'month = aug,', entry_text)
+        self.assertIn(u'pages = "12--" # "20",', entry_text)
+        reparsed = loader.parse_job((u'', new_text))
+        self.assertEqual(reparsed.entries['fynbo'].fields['month'], u'August')
+
+
+class SaveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'library.bib')
+        self.write(text)
+        self.session = self.open_session()
+
+    def open_session(self):
+        bib = session.DatabaseSession()
+        bib.open(self.filename)
+        return bib
+
+    def tearDown(self):
+        self.session.clear()
+        shutil.rmtree(self.directory)
+
+    def write(self, new_text):
+        with open(self.filename, 'wb') as bibtex_file:
+            bibtex_file.write(new_text.encode('utf-8'))
+
+    def save(self):
+        self.session.save(self.filename)
+
+    def test_save_edited_entry(self):
+        self.session.update_entry('ledoux', {'year': u'2004'})
+        self.save()
+        saved = loader.read_bibtex(self.filename)
+        self.assertEqual(saved[:saved.index(u'@article{ledoux')], text[:text.index(u'@article{ledoux')])
+        self.assertIn(u'year = {2004}', saved)
+        self.assertIn(u'{{Ledoux}, C.}', saved)
+
+    def test_file_changed_on_disk(self):
+        self.session.update_entry('ledoux', {'year': u'2004'})
+        changed_text = text.replace(u'Dust in quasar', u'Dust and gas in quasar')
+        self.write(changed_text)
+        self.assertRaises(IOError, self.save)
+        self.assertEqual(loader.read_bibtex(self.filename), changed_text)
+
+        # Saving is possible again once the changes were reloaded:
+        self.session.reload_file(self.filename)
+        self.save()
+        saved = loader.read_bibtex(self.filename)
+        self.assertIn(u'Dust and gas in quasar', saved)
+        self.assertIn(u'year = {2004}', saved)
+
+    def test_save_twice(self):
+        self.session.update_entry('ledoux', {'year': u'2004'})
+        self.save()
+        self.session.update_entry('fynbo', {'year': u'2012'})
+        self.save()
+        saved = loader.read_bibtex(self.filename)
+        self.assertIn(u'year = {2004}', saved)
+        self.assertIn(u'year = {2012}', saved)
+
+
+class WorkspaceSaveTest(SaveTest):
+
+    def open_session(self):
+        bib = workspace.Workspace()
+        bib.open(self.filename)
+        return bib
+
+    def save(self):
+        self.session.save()
+
+
+class SQLiteSaveTest(SaveTest):
+
+    def open_session(self):
+        bib = sqlstore.SQLiteSession(os.path.join(self.directory, 'libraries'))
+        bib.open(self.filename)
+        return bib
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: UTF-8 -*-
+
+import unittest
+
+import loader
+import searchindex
+
+text = u'''@article{moller,
+  author = {{M{\\o}ller}, P. and {P{\\'e}roux}, C.},
+  title = {Metal abundances of damped absorbers},
+  journal = {\\mnras},
+  keywords = {quasars: absorption lines},
+  year = 2001
+}
+
+@article{ledoux,
+  author = {{Ledoux}, C.},
+  title = {Molecular hydrogen in damped absorbers},
+  journal = {\\aap},
+  year = 2003
+}
+'''
+
+
+class ContentIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bib_database = loader.parse_job((u'', text))
+        self.index = searchindex.ContentIndex()
+        self.index.build(self.bib_database)
+
+    def test_tokenize(self):
+        self.assertEqual(searchindex.tokenize(u'{M{\\o}ller}, P. and {P{\\\'e}roux}'),
+                         [u'moller', u'p', u'and', u'peroux'])
+        self.assertEqual(searchindex.fold_accents(u'Stra\xdfer Łukasz'), u'Strasser Lukasz')
+
+    def test_search(self):
+        self.assertEqual(self.index.search({'author': u'moller'}), set([u'moller']))
+        self.assertEqual(self.index.search({'author': u'Peroux'}), set([u'moller']))
+        self.assertEqual(self.index.search({'title': u'damp absorb'}), set([u'moller', u'ledoux']))
+        self.assertEqual(self.index.search({'title': u'absorbers metal'}), set([u'moller']))
+        self.assertEqual(self.index.search({'title': u'damped', 'author': u'ledoux'}),
+                         set([u'ledoux']))
+        self.assertEqual(self.index.search({'title': u'damped hydrogen', 'author': u'moller'}),
+                         set())
+        self.assertEqual(self.index.search({'keyword': u'quasars'}), set([u'moller']))
+        self.assertEqual(self.index.search({'title': u'  '}), set([u'moller', u'ledoux']))
+        self.assertEqual(self.index.search({'colour': u'red'}), set())
+
+    def test_journal(self):
+        # Both the macro and the journal name are indexed:
+        self.assertEqual(self.index.search({'journal': u'mnras'}), set([u'moller']))
+        self.assertEqual(self.index.search({'journal': u'aap'}), set([u'ledoux']))
+        self.assertEqual(self.index.search({'journal': u'A&A'}), set([u'ledoux']))
+
+    def test_remove_and_update(self):
+        self.assertEqual(self.index.field_counts['keywords'], 1)
+        self.index.remove_entry(u'moller')
+        self.assertNotIn(u'metal', self.index.vocabulary('title'))
+        self.assertNotIn(u'peroux', self.index.postings['author'])
+        self.assertEqual(self.index.field_counts['keywords'], 0)
+        self.assertEqual(self.index.search({'title': u'damped'}), set([u'ledoux']))
+        self.index.remove_entry(u'moller')
+
+        bib_entry = self.bib_database.entries[u'ledoux']
+        bib_entry.fields['title'] = u'Metal-poor absorbers'
+        self.index.update_entry(u'ledoux', bib_entry)
+        self.assertEqual(self.index.search({'title': u'metal'}), set([u'ledoux']))
+        self.assertEqual(self.index.search({'title': u'hydrogen'}), set())
+        self.assertEqual(self.index.field_lengths['title'], 3)
+
+    def test_load_tokens(self):
+        index = searchindex.ContentIndex()
+        index.load_tokens(self.index.entry_tokens)
+        self.assertEqual(index.postings, self.index.postings)
+        self.assertEqual(index.field_lengths, self.index.field_lengths)
+        self.assertEqual(index.prefix_tokens('title', u'ab'), [u'absorbers', u'abundances'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+# -*- coding: UTF-8 -*-
+
+import random
+import unittest
+
+from pylatexenc import latex2text
+
+import benchmark
+import texconvert
+
+
+class CorpusTest(unittest.TestCase):
+    """ The fast conversion must give the same text as pylatexenc. """
+
+    def check(self, texts):
+        for text in texts:
+            self.assertEqual(texconvert.latex2text(text), latex2text.latex2text(text), text)
+
+    def test_corpus(self):
+        texts = benchmark.latex_corpus()
+        self.check(texts)
+
+    def test_author_lists(self):
+        rng = random.Random(1)
+        names = list()
+        for _ in range(200):
+            names.extend(benchmark.make_authors(rng, benchmark.latex_surnames,
+                                                benchmark.latex_initials))
+        self.check([name for name in names if u'\\' in name])
+
+    def test_fast_path(self):
+        self.assertEqual(texconvert.fast_latex2text(u'{\\"o}rsted \\AA{}berg'), u'\xf6rsted \xc5berg')
+        self.assertIsNotNone(texconvert.fast_latex2text(u'J.~P.~U. Fynbo'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pybtex.exceptions import PybtexError
+
+import session
+import watcher
+import workspace
+
+text = u'''@article{fynbo,
+  author = {{Fynbo}, J.~P.~U.},
+  title = {Dust in quasar absorbers},
+  year = 2011
+}
+
+@article{ledoux,
+  author = {{Ledoux}, C.},
+  title = {Molecular hydrogen in damped absorbers},
+  year = 2003
+}
+'''
+
+# The second entry is removed, and a comma is missing after the changed title:
+first_entry = text[:text.index(u'@article{ledoux')]
+broken_text = first_entry.replace(u'{Dust in quasar absorbers},', u'{Dust in absorbers}')
+fixed_text = first_entry.replace(u'{Dust in quasar absorbers}', u'{Dust in absorbers}')
+
+
+class ReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'library.bib')
+        self.write(text)
+        self.session = self.open_session()
+
+    def open_session(self):
+        bib = session.DatabaseSession()
+        bib.open(self.filename)
+        return bib
+
+    def tearDown(self):
+        self.session.clear()
+        shutil.rmtree(self.directory)
+
+    def write(self, new_text):
+        with open(self.filename, 'wb') as bibtex_file:
+            bibtex_file.write(new_text.encode('utf-8'))
+
+    def test_reload(self):
+        self.write(fixed_text + u'\n@misc{new, title = {New}}\n')
+        changes = self.session.reload_file(self.filename)
+        self.assertEqual((changes.added, changes.removed, changes.changed),
+                         (set([u'new']), set([u'ledoux']), set([u'fynbo'])))
+        self.assertEqual(self.session.entryID_list, [u'fynbo', u'new'])
+        self.assertEqual(self.session.search_content({'title': u'quasar'}), [])
+
+    def test_reload_broken_file(self):
+        self.write(broken_text)
+        self.assertRaises(PybtexError, self.session.reload_file, self.filename)
+        self.assertEqual(self.session.entryID_list, [u'fynbo', u'ledoux'])
+        self.assertEqual(self.session.search_content({'title': u'quasar'}), [u'fynbo'])
+
+        # Retried once the file is written completely:
+        self.write(fixed_text)
+        changes = self.session.reload_file(self.filename)
+        self.assertEqual((changes.removed, changes.changed), (set([u'ledoux']), set([u'fynbo'])))
+        self.assertEqual(self.session.entryID_list, [u'fynbo'])
+        self.assertEqual(self.session.search_content({'title': u'dust'}), [u'fynbo'])
+        self.assertEqual(self.session.search_content({'title': u'quasar'}), [])
+
+
+class WorkspaceReloadTest(ReloadTest):
+
+    def open_session(self):
+        bib = workspace.Workspace()
+        bib.open(self.filename)
+        return bib
+
+
+class InotifyWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            self.watcher = watcher.InotifyWatcher()
+        except (OSError, AttributeError):
+            self.skipTest("inotify is not available")
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.directory)
+
+    def test_clear_removes_watches(self):
+        filename = os.path.join(self.directory, 'library.bib')
+        for _ in range(3):
+            self.watcher.clear()
+            self.watcher.add(filename)
+            self.assertEqual(len(self.watcher.directories), 1)
+        with open(filename, 'w') as bibtex_file:
+            bibtex_file.write('@misc{new}\n')
+        self.assertEqual(self.watcher.changed(), [filename])
+        self.watcher.remove(filename)
+        self.assertEqual(self.watcher.directories, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pybtex.database import BibliographyData, Entry
+
+import dbcache
+import loader
+import workspace
+
+first_text = u'''@preamble{"\\newcommand{\\noop}[1]{}"}
+
+@article{fynbo,
+  author = {{Fynbo}, J.~P.~U.},
+  title = {Dust in quasar absorbers},
+  doi = {10.1093/mnras/stv1146},
+  year = 2011
+}
+
+@article{ledoux,
+  author = {{Ledoux}, C.},
+  title = {Molecular hydrogen in damped absorbers},
+  year = 2003
+}
+'''
+
+second_text = u'''@article{Fynbo2011,
+  author = {Fynbo, J. P. U.},
+  title = {Dust in quasar absorbers},
+  doi = {https://doi.org/10.1093/MNRAS/STV1146},
+  year = 2011
+}
+
+@article{ledoux,
+  author = {{Ledoux}, C.},
+  title = {Another paper},
+  year = 2006
+}
+
+@article{krogager,
+  author = {{Krogager}, J.-K.},
+  title = {Dusty quasar hosts},
+  eprint = {1505.01234},
+  year = 2015
+}
+'''
+
+
+class WorkspaceTest(unittest.TestCase):
+    compact = False
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.first = self.write('first.bib', first_text)
+        self.second = self.write('second.bib', second_text)
+        self.workspace = workspace.Workspace(self.compact)
+        self.workspace.open(self.first)
+        self.workspace.add_file(self.second)
+
+    def tearDown(self):
+        self.workspace.clear()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'wb') as bibtex_file:
+            bibtex_file.write(text.encode('utf-8'))
+        return filename
+
+    def test_merged_view(self):
+        self.assertEqual(self.workspace.entryID_list, [u'fynbo', u'krogager', u'ledoux'])
+        source = self.workspace.files[self.second]
+        self.assertEqual(source.duplicates, [(u'Fynbo2011', u'fynbo')])
+        self.assertEqual(source.conflicts, [u'ledoux'])
+        self.assertEqual(self.workspace.source_of(u'krogager'), self.second)
+        self.assertEqual(self.workspace.source_of(u'ledoux'), self.first)
+        self.assertEqual(self.workspace.search_content({'title': u'hydrogen'}), [u'ledoux'])
+        self.assertEqual(len(self.workspace.bib_database._preamble), 1)
+        self.assertIn(u'is a duplicate of fynbo', self.workspace.report())
+
+    def test_reopen_from_cache(self):
+        self.workspace.open(self.first)
+        self.assertIsNotNone(dbcache.load_cache(self.first))
+        self.workspace.open(self.first)
+        self.assertEqual(self.workspace.entryID_list, [u'fynbo', u'ledoux'])
+        self.assertEqual(self.workspace.files[self.first].preamble, self.workspace.bib_database._preamble)
+        self.assertEqual(self.workspace.search_content({'author': u'fynbo'}), [u'fynbo'])
+
+    def test_edited_identifier(self):
+        self.workspace.update_entry('fynbo', {'doi': u'10.1000/changed'})
+        third = self.write('third.bib', second_text.replace(u'ledoux', u'other'))
+        self.workspace.add_file(third)
+        # The entry with the old DOI is no longer a duplicate:
+        self.assertIn(u'Fynbo2011', self.workspace.entryID_list)
+        self.assertEqual(self.workspace.files[third].duplicates, [(u'krogager', u'krogager')])
+
+    def test_add_entries_with_skipped_key(self):
+        bib_database = BibliographyData()
+        bib_database.add_entry(u'Fynbo2011', Entry('article', fields={'title': u'Fetched'}))
+        bib_database.add_entry(u'new', Entry('article', fields={'title': u'Fetched'}))
+        self.assertEqual(self.workspace.add_entries(bib_database), [u'new'])
+        self.assertEqual(self.workspace.source_of(u'new'), self.second)
+
+    def test_save_to_source_files(self):
+        self.workspace.update_entry('krogager', {'year': u'2016'})
+        self.workspace.update_entry('ledoux', {'year': u'2004'})
+        self.workspace.save()
+        self.assertIn(u'year = {2016}', loader.read_bibtex(self.second))
+        self.assertIn(u'year = {2004}', loader.read_bibtex(self.first))
+        self.assertIn(u'year = 2006', loader.read_bibtex(self.second))
+
+    def test_remove_file(self):
+        self.workspace.remove_file(self.first)
+        self.assertEqual(self.workspace.entryID_list, [u'krogager'])
+        self.assertEqual(self.workspace.bib_database._preamble, [])
+
+
+class CompactWorkspaceTest(WorkspaceTest):
+    compact = True
+
+
+if __name__ == '__main__':
+    unittest.main()
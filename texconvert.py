@@ -0,0 +1,123 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Fast conversion of the LaTeX found in BibTeX names to Unicode.
+    ADS author lists only use a few accent and letter macros, e.g.
+    '{M{\\o}ller}', '{P{\\'e}roux}' or '{Fria{\\c c}a}'. These are converted
+    by one pass of a precompiled pattern with tables of the accented
+    letters, giving the same text as pylatexenc, spaces included. Text
+    with anything else (math, other macros, comments, quotes) is passed
+    to pylatexenc. `python benchmark.py latex` checks both agree on a
+    corpus of names and macros and times them.
+"""
+
+import re
+import unicodedata
+
+import instrument
+
+__author__ = 'Jens-Kristian Krogager'
+
+# Accent macro -> combining character:
+accents = {u"'": u'\u0301', u'`': u'\u0300', u'^': u'\u0302', u'"': u'\u0308',
+           u'~': u'\u0303', u'=': u'\u0304', u'.': u'\u0307', u'u': u'\u0306',
+           u'v': u'\u030c', u'H': u'\u030b', u'c': u'\u0327', u'k': u'\u0328',
+           u'b': u'\u0331', u'd': u'\u0323', u'r': u'\u030a'}
+
+# Letter macros, and the base letter used when they are accented:
+letters = {u'o': u'\xf8', u'O': u'\xd8', u'l': u'\u0142', u'L': u'\u0141',
+           u'ss': u'\xdf', u'ae': u'\xe6', u'AE': u'\xc6', u'oe': u'\u0153',
+           u'OE': u'\u0152', u'aa': u'\xe5', u'AA': u'\xc5', u'i': u'\u0131',
+           u'j': u'\u0237'}
+accent_bases = {u'i': u'i', u'j': u'j', u'o': u'\xf8', u'O': u'\xd8'}
+
+escaped = {u'&': u'&', u'%': u'%', u'_': u'_', u'#': u'#', u'{': u'{', u'}': u'}'}
+
+_body = r'(?:\\(?P<{0}macro>[ijoO])(?![A-Za-z])\s*|(?P<{0}char>[A-Za-z]))'
+# Like pylatexenc, spaces between two macros or groups are dropped: '{a} {b}' -> 'ab'
+_gap = r'(?:\s+(?=[{}\\]|\Z))?'
+latex_pattern = re.compile(
+    # Symbol accents take an argument after optional spaces: \'e, \' e, \'{e}, \'\i
+    r"""(?:\\(?P<symbol>['`^"~=.])\s*(?:%s|\{\s*(?:%s\s*)?\})"""
+    # Letter accents need a space or braces: \c c, \c{c}
+    r'|\\(?P<letter>[uvHckbdr])(?:\s+%s|\s*\{\s*(?:%s\s*)?\})'
+    r'|\\(?P<name>ss|ae|AE|oe|OE|aa|AA|[oOlLij])(?![A-Za-z])(?:\{\})?'
+    r'|\\(?P<escaped>[&%%_#{}])'
+    r'|[{}])%s|~|^\s+(?=[{\\])|\s+\Z' % (_body.format('s1'), _body.format('s2'), _body.format('l1'), _body.format('l2'), _gap))
+
+# Text which pylatexenc changes in other ways: math, comments, quotes and paragraphs.
+fallback_pattern = re.compile(r"(?<!\\)[$%]|``|''|\n\s*\n")
+
+_accented = dict()
+
+
+def accented(accent, base):
+    """ The composed character of `base` with an accent macro, e.g. ("'", "e") -> u'é'. """
+    try:
+        return _accented[(accent, base)]
+    except KeyError:
+        char = unicodedata.normalize('NFC', base + accents[accent])
+        _accented[(accent, base)] = char
+        return char
+
+
+def replacement(match):
+    """ Unicode text of one match of latex_pattern. """
+    groups = match.groupdict()
+    accent = groups['symbol'] or groups['letter']
+    if accent:
+        prefix = 's' if groups['symbol'] else 'l'
+        for part in ('1', '2'):
+            macro = groups[prefix + part + 'macro']
+            char = groups[prefix + part + 'char']
+            if macro:
+                return accented(accent, accent_bases[macro])
+            if char:
+                return accented(accent, char)
+        # Accent of an empty group: \'{}
+        return u''
+    if groups['name']:
+        return letters[groups['name']]
+    if groups['escaped']:
+        return escaped[groups['escaped']]
+    return u' ' if match.group() == u'~' else u''
+
+
+# Matched text -> replacement, the same macros occur again and again:
+_replacements = dict()
+
+
+def _replace(match):
+    text = match.group()
+    try:
+        return _replacements[text]
+    except KeyError:
+        result = replacement(match)
+        if len(_replacements) < 10000:
+            _replacements[text] = result
+        return result
+
+
+def fast_latex2text(text):
+    """
+    Unicode text of `text` if it only uses the accent and letter macros,
+    else None. Grouping braces are removed and '~' is a space.
+    """
+    if fallback_pattern.search(text):
+        return None
+    result = latex_pattern.sub(_replace, text)
+    # Any other macro is left with its backslash:
+    if u'\\' in result:
+        return None
+    return result
+
+
+def latex2text(text):
+    """ Convert LaTeX to Unicode text, with pylatexenc if the fast conversion does not apply. """
+    result = fast_latex2text(text)
+    if result is None:
+        # pylatexenc is slow to import, load it only when needed:
+        from pylatexenc import latex2text as pylatexenc_latex2text
+        result = pylatexenc_latex2text.latex2text(text)
+        instrument.count('latex2text.calls')
+    return result
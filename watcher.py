@@ -0,0 +1,241 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Watch opened BibTeX files for changes made by other programs and find
+    the entries which were added, removed or changed.
+    On Linux the files are watched with inotify (through ctypes), elsewhere
+    their size and modification time are polled. Both watchers are checked
+    by calling changed(), e.g. from a timer, and never block.
+    Files are compared entry by entry using a hash of the text of each
+    entry, so only the entries which differ have to be parsed again.
+"""
+
+import os
+import struct
+
+import loader
+
+__author__ = 'Jens-Kristian Krogager'
+
+
+class FileChanges(object):
+    """ Keys added, removed and changed in a new version of a file. """
+
+    def __init__(self, added=(), removed=(), changed=()):
+        self.added = set(added)
+        self.removed = set(removed)
+        self.changed = set(changed)
+        # Keys with unsaved edits which were not replaced by the file version:
+        self.conflicts = set()
+
+    def __nonzero__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def summary(self):
+        message = "%i added, %i removed, %i changed" % (len(self.added), len(self.removed),
+                                                        len(self.changed))
+        if self.conflicts:
+            message += ", %i kept with unsaved edits" % len(self.conflicts)
+        return message
+
+
+def entry_hashes(text):
+    """
+    Return a dictionary of key -> hash of the entry text, and the list of
+    @string and @preamble commands in `text`. Only the first of repeated
+    keys is used, as by pybtex.
+    """
+    hashes = dict()
+    macros = list()
+    for entry_type, key, start, end in loader.scan_entries(text):
+        if key is None:
+            if entry_type.lower() in ('string', 'preamble'):
+                macros.append(text[start:end])
+        elif key not in hashes:
+            hashes[key] = hash(text[start:end])
+    return hashes, macros
+
+
+def diff_entries(old_text, new_text):
+    """ Compare two versions of a BibTeX file. Returns a FileChanges. """
+    old_hashes, old_macros = entry_hashes(old_text)
+    new_hashes, new_macros = entry_hashes(new_text)
+    old_keys = set(old_hashes)
+    new_keys = set(new_hashes)
+    common = old_keys & new_keys
+    if old_macros != new_macros:
+        # The value of any entry may depend on the @string macros:
+        changed = common
+    else:
+        changed = set(key for key in common if old_hashes[key] != new_hashes[key])
+    return FileChanges(new_keys - old_keys, old_keys - new_keys, changed)
+
+
+def parse_entries(text, keys):
+    """
+    Parse only the entries of `keys` in `text`, with all @string macros of
+    the file. Raises PybtexError, or KeyError if an entry was skipped.
+    """
+    keys = set(keys)
+    macros = list()
+    positions = dict()
+    for entry_type, key, start, end in loader.scan_entries(text):
+        if key is None:
+            if entry_type.lower() == 'string':
+                macros.append(text[start:end])
+        elif key in keys and key not in positions:
+            positions[key] = (start, end)
+    chunk = u'\n'.join(text[start:end] for start, end in sorted(positions.values()))
+    parsed = loader.parse_job((u'\n'.join(macros), chunk))
+    for key in positions:
+        if key not in parsed.entries:
+            raise KeyError("Cannot parse entry: %s" % key)
+    return parsed
+
+
+class PollingWatcher(object):
+    """ Detect changes of files from their size and modification time. """
+
+    def __init__(self):
+        self.files = dict()
+        self.pending = dict()
+
+    def stat(self, filename):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime)
+
+    def add(self, filename):
+        filename = os.path.abspath(filename)
+        self.files[filename] = self.stat(filename)
+
+    def remove(self, filename):
+        filename = os.path.abspath(filename)
+        self.files.pop(filename, None)
+        self.pending.pop(filename, None)
+
+    def clear(self):
+        self.files.clear()
+        self.pending.clear()
+
+    def changed(self):
+        """ Return the list of files changed since the last call. """
+        changed = list()
+        for filename, last_stat in self.files.items():
+            stat = self.stat(filename)
+            if stat == last_stat or stat is None:
+                self.pending.pop(filename, None)
+                continue
+            # Only report files which did not change since the previous check,
+            # so a file being written is not read half way:
+            if self.pending.get(filename) == stat:
+                del self.pending[filename]
+                self.files[filename] = stat
+                changed.append(filename)
+            else:
+                self.pending[filename] = stat
+        return changed
+
+    def close(self):
+        self.clear()
+
+
+class InotifyWatcher(object):
+    """
+    Detect changes of files with the Linux inotify API. The directory of
+    each file is watched, so files replaced by a rename (as by most
+    editors, git and PyBib itself) are detected as well.
+    Raises OSError if inotify is not available.
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_NONBLOCK = 0x800
+    IN_CLOEXEC = 0x80000
+    event_header = struct.Struct('iIII')
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = dict()
+        self.files = set()
+
+    def add(self, filename):
+        filename = os.path.abspath(filename)
+        self.files.add(filename)
+        directory = os.path.dirname(filename)
+        if directory in self.directories.values():
+            return
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        wd = self.libc.inotify_add_watch(self.fd, directory.encode('utf-8'), mask)
+        if wd < 0:
+            raise OSError("Cannot watch directory: %s" % directory)
+        self.directories[wd] = directory
+
+    def remove(self, filename):
+        filename = os.path.abspath(filename)
+        self.files.discard(filename)
+        directory = os.path.dirname(filename)
+        if not any(os.path.dirname(name) == directory for name in self.files):
+            for wd, watched in self.directories.items():
+                if watched == directory:
+                    self.remove_watch(wd)
+
+    def remove_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+        del self.directories[wd]
+
+    def clear(self):
+        for wd in self.directories.keys():
+            self.remove_watch(wd)
+        self.files.clear()
+
+    def read_events(self):
+        """ Yield the full path of every file named in the pending events. """
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:
+                # EAGAIN: no more events
+                return
+            position = 0
+            while position < len(data):
+                wd, mask, cookie, length = self.event_header.unpack_from(data, position)
+                position += self.event_header.size
+                name = data[position:position + length].rstrip(b'\0')
+                position += length
+                if wd in self.directories and name:
+                    yield os.path.join(self.directories[wd], name.decode('utf-8'))
+
+    def changed(self):
+        """ Return the list of files changed since the last call. """
+        changed = list()
+        for filename in self.read_events():
+            if filename in self.files and filename not in changed:
+                changed.append(filename)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        self.directories.clear()
+
+
+def file_watcher():
+    """ Return an InotifyWatcher if possible, otherwise a PollingWatcher. """
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError):
+        return PollingWatcher()
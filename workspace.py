@@ -0,0 +1,350 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Several BibTeX files opened together as one searchable database.
+    A Workspace is a DatabaseSession whose entries come from any number of
+    files. The entries are stored once, in the merged database; each file
+    keeps its keys and original text, and every entry remembers the file
+    it came from, so
+    edits are saved back to the right file. Entries with the DOI, eprint
+    or ADS bibcode of an entry from another file are not added twice, and
+    adding a file only indexes its new entries.
+"""
+
+import os
+from collections import OrderedDict
+
+import columns
+import duplicates
+import instrument
+import session
+
+__author__ = 'Jens-Kristian Krogager'
+
+
+class SourceDatabase(object):
+    """ One opened file: its original text, preamble and the keys it adds to the workspace. """
+
+    def __init__(self, filename, info):
+        self.filename = filename
+        self.info = info
+        self.source_file = None
+        self.preamble = list()
+        self.keys = list()
+        # Lower case keys of all entries of the file, including those not added:
+        self.file_keys = set()
+        # (key, key of the entry it duplicates) of entries not added to the workspace:
+        self.duplicates = list()
+        # Keys already used by an unrelated entry of another file:
+        self.conflicts = list()
+
+
+class Workspace(session.DatabaseSession):
+    """
+    Merged view of several BibTeX files. open() replaces all files by one,
+    add_file() adds another. For loading in the background, call
+    begin_file(), then add_batch() for each parsed chunk and finish_loading().
+    """
+
+    def __init__(self, compact=False):
+        super(Workspace, self).__init__(compact)
+        self.files = OrderedDict()
+        self.provenance = dict()
+        self.duplicate_index = duplicates.DuplicateIndex()
+        self.current_file = None
+
+    def clear(self):
+        super(Workspace, self).clear()
+        self.files = OrderedDict()
+        self.provenance = dict()
+        self.duplicate_index.clear()
+        self.current_file = None
+
+    # -- Loading:
+    @instrument.traced('workspace.open')
+    def open(self, filename, processes=1):
+        self.clear()
+        self.add_file(filename, processes)
+
+    @instrument.traced('workspace.add_file')
+    def add_file(self, filename, processes=1):
+        """ Add the entries of `filename`. Returns the list of keys added to the workspace. """
+        if self.begin_file(filename):
+            return list(self.current_file.keys)
+
+        import loader
+        import writer
+        text = loader.read_bibtex(filename)
+        if processes == 1:
+            batches = loader.iter_batches(text)
+        else:
+            batches = loader.iter_batches_parallel(text, processes)
+        for chunk_database, end in batches:
+            self.add_batch(chunk_database)
+        self.finish_loading(writer.SourceFile(text))
+        return list(self.current_file.keys)
+
+    @instrument.traced('workspace.open_cached')
+    def open_cached(self, filename):
+        self.clear()
+        return self.begin_file(filename)
+
+    def open_lazy(self, filename):
+        filename = os.path.abspath(filename)
+        super(Workspace, self).open_lazy(filename)
+        self.current_file = SourceDatabase(filename, self.database_info)
+        self.current_file.keys = self.bib_database.entries.keys()
+        self.current_file.file_keys = set(key.lower() for key in self.current_file.keys)
+        self.current_file.preamble = list(self.bib_database._preamble)
+        self.files[filename] = self.current_file
+        self.provenance = dict.fromkeys(self.current_file.keys, filename)
+
+    def begin_file(self, filename):
+        """
+        Start adding `filename` and load it from the binary cache if possible.
+        Returns False if there is no valid cache, in which case the file must
+        be parsed and passed to add_batch() and finish_loading().
+        """
+        import dbcache
+        filename = os.path.abspath(filename)
+        if filename in self.files:
+            self.remove_file(filename)
+        # Duplicates can only be found among indexed entries:
+        self.ensure_indexed()
+
+        info = dbcache.file_info(filename)
+        self.current_file = SourceDatabase(filename, info)
+        self.files[filename] = self.current_file
+        self.database_file = filename
+        self.database_info = info if len(self.files) == 1 else None
+        self.source_file = None
+
+        cached = dbcache.load_cache(filename, info, self.new_database())
+        if cached is None:
+            return False
+
+        cached_columns = columns.FieldColumns()
+        cached_columns.set_state(cached['columns'])
+        self.merge_entries(cached['bib_database'], cached['entry_tokens'], cached_columns)
+        self.key_filter.add_keys(self.current_file.keys)
+        self.entryID_list = self.key_filter.keys
+        return True
+
+    @instrument.traced('workspace.add_batch')
+    def add_batch(self, chunk_database):
+        """ Add the entries of a parsed chunk of the current file. Returns the list of added keys. """
+        return self.merge_entries(chunk_database)
+
+    def merge_entries(self, bib_database, entry_tokens=None, cached_columns=None):
+        """
+        Add the entries of `bib_database` from the current file to the workspace.
+        Duplicates of entries from other files and keys used by another file
+        are only recorded. Keys which the file already has are skipped, the
+        first entry of a repeated key is kept as by pybtex. `entry_tokens`
+        and `cached_columns` are the index data of a cached file, used
+        instead of normalizing the entries again.
+        """
+        source = self.current_file
+        added = list()
+        self.bib_database.add_to_preamble(*bib_database._preamble)
+        source.preamble.extend(bib_database._preamble)
+        for key, bib_entry in bib_database.entries.items():
+            if key.lower() in source.file_keys:
+                continue
+            source.file_keys.add(key.lower())
+            original = self.duplicate_index.find(bib_entry)
+            if original is not None and self.provenance[original] != source.filename:
+                source.duplicates.append((key, original))
+                continue
+            if key in self.bib_database.entries:
+                source.conflicts.append(key)
+                continue
+
+            self.bib_database.add_entry(key, bib_entry)
+            self.provenance[key] = source.filename
+            if cached_columns is not None:
+                self.duplicate_index.add_entry(key, bib_entry)
+                self.columns.copy_entry(key, cached_columns)
+                self.content_index.add_tokens(key, entry_tokens[key])
+                self.query_engine.add_entry(key, bib_entry)
+            else:
+                self.index_entry(key, bib_entry)
+            added.append(key)
+        source.keys.extend(added)
+        return added
+
+    def index_entry(self, key, bib_entry):
+        self.duplicate_index.add_entry(key, bib_entry)
+        super(Workspace, self).index_entry(key, bib_entry)
+
+    def reindex_entry(self, entryID):
+        super(Workspace, self).reindex_entry(entryID)
+        # The DOI, eprint or ADS URL may have been edited:
+        self.duplicate_index.update_entry(entryID, self.bib_database.entries[entryID])
+
+    def add_entries(self, bib_database):
+        """ Add entries (e.g., fetched by fetch.py) to the current file, see DatabaseSession.add_entries(). """
+        from pybtex.database import BibliographyData
+        new_entries = BibliographyData()
+        for key, bib_entry in bib_database.entries.items():
+            # Keys of duplicates and conflicts of the file are not in the merged database:
+            if key.lower() not in self.current_file.file_keys:
+                new_entries.add_entry(key, bib_entry)
+        return super(Workspace, self).add_entries(new_entries)
+
+    @instrument.traced('workspace.finish_loading')
+    def finish_loading(self, source_file=None, write_cache=True):
+        """ Index the keys of the current file and update its binary cache. """
+        source = self.current_file
+        source.source_file = source_file
+        if len(self.files) == 1:
+            self.source_file = source_file
+        self.key_filter.add_keys(source.keys)
+        self.entryID_list = self.key_filter.keys
+
+        if write_cache:
+            self.write_cache()
+
+    def write_cache(self):
+        """ Update the binary cache of the current file. """
+        import dbcache
+        source = self.current_file
+        # The cache can only be written if all entries of the file were indexed:
+        if source.duplicates or source.conflicts:
+            return
+        entry_tokens = dict((key, self.content_index.entry_tokens[key]) for key in source.keys)
+        dbcache.save_cache(source.filename, self.bib_database, entry_tokens, source.info,
+                           self.columns.subset_state(source.keys), source.keys, source.preamble)
+
+    def remove_entries(self, keys):
+        for key in keys:
+            self.duplicate_index.remove_entry(key)
+            self.provenance.pop(key, None)
+        super(Workspace, self).remove_entries(keys)
+
+    @instrument.traced('workspace.remove_file')
+    def remove_file(self, filename):
+        """ Remove the entries of an opened file (e.g., if loading was cancelled). """
+        source = self.files.pop(os.path.abspath(filename), None)
+        if source is None:
+            return
+        self.remove_entries(source.keys)
+        self.bib_database._preamble = list()
+        for other in self.files.values():
+            self.bib_database.add_to_preamble(*other.preamble)
+        if self.current_file is source:
+            self.current_file = None
+
+    # -- Reloading:
+    def load_source(self, source):
+        """ Read the original text of `source` if it is unchanged on disk. Returns the SourceFile or None. """
+        import dbcache
+        import writer
+        if source.source_file is None:
+            if dbcache.file_info(source.filename)['sha1'] == source.info['sha1']:
+                source.source_file = writer.SourceFile.from_file(source.filename)
+        return source.source_file
+
+    def watched_files(self):
+        return [source.filename for source in self.files.values()
+                if self.load_source(source) is not None]
+
+    @instrument.traced('workspace.reload_file')
+    def reload_file(self, filename=None):
+        """
+        Apply the changes made to an opened file by another program. Removed
+        and changed entries of the file are taken out of the workspace and
+        the changed and added ones are merged again, with the same duplicate
+        checks as when the file was added. If the new entries cannot be
+        parsed, the error is raised before the workspace is changed.
+        """
+        import dbcache
+        import loader
+        import watcher
+        import writer
+        if filename is None:
+            filename = self.database_file
+        source = self.files.get(os.path.abspath(filename))
+        if source is None or source.source_file is None:
+            return None
+
+        text = loader.read_bibtex(source.filename)
+        changes = watcher.diff_entries(source.source_file.text, text)
+        if changes:
+            in_view = set(source.keys)
+            modified = changes.changed | changes.removed
+            changes.conflicts = modified & self.dirty_entries & in_view
+            dropped = modified - changes.conflicts
+            parsed = watcher.parse_entries(text, (changes.added | changes.changed) - changes.conflicts)
+            self.remove_entries(dropped & in_view)
+            source.keys = [key for key in source.keys if key not in dropped]
+            source.duplicates = [(key, original) for key, original in source.duplicates
+                                 if key not in dropped]
+            source.conflicts = [key for key in source.conflicts if key not in dropped]
+            source.file_keys -= set(key.lower() for key in dropped)
+
+            self.current_file = source
+            added = self.merge_entries(parsed)
+            self.key_filter.add_keys(added)
+            self.entryID_list = self.key_filter.keys
+            self.edit_journal.forget(dropped)
+
+        source.source_file = writer.SourceFile(text)
+        source.info = dbcache.file_info(source.filename)
+        return changes
+
+    def source_of(self, key):
+        """ Return the file name the entry of `key` was loaded from. """
+        return self.provenance.get(key)
+
+    def report(self):
+        """ Text summary of the opened files, duplicates and conflicting keys. """
+        lines = list()
+        for source in self.files.values():
+            lines.append(u"%s: %i entries" % (source.filename, len(source.keys)))
+            for key, original in source.duplicates:
+                lines.append(u"  %s is a duplicate of %s" % (key, original))
+            for key in source.conflicts:
+                lines.append(u"  %s is already used by another file" % key)
+        return u'\n'.join(lines)
+
+    # -- Saving:
+    @instrument.traced('workspace.save')
+    def save(self, filename=None):
+        """
+        Without `filename`, write the edited entries back to the files they
+        were loaded from. Otherwise write the merged database to `filename`.
+        Raises IOError or OSError if a file cannot be written, or if it was
+        changed by another program and not reloaded yet.
+        """
+        import dbcache
+        import writer
+        if filename is not None and len(self.files) == 1:
+            source = self.files.values()[0]
+            self.database_file = source.filename
+            self.database_info = source.info
+            self.source_file = source.source_file
+            super(Workspace, self).save(filename)
+            source.source_file = self.source_file
+            source.info = self.database_info
+            source.filename = self.database_file
+            self.files = OrderedDict([(source.filename, source)])
+            for key in source.keys:
+                self.provenance[key] = source.filename
+            return
+
+        if filename is not None:
+            writer.save_full(filename, self.bib_database)
+            return
+
+        for source in self.files.values():
+            dirty_keys = self.dirty_entries.intersection(source.keys)
+            if not dirty_keys:
+                continue
+            # Do not overwrite changes made by another program which were not reloaded yet:
+            if self.load_source(source) is None or not source.source_file.is_current(source.filename):
+                raise IOError("File changed on disk: %s" % source.filename)
+            writer.save_incremental(source.filename, source.source_file, self.bib_database,
+                                    dirty_keys)
+            source.info = dbcache.file_info(source.filename)
+            self.dirty_entries -= dirty_keys
@@ -0,0 +1,276 @@
+# -*- coding: UTF-8 -*-
+
+"""
+    Incremental saving of BibTeX files.
+    The original text of a loaded file is kept together with the position
+    of every entry, so a save only re-formats the modified entries and
+    copies the rest of the file (including comments and formatting) as is.
+    Files are written to a temporary file which then replaces the target.
+"""
+
+import io
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from bisect import bisect_right
+
+import loader
+
+field_name = re.compile(r'\s*([^\s=,{}()"#]+)\s*=\s*')
+bare_value = re.compile(r'[^\s,#{}"]+')
+
+
+def format_entry(key, bib_entry, original=None, values=None):
+    """
+    Return the BibTeX text of a single entry without trailing newline.
+    Values are written verbatim in braces, unlike the pybtex writer which
+    escapes characters such as '%' that are already valid LaTeX.
+    If `original` is the entry as parsed from the file and `values` the
+    text of its values in the file (see raw_values()), the fields which
+    are unchanged are written as in the file, e.g. `month = aug`.
+    """
+    if original is None or values is None:
+        original = None
+        values = dict()
+    persons = list()
+    for role, person_list in bib_entry.persons.items():
+        names = [unicode(person) for person in person_list]
+        if (role.lower() in values and role in original.persons and
+                [unicode(person) for person in original.persons[role]] == names):
+            persons.append((role, values[role.lower()]))
+        else:
+            persons.append((role, u'{%s}' % u' and '.join(names)))
+    fields = list()
+    for field, value in bib_entry.fields.items():
+        if field.lower() in values and original.fields.get(field) == value:
+            fields.append((field, values[field.lower()]))
+        else:
+            fields.append((field, u'{%s}' % value))
+    return format_values(bib_entry.original_type, key, persons + fields)
+
+
+def format_fields(entry_type, key, persons, fields):
+    """
+    Same as format_entry() for plain data: `persons` is a list of (role,
+    list of names) and `fields` a list of (name, value).
+    """
+    values = [(role, u'{%s}' % u' and '.join(names)) for role, names in persons]
+    values += [(field, u'{%s}' % value) for field, value in fields]
+    return format_values(entry_type, key, values)
+
+
+def format_values(entry_type, key, values):
+    """ Entry text of a list of (field name, value text including braces or quotes). """
+    lines = [u'@%s{%s,' % (entry_type, key)]
+    for field, value in values:
+        lines.append(u'    %s = %s,' % (field, value))
+    lines[-1] = lines[-1].rstrip(',')
+    lines.append(u'}')
+    return u'\n'.join(lines)
+
+
+def value_end(text, pos, end):
+    """ Return the end of the braced, quoted or bare value part at `pos`, or -1. """
+    if text.startswith('{', pos):
+        depth = 0
+        for num in xrange(pos, end):
+            if text[num] == '{':
+                depth += 1
+            elif text[num] == '}':
+                depth -= 1
+                if depth == 0:
+                    return num + 1
+        return -1
+    if text.startswith('"', pos):
+        depth = 0
+        for num in xrange(pos + 1, end):
+            char = text[num]
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+            elif char == '"' and depth == 0:
+                return num + 1
+        return -1
+    match = bare_value.match(text, pos, end)
+    return match.end() if match else -1
+
+
+def raw_values(entry_text):
+    """
+    Return a dictionary of lower case field name -> value as written in
+    the text of an entry, e.g. u'aug' or u'{{Fynbo}, J.~P.~U.}'. Returns
+    an empty dictionary if the fields cannot be read.
+    """
+    # The fields follow the key and end before the closing delimiter:
+    pos = entry_text.find(',')
+    end = len(entry_text) - 1
+    values = dict()
+    if pos < 0:
+        return values
+    while True:
+        while pos < end and (entry_text[pos].isspace() or entry_text[pos] == ','):
+            pos += 1
+        if pos >= end:
+            return values
+        match = field_name.match(entry_text, pos, end)
+        if match is None:
+            return dict()
+        start = pos = match.end()
+        while True:
+            pos = value_end(entry_text, pos, end)
+            if pos < 0:
+                return dict()
+            value = entry_text[start:pos]
+            # Parts of a value can be concatenated with '#':
+            while pos < end and entry_text[pos].isspace():
+                pos += 1
+            if not entry_text.startswith('#', pos):
+                break
+            pos += 1
+            while pos < end and entry_text[pos].isspace():
+                pos += 1
+        values[match.group(1).lower()] = value
+
+
+def write_atomic(filename, text, encoding='utf-8'):
+    """ Write `text` to a temporary file in the same directory and rename it to `filename`. """
+    with atomic_file(filename, encoding) as output:
+        output.write(text)
+
+
+@contextmanager
+def atomic_file(filename, encoding='utf-8'):
+    """
+    Context manager giving a text stream to a temporary file in the same
+    directory, which replaces `filename` once the block is done.
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, temp_name = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with io.open(fd, 'w', encoding=encoding, newline='') as output:
+            yield output
+        if os.path.exists(filename):
+            # Keep the permissions of the file being replaced:
+            os.chmod(temp_name, os.stat(filename).st_mode & 0o777)
+        os.rename(temp_name, filename)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
+class SourceFile(object):
+    """ Original text of a BibTeX file and the (start, end) position of each entry. """
+
+    def __init__(self, text):
+        self.text = text
+        self.offsets = dict()
+        for entry_type, key, start, end in loader.scan_entries(text):
+            # pybtex keeps the first of repeated keys:
+            if key is not None and key not in self.offsets:
+                self.offsets[key] = (start, end)
+
+    @classmethod
+    def from_file(cls, filename):
+        return cls(loader.read_bibtex(filename))
+
+    def is_current(self, filename):
+        """ True if `filename` still contains the text, i.e. was not changed by another program. """
+        try:
+            return loader.read_bibtex(filename) == self.text
+        except (IOError, OSError, UnicodeDecodeError):
+            return False
+
+    def original_entries(self, keys):
+        """ Parse the entries of `keys` from the text. Returns an empty dictionary if they cannot be parsed. """
+        from pybtex.exceptions import PybtexError
+        import watcher
+        try:
+            return watcher.parse_entries(self.text, keys).entries
+        except (PybtexError, KeyError):
+            return dict()
+
+    def splice(self, bib_database, dirty_keys):
+        """
+        Return the text of the file with the entries in `dirty_keys` replaced
+        by their current content in `bib_database`. Dirty keys missing from the
+        database are removed and keys missing from the file are appended.
+        Fields which were not edited keep their text in the file.
+        The stored text and offsets are updated to the new text.
+        """
+        replacements = list()
+        new_entries = list()
+        originals = self.original_entries([key for key in dirty_keys
+                                           if key in self.offsets and key in bib_database.entries])
+        for key in dirty_keys:
+            if key in self.offsets:
+                start, end = self.offsets[key]
+                if key in bib_database.entries:
+                    new_text = format_entry(key, bib_database.entries[key], originals.get(key),
+                                            raw_values(self.text[start:end]))
+                else:
+                    new_text = u''
+                replacements.append((start, end, key, new_text))
+            elif key in bib_database.entries:
+                new_entries.append(key)
+        replacements.sort()
+
+        pieces = list()
+        position = 0
+        shifts = list()
+        delta = 0
+        for start, end, key, new_text in replacements:
+            pieces.append(self.text[position:start])
+            pieces.append(new_text)
+            position = end
+            if new_text:
+                self.offsets[key] = (start + delta, start + delta + len(new_text))
+            else:
+                del self.offsets[key]
+            delta += len(new_text) - (end - start)
+            shifts.append((end, delta))
+        pieces.append(self.text[position:])
+
+        if shifts:
+            # Move the offsets of the unchanged entries after each replacement:
+            ends = [end for end, delta in shifts]
+            replaced = set(key for start, end, key, new_text in replacements)
+            for key, (start, end) in self.offsets.items():
+                if key in replaced:
+                    continue
+                num = bisect_right(ends, start)
+                if num:
+                    delta = shifts[num - 1][1]
+                    self.offsets[key] = (start + delta, end + delta)
+
+        length = sum(len(piece) for piece in pieces)
+        for key in sorted(new_entries):
+            new_text = format_entry(key, bib_database.entries[key])
+            if not pieces[-1].endswith('\n'):
+                pieces.append(u'\n')
+                length += 1
+            pieces.append(u'\n' + new_text + u'\n')
+            self.offsets[key] = (length + 1, length + 1 + len(new_text))
+            length += len(new_text) + 2
+
+        self.text = u''.join(pieces)
+        return self.text
+
+
+def save_incremental(filename, source, bib_database, dirty_keys):
+    """
+    Splice the `dirty_keys` into the `source` text and write it to `filename`.
+    If the file cannot be written, `source` keeps its previous text.
+    """
+    text, offsets = source.text, dict(source.offsets)
+    try:
+        write_atomic(filename, source.splice(bib_database, dirty_keys))
+    except BaseException:
+        source.text, source.offsets = text, offsets
+        raise
+
+
+def save_full(filename, bib_database):
+    """ Write the full database formatted by pybtex to `filename`. """
+    write_atomic(filename, bib_database.to_string('bibtex'))